@@ -216,10 +216,58 @@ def cli_cmd_load_directory(args):
     return return_code
 
 
+def cli_cmd_transcribe(args):
+    # Set the logging level.
+    _set_logging_level(args)
+
+    # Import locally so that other commands do not require Kaldi.
+    from dragonfly.engines.backend_kaldi.batch import (read_retain_tsv,
+                                                       transcribe_files)
+
+    # Collect the wave files to transcribe, with the expected text of each
+    # recognition listed in retain.tsv files. Close each file object
+    # created by argparse.
+    files = []
+    for lst in args.inputs:
+        for f in lst:
+            f.close()
+            if f.name.endswith(".tsv"):
+                files.extend(read_retain_tsv(f.name))
+            else:
+                files.append((f.name, None))
+    module_filenames = []
+    for lst in args.modules:
+        for f in lst:
+            f.close()
+            module_filenames.append(f.name)
+
+    try:
+        results, stats = transcribe_files(files, module_filenames,
+                                          args.engine_options,
+                                          args.processes)
+    except EngineError as e:
+        LOG.error(e)
+        return 1
+
+    # Print the results as tab-separated values.
+    for result in results:
+        fields = [result.filename, result.text, result.expected_text,
+                  result.grammar_name, result.rule_name, result.likelihood,
+                  result.error]
+        print(u"\t".join(u"" if field is None else u"%s" % field
+                         for field in fields))
+    if stats["correct"] is not None:
+        LOG.info("Correct: %d/%d", stats["correct"], stats["files"])
+
+    # Return whether all files were transcribed without errors.
+    return 1 if stats["errors"] else 0
+
+
 _COMMAND_MAP = {
     "test": cli_cmd_test,
     "load": cli_cmd_load,
     "load-directory": cli_cmd_load_directory,
+    "transcribe": cli_cmd_transcribe,
 }
 
 
@@ -385,6 +433,34 @@ def make_arg_parser():
         no_recobs_messages_argument, log_level_argument, quiet_argument
     )
 
+    # Create the parser for the "transcribe" command.
+    parser_transcribe = subparsers.add_parser(
+        "transcribe",
+        help="Transcribe wave files with the Kaldi engine using the "
+        "grammars of command modules, without executing any actions, and "
+        "print the recognitions as tab-separated values."
+    )
+    inputs_argument = _build_argument(
+        "inputs", metavar="input", nargs="+", type=_valid_file_or_pattern,
+        help="Wave file(s) to transcribe, or retain.tsv file(s) listing "
+             "retained recognitions to transcribe and compare against."
+    )
+    modules_argument = _build_argument(
+        "-m", "--modules", metavar="module", nargs="+", default=[],
+        type=_valid_file_or_pattern,
+        help="Command module file(s) with the grammars to use."
+    )
+    processes_argument = _build_argument(
+        "-p", "--processes", default=None, type=int,
+        help="Number of worker processes, each with its own decoder. By "
+             "default, this is the number of cores."
+    )
+    _add_arguments(
+        parser_transcribe,
+        inputs_argument, modules_argument, processes_argument,
+        engine_options_argument, log_level_argument, quiet_argument
+    )
+
     # Return the argument parser.
     return parser
 
@@ -31,11 +31,92 @@ from six.moves import queue, range
 import sounddevice
 import webrtcvad
 
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
 from ..base import EngineError
 
 _log = logging.getLogger("engine")
 
 
+class AudioRingBuffer(object):
+    """Fixed-capacity ring of equal-sized audio blocks, preallocated as a single bytearray. The writer (the capture
+    callback) copies each block directly into the next slot, and the reader receives read-only views of the slots,
+    so no objects are allocated per block. A view remains valid until the writer wraps around to its slot; if the
+    reader falls a whole capacity behind, the oldest unread blocks are dropped (counted in ``num_dropped``)."""
+
+    def __init__(self, capacity_blocks, block_size_bytes):
+        self.capacity_blocks = int(capacity_blocks)
+        self.block_size_bytes = int(block_size_bytes)
+        if self.capacity_blocks < 1:
+            raise ValueError("AudioRingBuffer capacity must be at least 1 block")
+        self.num_dropped = 0
+        self._buffer = bytearray(self.capacity_blocks * self.block_size_bytes)
+        self._views = [self._make_view(slot) for slot in range(self.capacity_blocks)]
+        self._write_index = 0  # Total number of blocks written
+        self._read_index = 0  # Total number of blocks read (or dropped)
+        self._condition = threading.Condition()
+
+    def _make_view(self, slot):
+        start = slot * self.block_size_bytes
+        if PY2:
+            return buffer(self._buffer, start, self.block_size_bytes)  # pylint: disable=undefined-variable
+        view = memoryview(self._buffer)[start : start + self.block_size_bytes]
+        if hasattr(view, 'toreadonly'):
+            return view.toreadonly()
+        return None  # Python < 3.8 cannot make read-only views, which webrtcvad requires, so blocks are copied on read
+
+    def write(self, data):
+        """Copies a block of audio data (any bytes-like object, such as the temporary C buffer passed to a stream
+        callback) into the next slot, waking a waiting reader."""
+        if len(data) != self.block_size_bytes:
+            raise ValueError("audio block of %d bytes does not match the ring buffer block size of %d bytes"
+                % (len(data), self.block_size_bytes))
+        with self._condition:
+            if self._write_index - self._read_index >= self.capacity_blocks:
+                # Full: overwrite the oldest unread block
+                self._read_index += 1
+                self.num_dropped += 1
+                if self.num_dropped == 1 or self.num_dropped % 100 == 0:
+                    _log.warning("audio ring buffer overflow: %d blocks dropped", self.num_dropped)
+            start = (self._write_index % self.capacity_blocks) * self.block_size_bytes
+            self._buffer[start : start + self.block_size_bytes] = data
+            self._write_index += 1
+            self._condition.notify()
+
+    def read(self, timeout=None):
+        """Returns a view of the oldest unread block, waiting for one if necessary, for at most timeout seconds if
+        given (0 does not wait). Returns None upon timeout."""
+        with self._condition:
+            if self._read_index == self._write_index:
+                if timeout is not None and timeout <= 0:
+                    return None
+                end_time = (time.time() + timeout) if timeout is not None else None
+                while self._read_index == self._write_index:
+                    remaining = (end_time - time.time()) if end_time is not None else None
+                    if remaining is not None and remaining <= 0:
+                        return None
+                    self._condition.wait(remaining)
+            slot = self._read_index % self.capacity_blocks
+            self._read_index += 1
+            view = self._views[slot]
+            if view is None:
+                start = slot * self.block_size_bytes
+                return bytes(self._buffer[start : start + self.block_size_bytes])
+            return view
+
+    def clear(self):
+        """Discards all unread blocks."""
+        with self._condition:
+            self._read_index = self._write_index
+
+    def __len__(self):
+        """Number of unread blocks."""
+        return self._write_index - self._read_index
+
+
 class MicAudio(object):
     """Streams raw audio from microphone. Data is received in a separate thread, and stored in a buffer, to be read from."""
 
@@ -46,22 +127,30 @@ class MicAudio(object):
     BLOCKS_PER_SECOND = 100
     BLOCK_SIZE_SAMPLES = int(SAMPLE_RATE / float(BLOCKS_PER_SECOND))  # Block size in number of samples
     BLOCK_DURATION_MS = int(1000 * BLOCK_SIZE_SAMPLES // SAMPLE_RATE)  # Block duration in milliseconds
+    BLOCK_SIZE_BYTES = BLOCK_SIZE_SAMPLES * SAMPLE_WIDTH * CHANNELS
+    DEFAULT_BUFFER_S = 30
 
-    def __init__(self, callback=None, buffer_s=0, flush_queue=True, start=True, input_device_index=None, self_threaded=None):
-        self.callback = callback if callback is not None else lambda in_data: self.buffer_queue.put(in_data, block=False)
+    def __init__(self, callback=None, buffer_s=None, flush_queue=True, start=True, input_device_index=None, self_threaded=None):
         self.flush_queue = flush_queue
         self.input_device_index = int(input_device_index) if input_device_index is not None else None
         self.self_threaded = bool(self_threaded)
 
-        self.buffer_queue = queue.Queue(maxsize=(buffer_s * 1000 // self.BLOCK_DURATION_MS))
+        buffer_s = buffer_s or self.DEFAULT_BUFFER_S
+        self.ring_buffer = AudioRingBuffer(max(1, int(buffer_s * 1000 // self.BLOCK_DURATION_MS)), self.BLOCK_SIZE_BYTES)
+        self.callback = callback if callback is not None else self.ring_buffer.write
         self.stream = None
         self.thread = None
+        self._active_event = threading.Event()  # Set while the stream is started, for the reader thread
         self._connect(start=start)
 
     def _connect(self, start=None):
         callback = self.callback
+        if callback == self.ring_buffer.write:
+            write = callback  # Copies directly from the temporary C buffer into the ring buffer
+        else:
+            write = lambda in_data: callback(bytes(in_data))  # Must copy data from temporary C buffer!
         def proxy_callback(in_data, frame_count, time_info, status):
-            callback(bytes(in_data))  # Must copy data from temporary C buffer!
+            write(in_data)
 
         self.stream = sounddevice.RawInputStream(
             samplerate=self.SAMPLE_RATE,
@@ -74,7 +163,7 @@ class MicAudio(object):
         )
 
         if self.self_threaded:
-            self.thread = threading.Thread(target=self._reader_thread, args=(callback,))
+            self.thread = threading.Thread(target=self._reader_thread, args=(write,))
             self.thread.daemon = True
             self.thread.start()
 
@@ -86,44 +175,54 @@ class MicAudio(object):
         _log.info("streaming audio from '%s' using %s: %i sample_rate, %i block_duration_ms, %i latency_ms",
             device_info['name'], hostapi_info['name'], self.stream.samplerate, self.BLOCK_DURATION_MS, int(self.stream.latency*1000))
 
-    def _reader_thread(self, callback):
-        while self.stream and not self.stream.closed:
-            read_available = self.stream.read_available
-            if read_available >= self.stream.blocksize:
-                in_data, overflowed = self.stream.read(self.stream.blocksize)
-                # print('_reader_thread', read_available, len(in_data), overflowed, self.stream.blocksize)
-                if overflowed:
-                    _log.warning("audio stream overflow")
-                callback(bytes(in_data))  # Must copy data from temporary C buffer!
-            else:
-                time.sleep(0.001)
+    def _reader_thread(self, write):
+        stream = self.stream
+        while not stream.closed:
+            if not stream.active:
+                # Sleep until the stream is started (or closed)
+                self._active_event.wait()
+                continue
+            try:
+                # Blocks until a whole block is available
+                in_data, overflowed = stream.read(stream.blocksize)
+            except sounddevice.PortAudioError:
+                if stream.closed or not stream.active:
+                    continue  # Stopped or closed while reading
+                raise
+            if overflowed:
+                _log.warning("audio stream overflow")
+            write(in_data)
 
     def destroy(self):
         self.stream.close()
+        self._active_event.set()  # Wake the reader thread, so it exits
 
     def reconnect(self):
         self.stream.close()
+        self._active_event.set()  # Wake the reader thread, so it exits
         if self.thread:
             self.thread.join()
             self.thread = None
+        self._active_event.clear()
         self._connect(start=True)
 
     def start(self):
         self.stream.start()
+        self._active_event.set()
 
     def stop(self):
+        self._active_event.clear()
         self.stream.stop()
 
-    def read(self, nowait=False):
-        """Return a block of audio data. If nowait==False, waits for a block if necessary; else, returns False immediately if no block is available."""
-        if self.stream or (self.flush_queue and not self.buffer_queue.empty()):
-            if nowait:
-                try:
-                    return self.buffer_queue.get_nowait()  # Return good block if available
-                except queue.Empty as e:
-                    return False  # Queue is empty for now
-            else:
-                return self.buffer_queue.get()  # Wait for a good block and return it
+    def read(self, nowait=False, timeout=None):
+        """Return a block of audio data, as a read-only view into the ring buffer that remains valid until the buffer
+        wraps around. If nowait==False, waits for a block if necessary, for at most timeout seconds if given; else,
+        returns False immediately if no block is available. Also returns False upon timeout."""
+        if self.stream or (self.flush_queue and len(self.ring_buffer)):
+            block = self.ring_buffer.read(timeout=(0 if nowait else timeout))
+            if block is None:
+                return False  # Buffer is empty for now
+            return block
         else:
             return None  # We are done
 
@@ -132,10 +231,10 @@ class MicAudio(object):
         for block in iter(self):
             callback(block)
 
-    def iter(self, nowait=False):
-        """Generator that yields all audio blocks from microphone."""
+    def iter(self, nowait=False, timeout=None):
+        """Generator that yields all audio blocks from microphone, or False when none was available (see read())."""
         while True:
-            block = self.read(nowait=nowait)
+            block = self.read(nowait=nowait, timeout=timeout)
             if block is None:
                 break
             yield block
@@ -192,15 +291,47 @@ class MicAudio(object):
 
 
 class VADAudio(MicAudio):
-    """Filter & segment audio with voice activity detection."""
+    """Filter & segment audio with voice activity detection. Optionally, blocks below an energy threshold
+    (*energy_gate_dbfs*, in dB relative to full scale) are treated as silence without invoking webrtcvad, which
+    requires NumPy. Blocks within ``ZCR_GATE_RANGE_DB`` below the threshold are still passed to webrtcvad if their
+    zero-crossing rate (the fraction of consecutive samples changing sign) is at least *zcr_gate*, since they may be
+    quiet unvoiced speech. Counts are kept in ``num_blocks_gated`` and ``num_blocks_vad``."""
+
+    ZCR_GATE_RANGE_DB = 10
 
-    def __init__(self, aggressiveness=3, **kwargs):
+    def __init__(self, aggressiveness=3, energy_gate_dbfs=None, zcr_gate=0.5, **kwargs):
         super(VADAudio, self).__init__(**kwargs)
         self.vad = webrtcvad.Vad(aggressiveness)
+        if energy_gate_dbfs is not None and np is None:
+            _log.warning("%s: energy_gate_dbfs requires NumPy, which is not installed; disabling energy gate", self)
+            energy_gate_dbfs = None
+        self.energy_gate_dbfs = energy_gate_dbfs
+        self.zcr_gate = zcr_gate
+        if energy_gate_dbfs is not None:
+            # Thresholds on the mean of squared samples, to avoid a square root and logarithm per block
+            self._gate_mean_square = (32768.0 * 10 ** (energy_gate_dbfs / 20.0)) ** 2
+            self._gate_zcr_mean_square = self._gate_mean_square * 10 ** (-self.ZCR_GATE_RANGE_DB / 10.0)
+        self.num_blocks_gated = 0
+        self.num_blocks_vad = 0
+
+    def is_speech(self, block):
+        """Returns whether the given block contains speech, according to the energy gate (if enabled) and webrtcvad."""
+        if self.energy_gate_dbfs is not None:
+            samples = np.frombuffer(block, dtype=np.int16)
+            if len(samples):
+                float_samples = samples.astype(np.float32)
+                mean_square = np.dot(float_samples, float_samples) / len(samples)
+                if mean_square < self._gate_mean_square:
+                    if (self.zcr_gate is None or mean_square < self._gate_zcr_mean_square
+                            or np.count_nonzero(np.diff(np.signbit(samples))) < self.zcr_gate * (len(samples) - 1)):
+                        self.num_blocks_gated += 1
+                        return False
+        self.num_blocks_vad += 1
+        return self.vad.is_speech(block, self.SAMPLE_RATE)
 
     def vad_collector(self, start_window_ms=150, start_padding_ms=100,
         end_window_ms=150, end_padding_ms=None, complex_end_window_ms=None,
-        ratio=0.8, blocks=None, nowait=False,
+        ratio=0.8, blocks=None, nowait=False, timeout=None,
         ):
         """Generator/coroutine that yields series of consecutive audio blocks comprising each phrase, separated by yielding a single None.
             Determines voice activity by ratio of blocks in window_ms. Uses a buffer to include window_ms prior to being triggered.
@@ -230,7 +361,7 @@ class VADAudio(MicAudio):
         num_empty_blocks = 0
         last_good_block_time = time.time()
 
-        if blocks is None: blocks = self.iter(nowait=nowait)
+        if blocks is None: blocks = self.iter(nowait=nowait, timeout=timeout)
         for block in blocks:
             if block is False or block is None:
                 # Bad/empty block
@@ -246,7 +377,7 @@ class VADAudio(MicAudio):
                 # Good block
                 num_empty_blocks = 0
                 last_good_block_time = time.time()
-                is_speech = self.vad.is_speech(block, self.SAMPLE_RATE)
+                is_speech = self.is_speech(block)
 
                 if not triggered:
                     # Between phrases
@@ -281,7 +412,7 @@ class VADAudio(MicAudio):
     def debug_print_simple(self):
         print("block_duration_ms=%s" % self.BLOCK_DURATION_MS)
         for block in self.iter(nowait=False):
-            is_speech = self.vad.is_speech(block, self.SAMPLE_RATE)
+            is_speech = self.is_speech(block)
             print('|' if is_speech else '.', end='')
 
     def debug_loop(self, *args, **kwargs):
@@ -303,25 +434,46 @@ class AudioStore(object):
     - *save_dir* (*str*, default *None*): if set, the directory to save the `retain.tsv` file and optionally wav files.
     - *save_metadata* (*bool*, default *None*): whether to automatically save the recognition metadata.
     - *save_audio* (*bool*, default *None*): whether to automatically save the recognition audio data (in addition to just the recognition metadata).
+    - *save_queue_size* (*int*, default *100*): the number of saved recognitions that can be waiting to be written (see `AudioStoreWriter`).
+    - *save_fsync* (*str*, default *None*): when to sync saved data to disk (see `AudioStoreWriter`).
     """
 
-    def __init__(self, audio_obj, maxlen=None, save_dir=None, save_audio=None, save_metadata=None, auto_save_predicate_func=None):
+    def __init__(self, audio_obj, maxlen=None, save_dir=None, save_audio=None, save_metadata=None, auto_save_predicate_func=None,
+            save_queue_size=100, save_fsync=None):
         self.audio_obj = audio_obj
         self.maxlen = maxlen
         self.save_dir = save_dir
         self.save_audio = save_audio
         self.save_metadata = save_metadata
+        self.writer = None
         if self.save_dir:
             _log.info("retaining recognition audio and/or metadata to '%s'", self.save_dir)
+            self.writer = AudioStoreWriter(audio_obj, save_dir, max_queue_size=save_queue_size, fsync=save_fsync)
         self.auto_save_predicate_func = auto_save_predicate_func
         self.deque = collections.deque(maxlen=maxlen) if maxlen else None
-        self.blocks = []
+        # The current utterance is copied into a preallocated buffer, which is grown by doubling and reused across
+        # utterances, so its audio is contiguous without allocating per block
+        self._buffer = bytearray(self.INITIAL_BUFFER_S * audio_obj.SAMPLE_RATE * audio_obj.SAMPLE_WIDTH)
+        self._length = 0
 
-    current_audio_data = property(lambda self: b''.join(bytes(self.blocks)) if PY2 else b''.join(self.blocks))
-    current_audio_length_ms = property(lambda self: len(self.blocks) * self.audio_obj.BLOCK_DURATION_MS)
+    INITIAL_BUFFER_S = 10
+
+    @property
+    def current_audio_data(self):
+        """ Copy of the current utterance's audio data. """
+        return memoryview(self._buffer)[:self._length].tobytes()
+
+    current_audio_length_ms = property(lambda self: 1000 * self._length // (self.audio_obj.SAMPLE_WIDTH * self.audio_obj.SAMPLE_RATE))
 
     def add_block(self, block):
-        self.blocks.append(block)
+        end = self._length + len(block)
+        if end > len(self._buffer):
+            # Grow into a new buffer, rather than resizing in place, which is not allowed while views are exported
+            buffer = bytearray(max(end, 2 * len(self._buffer)))
+            buffer[:self._length] = memoryview(self._buffer)[:self._length]
+            self._buffer = buffer
+        self._buffer[self._length:end] = block
+        self._length = end
 
     def finalize(self, text, grammar_name, rule_name, likelihood=None, tag='', has_dictation=None):
         """ Finalizes current utterance, creating its AudioStoreEntry and saving it (if enabled). """
@@ -332,13 +484,14 @@ class AudioStore(object):
             self.deque.appendleft(entry)
         # if self.auto_save_predicate_func and self.auto_save_predicate_func(*entry):
         #     self.save(0)
-        self.blocks = []
+        self._length = 0
 
     def cancel(self):
-        self.blocks = []
+        self._length = 0
 
     def save(self, index):
-        """ Saves AudioStoreEntry for given index (0 is most recent). """
+        """ Saves AudioStoreEntry for given index (0 is most recent). The data is written in the background by the
+        `AudioStoreWriter`, so this does not wait for the disk. """
         if slice(index).indices(len(self.deque))[1] >= len(self.deque):
             raise EngineError("Invalid index to save in AudioStore")
         if not self.save_dir:
@@ -352,21 +505,9 @@ class AudioStore(object):
             return
         if self.save_audio or entry.force_save:
             filename = os.path.join(self.save_dir, "retain_%s.wav" % datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S_%f"))
-            self.audio_obj.write_wav(filename, entry.audio_data)
         else:
             filename = ''
-
-        with open(os.path.join(self.save_dir, "retain.tsv"), 'a', encoding='utf-8') as tsv_file:
-            tsv_file.write(u'\t'.join([
-                    filename,
-                    text_type(self.audio_obj.get_wav_length_s(entry.audio_data)),
-                    entry.grammar_name,
-                    entry.rule_name,
-                    entry.text,
-                    text_type(entry.likelihood),
-                    text_type(entry.tag),
-                    text_type(entry.has_dictation),
-                ]) + '\n')
+        self.writer.put(entry, filename)
 
     def save_all(self, remove=True):
         if self.deque:
@@ -375,6 +516,11 @@ class AudioStore(object):
             if remove:
                 self.deque.clear()
 
+    def close(self, timeout=None):
+        """ Waits (for at most timeout seconds if given) for all saved recognitions to be written, and stops the writer. """
+        if self.writer:
+            self.writer.close(timeout=timeout)
+
     def __getitem__(self, key):
         return self.deque[key]
     def __len__(self):
@@ -383,6 +529,116 @@ class AudioStore(object):
         return True
     __nonzero__ = __bool__  # PY2 compatibility
 
+class AudioStoreWriter(object):
+    """
+    Writes saved recognitions (wav files and `retain.tsv` lines) from a background thread, so that saving never
+    blocks the recognition loop. Recognitions wait in a bounded queue; if it is full, the recognition is dropped
+    (and counted) rather than waiting for the disk. All recognitions waiting when the thread wakes are written as a
+    batch, with a single append to `retain.tsv`.
+
+    Constructor arguments:
+    - *audio_obj*: the audio object, used to write wav files.
+    - *save_dir* (*str*): the directory to save the `retain.tsv` file and wav files.
+    - *max_queue_size* (*int*, default *100*): the number of recognitions that can be waiting to be written.
+    - *fsync* (*str*, default *None*): when to sync written data to disk: *None* leaves it to the operating system,
+      *"batch"* syncs `retain.tsv` after each batch, and *"always"* also syncs each wav file.
+
+    Statistics are kept in `num_written`, `num_batches`, `num_dropped` and `max_queue_length`.
+    """
+
+    FSYNC_POLICIES = (None, 'batch', 'always')
+
+    def __init__(self, audio_obj, save_dir, max_queue_size=100, fsync=None):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError("Invalid fsync policy %r: must be one of %r" % (fsync, self.FSYNC_POLICIES))
+        self.audio_obj = audio_obj
+        self.save_dir = save_dir
+        self.fsync = fsync
+        self.queue = queue.Queue(maxsize=max(1, int(max_queue_size)))
+        self.thread = None
+        self.num_written = 0
+        self.num_batches = 0
+        self.num_dropped = 0
+        self.max_queue_length = 0
+
+    def put(self, entry, filename):
+        """ Queues AudioStoreEntry to be written, with its audio data to filename if given, without blocking. Returns
+        whether it was queued. """
+        try:
+            self.queue.put_nowait((entry, filename))
+        except queue.Full:
+            self.num_dropped += 1
+            _log.warning("retention queue full, so dropped retained recognition (%d dropped in total)", self.num_dropped)
+            return False
+        self.max_queue_length = max(self.max_queue_length, self.queue.qsize())
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._writer_thread)
+            self.thread.daemon = True
+            self.thread.start()
+        return True
+
+    def close(self, timeout=None):
+        """ Waits (for at most timeout seconds if given) for all queued recognitions to be written, and stops the
+        background thread. """
+        if self.thread is None:
+            return
+        try:
+            self.queue.put(None, timeout=timeout)  # Sentinel to stop the thread
+        except queue.Full:
+            pass
+        self.thread.join(timeout)
+        if self.thread.is_alive():
+            _log.warning("timed out waiting for %d retained recognitions to be written", self.queue.qsize())
+        else:
+            self.thread = None
+        _log.debug("retention: wrote %d recognitions in %d batches, dropped %d, max queue length %d",
+            self.num_written, self.num_batches, self.num_dropped, self.max_queue_length)
+
+    def _writer_thread(self):
+        while True:
+            batch = [self.queue.get()]
+            while batch[-1] is not None:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._write_batch([item for item in batch if item is not None])
+            except Exception as e:
+                _log.exception("failed to write retained recognitions: %s", e)
+            if batch[-1] is None:
+                return
+
+    def _write_batch(self, batch):
+        if not batch:
+            return
+        lines = []
+        for entry, filename in batch:
+            if filename:
+                self.audio_obj.write_wav(filename, entry.audio_data)
+                if self.fsync == 'always':
+                    with open(filename, 'rb+') as wav_file:
+                        os.fsync(wav_file.fileno())
+            lines.append(u'\t'.join([
+                    filename,
+                    text_type(self.audio_obj.get_wav_length_s(entry.audio_data)),
+                    entry.grammar_name,
+                    entry.rule_name,
+                    entry.text,
+                    text_type(entry.likelihood),
+                    text_type(entry.tag),
+                    text_type(entry.has_dictation),
+                ]) + '\n')
+
+        with open(os.path.join(self.save_dir, "retain.tsv"), 'a', encoding='utf-8') as tsv_file:
+            tsv_file.write(u''.join(lines))
+            if self.fsync:
+                tsv_file.flush()
+                os.fsync(tsv_file.fileno())
+        self.num_written += len(batch)
+        self.num_batches += 1
+
+
 class AudioStoreEntry(object):
     __slots__ = ('audio_data', 'grammar_name', 'rule_name', 'text', 'likelihood', 'tag', 'has_dictation', 'force_save')
 
@@ -0,0 +1,159 @@
+#
+# This file is part of Dragonfly.
+# (c) Copyright 2019 by David Zurow
+# Licensed under the LGPL.
+#
+#   Dragonfly is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published
+#   by the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Dragonfly is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public
+#   License along with Dragonfly.  If not, see
+#   <http://www.gnu.org/licenses/>.
+#
+
+"""
+Batch transcription of wave files for Kaldi backend, such as to re-run a
+corpus of retained recognitions after grammar changes
+"""
+
+from __future__ import division
+import logging, multiprocessing, os, time
+from io import open
+
+_log = logging.getLogger("engine.kaldi")
+
+
+class TranscriptionResult(object):
+    """ Result of transcribing a single wave file. *error* is set (and the recognition fields are empty) if it failed. """
+    __slots__ = ('filename', 'expected_text', 'text', 'grammar_name', 'rule_name', 'likelihood', 'audio_length_s',
+        'processing_time_s', 'error')
+
+    def __init__(self, filename, expected_text=None, text='', grammar_name=None, rule_name=None, likelihood=None,
+            audio_length_s=0.0, processing_time_s=0.0, error=None):
+        self.filename = filename
+        self.expected_text = expected_text
+        self.text = text
+        self.grammar_name = grammar_name
+        self.rule_name = rule_name
+        self.likelihood = likelihood
+        self.audio_length_s = audio_length_s
+        self.processing_time_s = processing_time_s
+        self.error = error
+
+    correct = property(lambda self: (self.expected_text is not None and self.error is None
+        and self.text == self.expected_text), doc="Whether the recognized text matches the expected text, if any.")
+
+
+def read_retain_tsv(filename):
+    """ Returns a list of ``(wav_filename, text)`` tuples for the retained recognitions with audio listed in the given
+    ``retain.tsv`` file. Audio files that have moved along with the ``retain.tsv`` file are looked up next to it. """
+    entries = []
+    tsv_dir = os.path.dirname(os.path.abspath(filename))
+    with open(filename, 'r', encoding='utf-8') as tsv_file:
+        for line in tsv_file:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) < 5 or not fields[0]:
+                continue  # Metadata only
+            wav_filename = fields[0]
+            if not os.path.isfile(wav_filename):
+                wav_filename = os.path.join(tsv_dir, os.path.basename(wav_filename))
+            entries.append((wav_filename, fields[4]))
+    return entries
+
+
+_worker_engine = None
+
+def _init_engine(engine_options, module_filenames):
+    """ Initializes the Kaldi engine of this process and loads the command modules into it. """
+    global _worker_engine
+    from dragonfly.engines import get_engine
+    from dragonfly.loader import CommandModule
+    engine = get_engine("kaldi", **engine_options)
+    engine.connect()
+    for module_filename in module_filenames:
+        CommandModule(module_filename).load()
+    engine.prepare_for_recognition()  # Compile any pending rules now, rather than during the first transcription
+    _worker_engine = engine
+    return engine
+
+def _transcribe_file(args):
+    filename, expected_text = args
+    start_time = time.time()
+    try:
+        kaldi_rule, text, likelihood, audio_length_s = _worker_engine.transcribe_wave_file(filename)
+    except Exception as e:
+        _log.exception("failed to transcribe %r: %s", filename, e)
+        return TranscriptionResult(filename, expected_text, error=str(e), processing_time_s=(time.time() - start_time))
+    return TranscriptionResult(filename, expected_text, text=text,
+        grammar_name=(kaldi_rule.parent_grammar.name if kaldi_rule else None),
+        rule_name=(kaldi_rule.parent_rule.name if kaldi_rule else None),
+        likelihood=likelihood, audio_length_s=audio_length_s, processing_time_s=(time.time() - start_time))
+
+
+def transcribe_files(files, module_filenames=(), engine_options=None, processes=None):
+    """
+    Transcribes the given wave files with the Kaldi engine, each as a single utterance, using the grammars of the given
+    command modules, without executing any actions. Files are fanned out to *processes* worker processes (default:
+    the number of cores), each with its own engine and decoder. The grammars are first compiled in this process, so
+    the workers load them from the compilation caches rather than compiling them again; the engine of this process is
+    then disconnected. If *processes* is 1, the engine of this process transcribes the files itself, and is
+    disconnected afterwards. This is intended to be run from a process of its own, such as the ``transcribe``
+    command-line command.
+
+    *files* is a list of wave filenames or ``(filename, expected_text)`` tuples (see `read_retain_tsv()`).
+
+    Returns a tuple of the list of `TranscriptionResult` objects (in the order of *files*) and a *dict* of statistics:
+    *files*, *errors*, *correct* (if expected texts were given), *audio_s*, *processing_s* (summed over all files),
+    *wall_s*, *real_time_factor* (processing time per second of audio), and *speed* (seconds of audio transcribed
+    per second of wall time).
+    """
+    files = [(item, None) if not isinstance(item, tuple) else item for item in files]
+    engine_options = dict(engine_options or {})
+    module_filenames = [os.path.abspath(filename) for filename in module_filenames]
+    processes = int(processes) if processes else multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(files)))
+    start_time = time.time()
+
+    engine = _init_engine(engine_options, module_filenames)
+    if processes == 1:
+        try:
+            results = [_transcribe_file(item) for item in files]
+        finally:
+            engine.disconnect()
+    else:
+        engine.disconnect()  # Free this process's decoder for the workers
+        # Spawn fresh worker processes, rather than forking this one with its engine state, where supported
+        context = multiprocessing.get_context('spawn') if hasattr(multiprocessing, 'get_context') else multiprocessing
+        pool = context.Pool(processes, initializer=_init_engine, initargs=(engine_options, module_filenames))
+        try:
+            results = pool.map(_transcribe_file, files, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+
+    wall_s = time.time() - start_time
+    audio_s = sum(result.audio_length_s for result in results)
+    processing_s = sum(result.processing_time_s for result in results)
+    stats = dict(
+        files = len(results),
+        errors = sum(1 for result in results if result.error is not None),
+        correct = (sum(1 for result in results if result.correct)
+            if any(result.expected_text is not None for result in results) else None),
+        audio_s = audio_s,
+        processing_s = processing_s,
+        wall_s = wall_s,
+        real_time_factor = (processing_s / audio_s) if audio_s else None,
+        speed = (audio_s / wall_s) if wall_s else None,
+    )
+    _log.info("transcribed %d files (%.1f s of audio) with %d processes in %.1f s: real-time factor %s, %s x real time",
+        stats['files'], audio_s, processes, wall_s,
+        ('%.3f' % stats['real_time_factor']) if stats['real_time_factor'] is not None else 'n/a',
+        ('%.1f' % stats['speed']) if stats['speed'] is not None else 'n/a')
+    return results, stats
@@ -22,7 +22,8 @@
 Compiler classes for Kaldi backend
 """
 
-import collections, logging, os.path, re, subprocess, types
+import collections, hashlib, logging, multiprocessing, os, os.path, re, subprocess, time, types
+import concurrent.futures
 
 from .testing                   import debug_timer
 from .dictation                 import AlternativeDictation, DefaultDictation
@@ -34,6 +35,7 @@ from kaldi_active_grammar import Compiler as KaldiAGCompiler
 
 import six
 from six import text_type
+from six.moves import cPickle as pickle
 from six.moves import map, range
 
 _log = logging.getLogger("engine.compiler")
@@ -64,20 +66,120 @@ InternalRule = collections.namedtuple('InternalRule', 'name gstring')
 MockLiteral = collections.namedtuple('MockLiteral', 'words')
 
 
+class RuleFSTCache(object):
+    """
+    On-disk cache of the FSTs built for KaldiRules, stored under a hash of everything the FST depends on, so that
+    unchanged rules need not be rebuilt on the next startup. Entries not used for ``max_age`` seconds are evicted
+    when the cache is opened.
+    """
+
+    version = 1  # Increment when the key or the entry format changes
+    suffix = '.fst.pickle'
+
+    def __init__(self, cache_dir, max_age=30*24*60*60):
+        self.cache_dir = cache_dir
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+        self._log = _log
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.evict()
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.cache_dir)
+
+    def hash_key(self, parts):
+        """ Returns the cache key for the given (repr-able) key parts. """
+        data = repr((self.version, parts))
+        if isinstance(data, text_type):
+            data = data.encode('utf-8')
+        return hashlib.sha1(data).hexdigest()
+
+    def _get_path(self, key):
+        return os.path.join(self.cache_dir, key + self.suffix)
+
+    def _iter_paths(self):
+        for filename in os.listdir(self.cache_dir):
+            if filename.endswith(self.suffix):
+                yield os.path.join(self.cache_dir, filename)
+
+    def get(self, key):
+        """ Returns the (fst, fst_text, filename) entry stored under the given key, or None. """
+        path = self._get_path(key)
+        try:
+            with open(path, 'rb') as f:
+                entry = pickle.load(f)
+            os.utime(path, None)  # Mark as recently used
+        except (IOError, OSError):
+            self.misses += 1
+            return None
+        except Exception as e:
+            self._log.warning("%s: removing unreadable entry %r: %s", self, path, e)
+            self._remove(path)
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key, fst, fst_text, filename):
+        """ Stores the given entry under the given key. """
+        path = self._get_path(key)
+        try:
+            with open(path, 'wb') as f:
+                pickle.dump((fst, fst_text, filename), f, protocol=2)
+        except (IOError, OSError) as e:
+            self._log.warning("%s: failed to write entry %r: %s", self, path, e)
+            self._remove(path)
+
+    def evict(self, max_age=None):
+        """ Removes entries not used for ``max_age`` seconds (default: ``self.max_age``). """
+        if max_age is None:
+            max_age = self.max_age
+        cutoff_time = time.time() - max_age
+        for path in self._iter_paths():
+            try:
+                if os.path.getmtime(path) < cutoff_time:
+                    os.remove(path)
+            except OSError:
+                pass
+
+    def clear(self):
+        """ Removes all entries. """
+        self.evict(max_age=-1)
+
+    def _remove(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
 #---------------------------------------------------------------------------
 
 class KaldiCompiler(CompilerBase, KaldiAGCompiler):
 
-    def __init__(self, model_dir, tmp_dir, auto_add_to_user_lexicon=None, lazy_compilation=None, **kwargs):
+    def __init__(self, model_dir, tmp_dir, auto_add_to_user_lexicon=None, lazy_compilation=None, rule_cache_dir=None,
+            compile_workers=None, **kwargs):
+        """
+        :param rule_cache_dir: directory of the RuleFSTCache; None for the default next to tmp_dir, False to disable
+        :param compile_workers: number of rules compiled in parallel; None for the number of cores
+        """
         CompilerBase.__init__(self)
         KaldiAGCompiler.__init__(self, model_dir=model_dir, tmp_dir=tmp_dir, **kwargs)
 
         self.auto_add_to_user_lexicon = bool(auto_add_to_user_lexicon)
         self.lazy_compilation = bool(lazy_compilation)
+        self.compile_workers = max(1, int(compile_workers or multiprocessing.cpu_count()))
+        if rule_cache_dir is None:
+            rule_cache_dir = os.path.normpath(self.tmp_dir) + '.rules'
+        self.rule_cache = RuleFSTCache(rule_cache_dir) if rule_cache_dir else None
 
         self.kaldi_rule_by_rule_dict = collections.OrderedDict()  # maps Rule -> KaldiRule
         self._grammar_rule_states_dict = dict()  # FIXME: disabled!
         self.kaldi_rules_by_listreflist_dict = collections.defaultdict(set)
+        self.kaldi_list_rule_by_listreflist_dict = collections.OrderedDict()  # maps id(List) -> KaldiRule of the list's sub-FST
+        self._new_kaldi_list_rules = []  # list KaldiRules not yet passed to the engine for loading
         self.added_word = False
         self.internal_grammar = InternalGrammar('!kaldi_engine_internal')
 
@@ -153,22 +255,134 @@ class KaldiCompiler(CompilerBase, KaldiAGCompiler):
                 kaldi_rule_by_rule_dict[rule] = kaldi_rule
 
                 try:
-                    self._compile_rule_root(rule, grammar, kaldi_rule)
+                    self._compile_rule_root(rule, grammar, kaldi_rule, lazy=True)
                 except Exception as e:
-                    kaldi_rule.destroy()
+                    self._destroy_kaldi_rules([kaldi_rule])
                     raise
 
+        # The rule FSTs were queued for compilation above; unless compilation is lazy, compile them all in parallel now
+        if not self.lazy_compilation:
+            self.process_compile_and_load_queues()
+
         self.kaldi_rule_by_rule_dict.update(kaldi_rule_by_rule_dict)
         return kaldi_rule_by_rule_dict
 
-    def _compile_rule_root(self, rule, grammar, kaldi_rule):
+    def pop_new_kaldi_list_rules(self):
+        """ Returns the list KaldiRules created since the last call, which must be loaded along with the grammar's rules. """
+        kaldi_list_rules, self._new_kaldi_list_rules = self._new_kaldi_list_rules, []
+        return [kaldi_rule for kaldi_rule in kaldi_list_rules if not kaldi_rule.destroyed]
+
+    def _compile_rule_root(self, rule, grammar, kaldi_rule, lazy=None):
+        """ :param lazy: whether to queue the FST for compilation, rather than compile it now; None for lazy_compilation """
+        cache_key = None
+        if self.rule_cache:
+            lists = []
+            key_parts = [self.get_weight(grammar)]
+            self._get_rule_cache_key_parts(rule, key_parts, lists)
+            cache_key = self._get_cache_key(key_parts)
+            if self._load_cached_fst(cache_key, kaldi_rule, lazy):
+                # Register the list references, as _compile_list_ref() would have done
+                for lst in lists:
+                    if lst not in grammar.lists:
+                        grammar.add_list(lst)
+                    self.kaldi_rules_by_listreflist_dict[id(lst)].add(kaldi_rule)
+                return
         self._compile_rule(rule, grammar, kaldi_rule, kaldi_rule.fst)
+        self._finish_compile(kaldi_rule, cache_key, lazy)
+
+    def _compile_list_root(self, lst, kaldi_list_rule, lazy=None):
+        """ Compiles the items of the given list as a nonterminal sub-FST, which rules referencing the list link to. """
+        items = lst.get_list_items()
+        cache_key = None
+        if self.rule_cache:
+            cache_key = self._get_cache_key(['!list', list(items)])
+            if self._load_cached_fst(cache_key, kaldi_list_rule, lazy):
+                return
+        fst = kaldi_list_rule.fst
+        src_state = fst.add_state(initial=True)
+        dst_state = fst.add_state(final=True)
+        for child_str in items:
+            self._compile_literal(MockLiteral(child_str.split()), src_state, dst_state, None, kaldi_list_rule, fst)
+        if not items:
+            # An empty list must not match anything, not even the empty string
+            self._compile_impossible(None, src_state, dst_state, None, kaldi_list_rule, fst)
+        self._finish_compile(kaldi_list_rule, cache_key, lazy)
+
+    def _finish_compile(self, kaldi_rule, cache_key=None, lazy=None):
         if self.added_word:
             self.model.generate_lexicon_files()
             self.model.load_words()
             self.decoder.load_lexicon()
             self.added_word = False
-        kaldi_rule.compile(lazy=self.lazy_compilation)
+            # Words were added to the lexicon, which changes the keys of all rules; don't cache this FST under the old key
+            cache_key = None
+        if cache_key is not None:
+            # Generate the FST text as KaldiRule.compile() would, so that it can be cached
+            # pylint: disable=protected-access
+            kaldi_rule._fst_text = kaldi_rule.fst.get_fst_text()
+            kaldi_rule.filename = self.fst_cache.get_fst_filename(kaldi_rule._fst_text)
+            self.rule_cache.put(cache_key, kaldi_rule.fst, kaldi_rule._fst_text, kaldi_rule.filename)
+        kaldi_rule.compile(lazy=self.lazy_compilation if lazy is None else lazy)
+
+    def process_compile_and_load_queues(self):
+        """ Compiles the queued KaldiRules across ``compile_workers`` threads, then lets kaldi_active_grammar process the
+        rest of its queues, loading the KaldiRules in id order. """
+        kaldi_rules = [kaldi_rule for kaldi_rule in self.compile_queue if not kaldi_rule.compiled]
+        if kaldi_rules:
+            with debug_timer(self._log.debug, "compiling %d rules with %d workers" % (len(kaldi_rules), self.compile_workers)):
+                with concurrent.futures.ThreadPoolExecutor(max_workers=self.compile_workers) as executor:
+                    for kaldi_rule in executor.map(lambda kaldi_rule: kaldi_rule.finish_compile(), kaldi_rules):
+                        assert kaldi_rule.compiled
+                        self.compile_queue.discard(kaldi_rule)
+        KaldiAGCompiler.process_compile_and_load_queues(self)
+
+    #-----------------------------------------------------------------------
+    # Methods for caching rule FSTs.
+
+    def _get_cache_key(self, key_parts):
+        # The FSTs depend on the model and lexicon, and on how OOV words are handled
+        return self.rule_cache.hash_key((self.fst_cache.cache.get('dependencies_hash'),
+            self.auto_add_to_user_lexicon, key_parts))
+
+    def _load_cached_fst(self, cache_key, kaldi_rule, lazy=None):
+        """ Sets up the given KaldiRule from the RuleFSTCache entry under the given key, returning whether there was one. """
+        entry = self.rule_cache.get(cache_key)
+        if entry is None:
+            return False
+        fst, fst_text, filename = entry
+        self._log.debug("%s: Using cached FST for %s." % (self, kaldi_rule))
+        # pylint: disable=protected-access
+        kaldi_rule.fst = fst
+        kaldi_rule._fst_text = fst_text
+        kaldi_rule.filename = filename
+        kaldi_rule.compile(lazy=self.lazy_compilation if lazy is None else lazy)
+        return True
+
+    def _get_rule_cache_key_parts(self, rule, key_parts, lists):
+        """ Appends everything the FST of the given rule depends on to key_parts, and the lists it references to lists. """
+        key_parts.append(('<rule>', self.get_weight(rule)))
+        elements = [rule.element]
+        while elements:
+            element = elements.pop()
+            part = [type(element).__name__, self.get_weight(element)]
+            if isinstance(element, elements_.RuleRef):
+                part.append(self.get_weight(element.rule))
+                elements.append(element.rule.element)
+            elif isinstance(element, elements_.ListRef):
+                # Rules link to the list's sub-FST by its nonterminal, whose items have their own key
+                part.append(self._get_kaldi_list_rule(element.list).id)
+                lists.append(element.list)
+            elif isinstance(element, elements_.Literal):
+                part.append(element.words)
+            elif isinstance(element, elements_.Repetition):
+                part.extend((element.min, element.max, element.optimize))
+            elif isinstance(element, elements_.Dictation):
+                part.extend((getattr(element, 'alternative', None), getattr(element, 'cloud', None)))
+            # Only the child of a repetition needs to be walked, not its expanded children
+            children = [element.child] if isinstance(element, elements_.Repetition) else element.children
+            part.append(len(children))
+            key_parts.append(tuple(part))
+            elements.extend(reversed(children))
 
     def _compile_rule(self, rule, grammar, kaldi_rule, fst, export=True):
         """ :param export: whether rule is exported (a root rule) """
@@ -200,21 +414,78 @@ class KaldiCompiler(CompilerBase, KaldiAGCompiler):
         return (outer_src_state, dst_state)
 
     def unload_grammar(self, grammar, rules, engine):
-        for rule in rules:
-            kaldi_rule = self.kaldi_rule_by_rule_dict[rule]
+        kaldi_rules = [self.kaldi_rule_by_rule_dict.pop(rule) for rule in rules]
+        # NOTE: the kaldi_rule_by_rule_dict we returned from compile_grammar() is not updated, but it should be dropped upon unload anyway!
+        self._destroy_kaldi_rules(kaldi_rules)
+
+    def _destroy_kaldi_rules(self, kaldi_rules):
+        # Destroying a KaldiRule shifts the ids of all KaldiRules above it, so remember the ids of the list sub-FSTs
+        # that the remaining rules link to.
+        list_rule_ids = { list_id: kaldi_list_rule.id
+            for list_id, kaldi_list_rule in self.kaldi_list_rule_by_listreflist_dict.items() }
+
+        for kaldi_rule in kaldi_rules:
             # Unload kaldi_rule: destroy() handles KaldiAGCompiler stuff; we must handle ours
             kaldi_rule.destroy()
-            del self.kaldi_rule_by_rule_dict[rule]
             for kaldi_rules_set in self.kaldi_rules_by_listreflist_dict.values():
                 kaldi_rules_set.discard(kaldi_rule)
-            # NOTE: the kaldi_rule_by_rule_dict we returned from compile_grammar() is not updated, but it should be dropped upon unload anyway!
 
-    def update_list(self, lst, grammar):
-        # Note: we update all rules in all grammars that reference this list (unlike WSR/natlink?)
-        lst_kaldi_rules = self.kaldi_rules_by_listreflist_dict[id(lst)]
-        for kaldi_rule in lst_kaldi_rules:
+        # Destroy the sub-FSTs of lists which are no longer referenced by any rule.
+        for list_id, kaldi_rules_set in list(self.kaldi_rules_by_listreflist_dict.items()):
+            if not kaldi_rules_set:
+                del self.kaldi_rules_by_listreflist_dict[list_id]
+                kaldi_list_rule = self.kaldi_list_rule_by_listreflist_dict.pop(list_id, None)
+                if kaldi_list_rule is not None:
+                    kaldi_list_rule.destroy()
+
+        # Relink the remaining rules to list sub-FSTs whose nonterminal changed.
+        relink_kaldi_rules = []
+        for list_id, kaldi_list_rule in self.kaldi_list_rule_by_listreflist_dict.items():
+            if kaldi_list_rule.id != list_rule_ids[list_id]:
+                for kaldi_rule in self.kaldi_rules_by_listreflist_dict[list_id]:
+                    if kaldi_rule not in relink_kaldi_rules:
+                        relink_kaldi_rules.append(kaldi_rule)
+        for kaldi_rule in relink_kaldi_rules:
             with kaldi_rule.reload():
-                self._compile_rule_root(kaldi_rule.parent_rule, grammar, kaldi_rule)
+                self._compile_rule_root(kaldi_rule.parent_rule, kaldi_rule.parent_grammar, kaldi_rule)
+
+    def update_list(self, lst, grammar, delta=None):
+        self.update_lists([(lst, grammar, delta)])
+
+    def update_lists(self, list_updates):
+        """ :param list_updates: iterable of (list, grammar, delta) tuples """
+        # Note: we update the list for all rules in all grammars that reference it (unlike WSR/natlink?)
+        # List items are compiled into a single sub-FST per list, which referencing rules link to as a nonterminal,
+        # so only that sub-FST is recompiled; the referencing rules are left untouched. Empty deltas are skipped, and
+        # lists updated several times are only recompiled once.
+        kaldi_list_rules = []
+        for lst, grammar, delta in list_updates:
+            if delta is not None and not delta:
+                continue
+            kaldi_list_rule = self.kaldi_list_rule_by_listreflist_dict.get(id(lst))
+            if kaldi_list_rule is not None and kaldi_list_rule not in kaldi_list_rules:
+                kaldi_list_rules.append(kaldi_list_rule)
+        for kaldi_list_rule in kaldi_list_rules:
+            with kaldi_list_rule.reload():
+                self._compile_list_root(kaldi_list_rule.parent_list, kaldi_list_rule)
+
+    def _get_kaldi_list_rule(self, lst):
+        """ Returns the KaldiRule of the given list's sub-FST, compiling it on first use. """
+        kaldi_list_rule = self.kaldi_list_rule_by_listreflist_dict.get(id(lst))
+        if kaldi_list_rule is None:
+            kaldi_list_rule = KaldiRule(self, name='!list::%s' % lst.name, has_dictation=False)
+            kaldi_list_rule.parent_grammar = None
+            kaldi_list_rule.parent_rule = None
+            kaldi_list_rule.parent_list = lst
+            try:
+                # Queued for compilation along with the rules being compiled
+                self._compile_list_root(lst, kaldi_list_rule, lazy=True)
+            except Exception as e:
+                kaldi_list_rule.destroy()
+                raise
+            self.kaldi_list_rule_by_listreflist_dict[id(lst)] = kaldi_list_rule
+            self._new_kaldi_list_rules.append(kaldi_list_rule)
+        return kaldi_list_rule
 
     #-----------------------------------------------------------------------
     # Methods for compiling elements.
@@ -243,41 +514,44 @@ class KaldiCompiler(CompilerBase, KaldiAGCompiler):
             return self.compile_element(children[0], src_state, dst_state, grammar, kaldi_rule, fst)
 
         else:  # len(children) >= 2:
-            # Handle Repetition elements differently as a special case
-            is_repetition = isinstance(element, elements_.Repetition)
-            if is_repetition and element.optimize:
-                # Repetition...
-                # Insert new states, so back arc only affects child
-                s1 = fst.add_state()
-                s2 = fst.add_state()
-                fst.add_arc(src_state, s1, None)
-                # NOTE: to avoid creating an un-decodable epsilon loop, we must not allow an all-epsilon child here (compile_graph_agf should check this)
-                self.compile_element(children[0], s1, s2, grammar, kaldi_rule, fst)
-                if not fst.has_eps_path(s1, s2, self._eps_like_nonterms):
-                    fst.add_arc(s2, s1, fst.eps_disambig, fst.eps)  # back arc
-                    fst.add_arc(s2, dst_state, None)
-                    return
-
-                else:
-                    # Cannot do optimize path, because of epsilon loop, so finish up with Sequence path
-                    self._log.warning("%s: Cannot optimize Repetition element, because its child element can match empty string;"
-                        " falling back to inefficient non-optimize path. (this is not that bad)" % self)
-                    states = [src_state, s2] + [fst.add_state() for i in range(len(children)-2)] + [dst_state]
-                    for i, child in enumerate(children[1:], start=1):
-                        s1 = states[i]
-                        s2 = states[i + 1]
-                        self.compile_element(child, s1, s2, grammar, kaldi_rule, fst)
-                    return
+            # Insert new states for individual children elements
+            states = [src_state] + [fst.add_state() for i in range(len(children)-1)] + [dst_state]
+            for i, child in enumerate(children):
+                s1 = states[i]
+                s2 = states[i + 1]
+                self.compile_element(child, s1, s2, grammar, kaldi_rule, fst)
+            return
 
-            else:
-                # Sequence, not Repetition...
-                # Insert new states for individual children elements
-                states = [src_state] + [fst.add_state() for i in range(len(children)-1)] + [dst_state]
-                for i, child in enumerate(children):
-                    s1 = states[i]
-                    s2 = states[i + 1]
-                    self.compile_element(child, s1, s2, grammar, kaldi_rule, fst)
-                return
+    # @trace_compile
+    def _compile_repetition(self, element, src_state, dst_state, grammar, kaldi_rule, fst):
+        src_state = self.add_weight_linkage(src_state, dst_state, self.get_weight(element), fst)
+        sequence = element.get_expanded_sequence()
+        if not (element.optimize and len(sequence.children) > 1):
+            # Compile the equivalent Sequence of nested Optionals
+            return self._compile_sequence(sequence, src_state, dst_state, grammar, kaldi_rule, fst)
+
+        # Insert new states, so back arc only affects child
+        s1 = fst.add_state()
+        s2 = fst.add_state()
+        fst.add_arc(src_state, s1, None)
+        # NOTE: to avoid creating an un-decodable epsilon loop, we must not allow an all-epsilon child here (compile_graph_agf should check this)
+        self.compile_element(element.child, s1, s2, grammar, kaldi_rule, fst)
+        if not fst.has_eps_path(s1, s2, self._eps_like_nonterms):
+            fst.add_arc(s2, s1, fst.eps_disambig, fst.eps)  # back arc
+            fst.add_arc(s2, dst_state, None)
+            return
+
+        else:
+            # Cannot do optimize path, because of epsilon loop, so finish up with Sequence path
+            self._log.warning("%s: Cannot optimize Repetition element, because its child element can match empty string;"
+                " falling back to inefficient non-optimize path. (this is not that bad)" % self)
+            children = sequence.children
+            states = [src_state, s2] + [fst.add_state() for i in range(len(children)-2)] + [dst_state]
+            for i, child in enumerate(children[1:], start=1):
+                s1 = states[i]
+                s2 = states[i + 1]
+                self.compile_element(child, s1, s2, grammar, kaldi_rule, fst)
+            return
 
     # @trace_compile
     def _compile_alternative(self, element, src_state, dst_state, grammar, kaldi_rule, fst):
@@ -330,9 +604,10 @@ class KaldiCompiler(CompilerBase, KaldiAGCompiler):
         if element.list not in grammar.lists:
             # Should only happen during initial compilation; during updates, we must skip this
             grammar.add_list(element.list)
+        kaldi_list_rule = self._get_kaldi_list_rule(element.list)
         self.kaldi_rules_by_listreflist_dict[id(element.list)].add(kaldi_rule)
-        for child_str in element.list.get_list_items():
-            self._compile_literal(MockLiteral(child_str.split()), src_state, dst_state, grammar, kaldi_rule, fst)
+        # Link to the list's sub-FST, rather than inlining its items into every referencing rule
+        fst.add_arc(src_state, dst_state, '#nonterm:rule%d' % kaldi_list_rule.id, WFST.eps)
 
     # @trace_compile
     def _compile_dictation(self, element, src_state, dst_state, grammar, kaldi_rule, fst):
@@ -357,6 +632,54 @@ class KaldiCompiler(CompilerBase, KaldiAGCompiler):
         src_state = self.add_weight_linkage(src_state, dst_state, self.get_weight(element), fst)
         fst.add_arc(src_state, dst_state, WFST.eps)
 
+    #-----------------------------------------------------------------------
+    # Methods for parsing recognitions.
+
+    def parse_output_for_rule(self, kaldi_rule, output):
+        """ Like KaldiAGCompiler.parse_output_for_rule(), but follows the list sub-FSTs linked from the rule's FST. """
+        labels = self._does_match(kaldi_rule.fst, output.split())
+        self._log.log(5, "parse_output_for_rule(%s, %r) got %r", kaldi_rule, output, labels)
+        if labels is False:
+            return None
+        words = [label for label in labels if not label.startswith('#nonterm:')]
+        parsed_output = ' '.join(words)
+        if parsed_output.lower() != output:
+            self._log.error("parsed_output(%r).lower() != output(%r)" % (parsed_output, output))
+        return words
+
+    def _does_match(self, fst, target_words):
+        """ Returns the olabels on a matching path if there is one, False if not. Uses BFS, entering list sub-FSTs
+        linked by nonterminals and returning to the linking FST from their final states. Otherwise the same as
+        WFST.does_match(). """
+        # pylint: disable=protected-access
+        wildcard_nonterms = self.wildcard_nonterms
+        queue = collections.deque()  # entries: (fst, state, path of olabels, index into target_words, stack of (fst, return state))
+        queue.append((fst, fst.start_state, (), 0, ()))
+        while queue:
+            fst, state, path, target_word_index, stack = queue.popleft()
+            target_word = target_words[target_word_index] if target_word_index < len(target_words) else None
+            if fst.state_is_final(state):
+                if stack:
+                    return_fst, return_state = stack[-1]
+                    queue.append((return_fst, return_state, path, target_word_index, stack[:-1]))
+                elif target_word is None:
+                    return tuple(olabel for olabel in path if not fst.label_is_silent(olabel))
+            for src_state, dst_state, ilabel, olabel, weight in fst._arc_table_dict[state]:
+                if (target_word is not None) and (ilabel == target_word):
+                    queue.append((fst, dst_state, path+(olabel,), target_word_index+1, stack))
+                elif ilabel in wildcard_nonterms:
+                    if olabel not in path:
+                        path += (olabel,)
+                    if target_word is not None:
+                        queue.append((fst, src_state, path+(target_word,), target_word_index+1, stack))  # accept word and stay
+                    queue.append((fst, dst_state, path, target_word_index, stack))
+                elif ilabel.startswith('#nonterm:rule'):
+                    sub_fst = self.kaldi_rule_by_id_dict[int(ilabel[len('#nonterm:rule'):])].fst
+                    queue.append((sub_fst, sub_fst.start_state, path, target_word_index, stack+((fst, dst_state),)))
+                elif fst.label_is_silent(ilabel):
+                    queue.append((fst, dst_state, path+(olabel,), target_word_index, stack))  # epsilon transition
+        return False
+
     #-----------------------------------------------------------------------
     # Utility methods.
 
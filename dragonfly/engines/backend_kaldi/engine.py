@@ -35,7 +35,7 @@ from ..base                     import (EngineBase, EngineError, MimicFailure,
                                         DelegateTimerManagerInterface,
                                         DictationContainerBase,
                                         GrammarWrapperBase)
-from .audio                     import MicAudio, VADAudio, AudioStore, WavAudio
+from .audio                     import MicAudio, VADAudio, AudioStore, AudioStoreWriter, WavAudio
 from .recobs                    import KaldiRecObsManager
 from .testing                   import debug_timer
 from dragonfly.grammar.state    import State
@@ -58,14 +58,18 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
 
     _name = "kaldi"
     DictationContainer = DictationContainerBase
+    _loads_list_items = True  # List items are compiled into the FSTs of rules referencing them.
+    parse_cache_size = 256  # Number of recognitions whose text framework parse results are cached.
 
     #-----------------------------------------------------------------------
 
     def __init__(self, model_dir=None, tmp_dir=None,
         input_device_index=None, retain_dir=None, retain_audio=None, retain_metadata=None, vad_aggressiveness=3,
         vad_padding_start_ms=150, vad_padding_end_ms=150, vad_complex_padding_end_ms=500,
+        vad_energy_gate_dbfs=None, vad_zcr_gate=0.5,
         auto_add_to_user_lexicon=True, lazy_compilation=True, invalidate_cache=False,
-        alternative_dictation=None, cloud_dictation_lang='en-US',
+        alternative_dictation=None, cloud_dictation_lang='en-US', rule_cache_dir=None,
+        compile_workers=None, retain_queue_size=100, retain_fsync=None, partial_parse_interval_ms=0,
         ):
         EngineBase.__init__(self)
         DelegateTimerManagerInterface.__init__(self)
@@ -100,6 +104,9 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         if retain_audio and not retain_dir:
             self._log.error("retain_audio=True requires retain_dir to be set; making retain_audio=False instead")
             retain_audio = False
+        if retain_fsync not in AudioStoreWriter.FSYNC_POLICIES:
+            self._log.error("Invalid retain_fsync: %r; making retain_fsync=None instead" % retain_fsync)
+            retain_fsync = None
 
         self._options = dict(
             model_dir = model_dir,
@@ -108,15 +115,22 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
             retain_dir = retain_dir,
             retain_audio = bool(retain_audio) if retain_audio is not None else bool(retain_dir),
             retain_metadata = bool(retain_metadata) if retain_metadata is not None else bool(retain_dir),
+            retain_queue_size = int(retain_queue_size),
+            retain_fsync = retain_fsync,
+            partial_parse_interval_ms = int(partial_parse_interval_ms),
             vad_aggressiveness = int(vad_aggressiveness),
             vad_padding_start_ms = int(vad_padding_start_ms),
             vad_padding_end_ms = int(vad_padding_end_ms),
             vad_complex_padding_end_ms = int(vad_complex_padding_end_ms),
+            vad_energy_gate_dbfs = float(vad_energy_gate_dbfs) if vad_energy_gate_dbfs is not None else None,
+            vad_zcr_gate = float(vad_zcr_gate) if vad_zcr_gate is not None else None,
             auto_add_to_user_lexicon = bool(auto_add_to_user_lexicon),
             lazy_compilation = bool(lazy_compilation),
             invalidate_cache = bool(invalidate_cache),
             alternative_dictation = alternative_dictation,
             cloud_dictation_lang = cloud_dictation_lang,
+            rule_cache_dir = rule_cache_dir,
+            compile_workers = int(compile_workers) if compile_workers is not None else None,
         )
 
         self._compiler = None
@@ -130,6 +144,12 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         self._doing_recognition = False
         self._deferred_disconnect = False
 
+        # Counters of partial phrase outputs parsed and skipped (unchanged or within partial_parse_interval_ms)
+        self.partial_parse_count = 0
+        self.partial_parse_skip_count = 0
+        self._last_partial_output = None
+        self._next_partial_parse_time = 0
+
     def connect(self):
         """ Connect to back-end SR engine. """
         if self._decoder:
@@ -144,9 +164,13 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
             lazy_compilation=self._options['lazy_compilation'],
             alternative_dictation=self._options['alternative_dictation'],
             cloud_dictation_lang=self._options['cloud_dictation_lang'],
+            rule_cache_dir=self._options['rule_cache_dir'],
+            compile_workers=self._options['compile_workers'],
             )
         if self._options['invalidate_cache']:
             self._compiler.fst_cache.invalidate()
+            if self._compiler.rule_cache:
+                self._compiler.rule_cache.clear()
 
         top_fst = self._compiler.compile_top_fst()
         dictation_fst_file = self._compiler.dictation_fst_filepath
@@ -154,16 +178,26 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
             top_fst_file=top_fst.filepath, dictation_fst_file=dictation_fst_file, save_adaptation_state=False)
         self._compiler.decoder = self._decoder
 
-        self._audio = VADAudio(aggressiveness=self._options['vad_aggressiveness'], start=False, input_device_index=self._options['input_device_index'])
-        self._audio_iter = self._audio.vad_collector(nowait=True,
+        self._audio = VADAudio(aggressiveness=self._options['vad_aggressiveness'], start=False, input_device_index=self._options['input_device_index'],
+            energy_gate_dbfs=self._options['vad_energy_gate_dbfs'], zcr_gate=self._options['vad_zcr_gate'])
+        # Wait for audio for at most a block duration, so that timer callbacks are still called on schedule
+        self._audio_iter = self._audio.vad_collector(timeout=(self._audio.BLOCK_DURATION_MS / 1000.0),
             start_window_ms=self._options['vad_padding_start_ms'],
             end_window_ms=self._options['vad_padding_end_ms'],
             complex_end_window_ms=self._options['vad_complex_padding_end_ms'],
             )
         self.audio_store = AudioStore(self._audio, maxlen=(1 if self._options['retain_dir'] else 0),
-            save_dir=self._options['retain_dir'], save_audio=self._options['retain_audio'], save_metadata=self._options['retain_metadata'])
+            save_dir=self._options['retain_dir'], save_audio=self._options['retain_audio'], save_metadata=self._options['retain_metadata'],
+            save_queue_size=self._options['retain_queue_size'], save_fsync=self._options['retain_fsync'])
 
         self._any_exclusive_grammars = False
+        self._kaldi_rules_activity = None  # Rebuilt on next use if None
+        self._active_kaldi_rules = set()
+        self._active_kaldi_rules_version = 0  # Incremented whenever _active_kaldi_rules changes
+        self._sorted_active_kaldi_rules = None  # Parsing order of _active_kaldi_rules; recomputed on next use if None
+        self._parse_cache = collections.OrderedDict()  # LRU of text framework parse results
+        self.parse_cache_hits = 0
+        self.parse_cache_misses = 0
         self._in_phrase = False
         self._ignore_current_phrase = False
 
@@ -177,6 +211,7 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
                 self._audio.destroy()
                 self._audio = None
                 self._audio_iter = None
+                self.audio_store.close()  # Finish writing retained recognitions
                 self.audio_store = None
             self._compiler = None
             self._decoder = None
@@ -197,9 +232,16 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         kaldi_rule_by_rule_dict = self._compiler.compile_grammar(grammar, self)
         wrapper = GrammarWrapper(grammar, kaldi_rule_by_rule_dict, self,
                                  self._recognition_observer_manager)
-        for kaldi_rule in kaldi_rule_by_rule_dict.values():
+        # Load the rules along with any new list sub-FSTs they link to, in
+        #  the order of their ids, as the decoder requires.
+        kaldi_rules = (list(kaldi_rule_by_rule_dict.values())
+                       + self._compiler.pop_new_kaldi_list_rules())
+        for kaldi_rule in sorted(kaldi_rules, key=lambda kr: kr.id):
             kaldi_rule.load(lazy=self._compiler.lazy_compilation)
 
+        # KaldiRule ids were allocated, so rebuild the activity vector.
+        self._kaldi_rules_activity = None
+        self._parse_cache.clear()
         return wrapper
 
     def _unload_grammar(self, grammar, wrapper):
@@ -207,36 +249,60 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         self._log.debug("Unloading grammar %s." % grammar.name)
         rules = list(wrapper.kaldi_rule_by_rule_dict.keys())
         self._compiler.unload_grammar(grammar, rules, self)
+        # KaldiRule ids were shifted, so rebuild the activity vector.
+        self._kaldi_rules_activity = None
+        self._parse_cache.clear()
 
     def activate_grammar(self, grammar):
         """ Activate the given *grammar*. """
         self._log.debug("Activating grammar %s." % grammar.name)
-        self._get_grammar_wrapper(grammar).active = True
+        wrapper = self._get_grammar_wrapper(grammar)
+        wrapper.active = True
+        self._update_kaldi_rules_activity(wrapper)
 
     def deactivate_grammar(self, grammar):
         """ Deactivate the given *grammar*. """
         self._log.debug("Deactivating grammar %s." % grammar.name)
-        self._get_grammar_wrapper(grammar).active = False
+        wrapper = self._get_grammar_wrapper(grammar)
+        wrapper.active = False
+        self._update_kaldi_rules_activity(wrapper)
 
     def activate_rule(self, rule, grammar):
         """ Activate the given *rule*. """
         self._log.debug("Activating rule %s in grammar %s." % (rule.name, grammar.name))
-        self._compiler.kaldi_rule_by_rule_dict[rule].active = True
+        kaldi_rule = self._compiler.kaldi_rule_by_rule_dict[rule]
+        kaldi_rule.active = True
+        self._update_kaldi_rules_activity(self._get_grammar_wrapper(grammar), [kaldi_rule])
 
     def deactivate_rule(self, rule, grammar):
         """ Deactivate the given *rule*. """
         self._log.debug("Deactivating rule %s in grammar %s." % (rule.name, grammar.name))
-        self._compiler.kaldi_rule_by_rule_dict[rule].active = False
+        kaldi_rule = self._compiler.kaldi_rule_by_rule_dict[rule]
+        kaldi_rule.active = False
+        self._update_kaldi_rules_activity(self._get_grammar_wrapper(grammar), [kaldi_rule])
+
+    def update_list(self, lst, grammar, delta=None):
+        self._compiler.update_list(lst, grammar, delta)
+        self._parse_cache.clear()
 
-    def update_list(self, lst, grammar):
-        self._compiler.update_list(lst, grammar)
+    def _apply_list_updates(self, list_updates):
+        # Recompile each rule referencing the updated lists only once.
+        self._compiler.update_lists(list_updates)
+        self._parse_cache.clear()
 
     def set_exclusiveness(self, grammar, exclusive):
         self._log.debug("Setting exclusiveness of grammar %s to %s." % (grammar.name, exclusive))
-        self._get_grammar_wrapper(grammar).exclusive = exclusive
+        wrapper = self._get_grammar_wrapper(grammar)
+        wrapper.exclusive = exclusive
         if exclusive:
-            self._get_grammar_wrapper(grammar).active = True
-        self._any_exclusive_grammars = any(gw.exclusive for gw in self._grammar_wrappers.values())
+            wrapper.active = True
+        any_exclusive_grammars = any(gw.exclusive for gw in self._grammar_wrappers.values())
+        if any_exclusive_grammars != self._any_exclusive_grammars:
+            # The activity of all other grammars changed too.
+            self._any_exclusive_grammars = any_exclusive_grammars
+            self._kaldi_rules_activity = None
+        else:
+            self._update_kaldi_rules_activity(wrapper)
 
     #-----------------------------------------------------------------------
     # Miscellaneous methods.
@@ -275,6 +341,26 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         """ Can be called optionally before ``do_recognition()`` to speed up its starting of active recognition. """
         self._compiler.prepare_for_recognition()
 
+    def _parse_partial_output(self, in_complex):
+        """ Returns whether the current partial phrase is complex (in dictation or a complex rule), for the VAD. The
+            partial output is only fetched at most every ``partial_parse_interval_ms``, and only reparsed if it has
+            changed; otherwise, the given previous *in_complex* is returned. """
+        now = time.time()
+        if now < self._next_partial_parse_time:
+            self.partial_parse_skip_count += 1
+            return in_complex
+        self._next_partial_parse_time = now + (self._options['partial_parse_interval_ms'] / 1000.0)
+
+        output, likelihood = self._decoder.get_output()
+        if output == self._last_partial_output:
+            self.partial_parse_skip_count += 1
+            return in_complex
+        self._last_partial_output = output
+        self._log.log(5, "Partial phrase: likelihood %f, %r [in_complex=%s]", likelihood, output, in_complex)
+        kaldi_rule, words, words_are_dictation_mask, in_dictation = self._compiler.parse_partial_output(output)
+        self.partial_parse_count += 1
+        return bool(in_dictation or (kaldi_rule and kaldi_rule.is_complex))
+
     def _do_recognition(self, timeout=None, single=False, audio_iter=None):
         """
             Loops performing recognition, by default forever, or for *timeout* seconds, or for a single recognition if *single=True*.
@@ -309,8 +395,8 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
                 block = audio_iter.send(in_complex)
 
                 if block is False:
-                    # No audio block available
-                    time.sleep(0.001)
+                    # No audio block available (the audio iterator already waited for one)
+                    pass
 
                 elif block is not None:
                     if not self._in_phrase:
@@ -320,6 +406,8 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
                             kaldi_rules_activity = self._compute_kaldi_rules_activity()
                         self._in_phrase = True
                         self._ignore_current_phrase = False
+                        self._last_partial_output = None
+                        self._next_partial_parse_time = 0
 
                     else:
                         # Ongoing phrase
@@ -327,10 +415,7 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
                     self._decoder.decode(block, False, kaldi_rules_activity)
                     if self.audio_store:
                         self.audio_store.add_block(block)
-                    output, likelihood = self._decoder.get_output()
-                    self._log.log(5, "Partial phrase: likelihood %f, %r [in_complex=%s]", likelihood, output, in_complex)
-                    kaldi_rule, words, words_are_dictation_mask, in_dictation = self._compiler.parse_partial_output(output)
-                    in_complex = bool(in_dictation or (kaldi_rule and kaldi_rule.is_complex))
+                    in_complex = self._parse_partial_output(in_complex)
 
                 else:
                     # End of phrase
@@ -379,6 +464,33 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         """ Does recognition on given wave file, treating it as a single utterance (without VAD), then returns. """
         self.do_recognition(audio_iter=WavAudio.read_file(filename), **kwargs)
 
+    def transcribe_wave_file(self, filename):
+        """
+            Decodes given wave file as a single utterance (without VAD) using the currently active rules, but without
+            processing the recognition: no grammar callbacks, recognition observers, or actions are run, and contexts
+            are not rechecked. Returns a tuple of the recognized KaldiRule (or ``None``), the recognized text, the
+            likelihood, and the length of the audio in seconds.
+        """
+        if not self._decoder:
+            raise EngineError("Cannot recognize before connect()")
+        kaldi_rules_activity = self._compute_kaldi_rules_activity(phrase_start=False)
+        audio_length_bytes = 0
+        for block in WavAudio.read_file(filename):
+            if block is None:
+                break
+            self._decoder.decode(block, False, kaldi_rules_activity)
+            kaldi_rules_activity = None  # Only passed at the start of the utterance
+            self.audio_store.add_block(block)
+            audio_length_bytes += len(block)
+        self._decoder.decode(b'', True, kaldi_rules_activity)
+        output, likelihood = self._decoder.get_output()
+        try:
+            kaldi_rule, words, _ = self._parse_output(output)
+        finally:
+            self.audio_store.cancel()
+        audio_length_s = float(audio_length_bytes) / (MicAudio.SAMPLE_WIDTH * MicAudio.SAMPLE_RATE)
+        return kaldi_rule, ' '.join(words), likelihood, audio_length_s
+
     def ignore_current_phrase(self):
         """
             Marks the current phrase's recognition to be ignored when it completes, or does nothing if there is none.
@@ -421,51 +533,129 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
             todo_grammar_wrappers = set(self._grammar_wrappers.values()) - processed_grammar_wrappers
 
     def _compute_kaldi_rules_activity(self, phrase_start=True):
+        """ Returns the activity vector of all KaldiRules, which is kept up to date by the rule and grammar
+        (de)activation methods, and only rebuilt after grammars are loaded or unloaded. """
         if phrase_start:
-            fg_window = Window.get_foreground()
-            for grammar_wrapper in self._iter_all_grammar_wrappers_dynamically():
-                grammar_wrapper.phrase_start_callback(fg_window)
+            with debug_timer(self._log.debug, "phrase start callbacks"):
+                fg_window = Window.get_foreground()
+                for grammar_wrapper in self._iter_all_grammar_wrappers_dynamically():
+                    grammar_wrapper.phrase_start_callback(fg_window)
         self.prepare_for_recognition()
+        if (self._kaldi_rules_activity is None
+                or len(self._kaldi_rules_activity) != self._compiler.num_kaldi_rules):
+            with debug_timer(self._log.debug, "rebuilding activity"):
+                self._rebuild_kaldi_rules_activity()
+        if self._log.isEnabledFor(logging.DEBUG):
+            self._log.debug("active kaldi_rules: %s", [kr.name for kr in self._active_kaldi_rules])
+        return self._kaldi_rules_activity
+
+    def _is_grammar_wrapper_active(self, grammar_wrapper):
+        return grammar_wrapper.active and (not self._any_exclusive_grammars or grammar_wrapper.exclusive)
+
+    def _rebuild_kaldi_rules_activity(self):
         self._active_kaldi_rules = set()
+        self._active_kaldi_rules_changed()
         self._kaldi_rules_activity = [False] * self._compiler.num_kaldi_rules
         for grammar_wrapper in self._iter_all_grammar_wrappers_dynamically():
-            if grammar_wrapper.active and (not self._any_exclusive_grammars or (self._any_exclusive_grammars and grammar_wrapper.exclusive)):
+            if self._is_grammar_wrapper_active(grammar_wrapper):
                 for kaldi_rule in grammar_wrapper.kaldi_rule_by_rule_dict.values():
                     if kaldi_rule.active:
                         self._active_kaldi_rules.add(kaldi_rule)
                         self._kaldi_rules_activity[kaldi_rule.id] = True
-        self._log.debug("active kaldi_rules: %s", [kr.name for kr in self._active_kaldi_rules])
-        return self._kaldi_rules_activity
+        self._update_kaldi_list_rules_activity()
+
+    def _update_kaldi_rules_activity(self, grammar_wrapper, kaldi_rules=None):
+        """ Updates the activity of the given KaldiRules of the given grammar (default: all of them), and of the list
+        sub-FSTs they link to. """
+        if self._kaldi_rules_activity is None:
+            return  # Will be rebuilt before use
+        if kaldi_rules is None:
+            kaldi_rules = list(grammar_wrapper.kaldi_rule_by_rule_dict.values())
+        grammar_active = self._is_grammar_wrapper_active(grammar_wrapper)
+        for kaldi_rule in kaldi_rules:
+            active = grammar_active and kaldi_rule.active
+            self._kaldi_rules_activity[kaldi_rule.id] = active
+            if active != (kaldi_rule in self._active_kaldi_rules):
+                if active:
+                    self._active_kaldi_rules.add(kaldi_rule)
+                else:
+                    self._active_kaldi_rules.discard(kaldi_rule)
+                self._active_kaldi_rules_changed()
+        self._update_kaldi_list_rules_activity(kaldi_rules)
+
+    def _active_kaldi_rules_changed(self):
+        self._active_kaldi_rules_version += 1
+        self._sorted_active_kaldi_rules = None
+
+    def _get_sorted_active_kaldi_rules(self):
+        """ Returns the active KaldiRules in the order to attempt parsing with them, which is kept between phrases. """
+        if self._sorted_active_kaldi_rules is None:
+            self._sorted_active_kaldi_rules = sorted(self._active_kaldi_rules, key=lambda kr: 100 if kr.has_dictation else 0)
+        return self._sorted_active_kaldi_rules
+
+    def _update_kaldi_list_rules_activity(self, kaldi_rules=None):
+        """ Enables the list sub-FSTs linked from the active rules, considering only the lists referenced by the given
+        KaldiRules (default: all lists). The decoder checks the activity of every #nonterm:ruleN it enters, including
+        those linked from other rules, so list sub-FSTs must be active to be reachable; a list recognized on its own is
+        instead rejected by _parse_output(). """
+        for list_id, kaldi_list_rule in self._compiler.kaldi_list_rule_by_listreflist_dict.items():
+            referencing_kaldi_rules = self._compiler.kaldi_rules_by_listreflist_dict[list_id]
+            if kaldi_rules is None or not referencing_kaldi_rules.isdisjoint(kaldi_rules):
+                self._kaldi_rules_activity[kaldi_list_rule.id] = not self._active_kaldi_rules.isdisjoint(referencing_kaldi_rules)
 
     def _parse_recognition(self, output, mimic=False):
+        kaldi_rule, words, words_are_dictation_mask = self._parse_output(output, mimic=mimic)
+        if kaldi_rule is None:
+            # FIXME
+            results_obj = None
+            self._recognition_observer_manager.notify_failure(results_obj)
+            return None, ''
+
+        words = tuple(words)
+        grammar_wrapper = self._get_grammar_wrapper(kaldi_rule.parent_grammar)
+        with debug_timer(self._log.debug, "dragonfly parse time"):
+            grammar_wrapper.recognition_callback(words, kaldi_rule.parent_rule, words_are_dictation_mask)
+
+        parsed_output = ' '.join(words)
+        return kaldi_rule, parsed_output
+
+    def _parse_output(self, output, mimic=False):
+        """ Returns the KaldiRule, words, and words_are_dictation_mask for the given decoder output, with a KaldiRule of
+            None if it could not be parsed. Does not process the recognition. """
         if mimic or self._compiler.parsing_framework == 'text':
             with debug_timer(self._log.debug, "kaldi_rule parse time"):
-                detect_ambiguity = False
-                results = []
-                for kaldi_rule in sorted(self._active_kaldi_rules, key=lambda kr: 100 if kr.has_dictation else 0):
-                    self._log.debug("attempting to parse %r with %s", output, kaldi_rule)
-                    words = self._compiler.parse_output_for_rule(kaldi_rule, output)
-                    if words is None:
-                        continue
-                    # self._log.debug("success %d", kaldi_rule_id)
-                    # Pass (kaldi_rule, words) to below.
-                    results.append((kaldi_rule, words))
-                    if not detect_ambiguity:
-                        break
+                # Results are cached for each output and set of active rules, until any rule is recompiled
+                cache_key = (output, self._active_kaldi_rules_version)
+                results = self._parse_cache.pop(cache_key, None)
+                if results is not None:
+                    self.parse_cache_hits += 1
+                else:
+                    self.parse_cache_misses += 1
+                    detect_ambiguity = False
+                    results = []
+                    for kaldi_rule in self._get_sorted_active_kaldi_rules():
+                        self._log.debug("attempting to parse %r with %s", output, kaldi_rule)
+                        words = self._compiler.parse_output_for_rule(kaldi_rule, output)
+                        if words is None:
+                            continue
+                        # self._log.debug("success %d", kaldi_rule_id)
+                        # Pass (kaldi_rule, words) to below.
+                        results.append((kaldi_rule, words))
+                        if not detect_ambiguity:
+                            break
+                    # FIXME: improve sorting criterion
+                    results = tuple(sorted(results, key=lambda result: 100 if result[0].has_dictation else 0))
+                self._parse_cache[cache_key] = results  # Most recently used
+                if len(self._parse_cache) > self.parse_cache_size:
+                    self._parse_cache.popitem(last=False)
 
                 if not results:
                     if not mimic:
                         # We should never receive an unparsable recognition from kaldi, only from mimic
                         self._log.error("unable to parse recognition: %r" % output)
-
-                    # FIXME
-                    results_obj = None
-                    self._recognition_observer_manager.notify_failure(results_obj)
-                    return None, ''
+                    return None, [], []
                 if len(results) > 1:
                     self._log.warning("ambiguity in recognition: %r" % output)
-                    # FIXME: improve sorting criterion
-                    results.sort(key=lambda result: 100 if result[0].has_dictation else 0)
 
                 kaldi_rule, words = results[0]
                 words_are_dictation_mask = [True] * len(words)  # FIXME: hack, but seems to work fine? only a problem for ambiguous rules containing dictation, which should be handled above
@@ -473,15 +663,14 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         elif self._compiler.parsing_framework == 'token':
             kaldi_rule, words, words_are_dictation_mask = self._compiler.parse_output(output,
                 dictation_info_func=lambda: (self.audio_store.current_audio_data, self._decoder.get_word_align(output)))
+            if kaldi_rule is not None and kaldi_rule.parent_rule is None:
+                # A list sub-FST was recognized on its own, rather than through a rule linking to it
+                kaldi_rule, words = None, []
             if kaldi_rule is None:
                 if words != []:
                     # We should never receive an unparsable recognition from kaldi, unless it's empty (from noise)
                     self._log.error("unable to parse recognition: %r" % output)
-
-                # FIXME
-                results_obj = None
-                self._recognition_observer_manager.notify_failure(results_obj)
-                return None, ''
+                return None, [], []
 
             if self._log.isEnabledFor(12):
                 try:
@@ -492,13 +681,7 @@ class KaldiEngine(EngineBase, DelegateTimerManagerInterface):
         else:
             raise EngineError("Invalid _compiler.parsing_framework")
 
-        words = tuple(words)
-        grammar_wrapper = self._get_grammar_wrapper(kaldi_rule.parent_grammar)
-        with debug_timer(self._log.debug, "dragonfly parse time"):
-            grammar_wrapper.recognition_callback(words, kaldi_rule.parent_rule, words_are_dictation_mask)
-
-        parsed_output = ' '.join(words)
-        return kaldi_rule, parsed_output
+        return kaldi_rule, words, words_are_dictation_mask
 
 
 #===========================================================================
@@ -534,9 +717,10 @@ class GrammarWrapper(GrammarWrapperBase):
                     # Return early if the method didn't return True or equiv.
                     return
 
-            state = State(words_rules, rule_names, self.engine)
+            state = State(words_rules, rule_names, self.engine,
+                          self.grammar.memoize_decoding)
             state.initialize_decoding()
-            for result in rule.decode(state):
+            for result in self.grammar.decode_rule(rule, state):
                 if state.finished():
                     root = state.build_parse_tree()
                     notify_args = (words, rule, root, results_obj)
@@ -31,8 +31,6 @@ from locale import getpreferredencoding
 
 from ..base import CompilerBase, CompilerError
 
-import dragonfly.grammar.elements as elements_
-
 
 #===========================================================================
 
@@ -64,20 +62,25 @@ class NatlinkCompiler(CompilerBase):
     #-----------------------------------------------------------------------
     # Methods for compiling elements.
 
+    def _compile_repetition(self, element, compiler):
+        # Use the native repetition construct if optimizing and more than
+        #  one repetition is allowed.  Otherwise compile the equivalent
+        #  sequence of nested optional elements.
+        sequence = element.get_expanded_sequence()
+        if element.optimize and len(sequence.children) > 1:
+            compiler.start_repetition()
+            self.compile_element(element.child, compiler)
+            compiler.end_repetition()
+        else:
+            self._compile_sequence(sequence, compiler)
+
     def _compile_sequence(self, element, compiler):
         children = element.children
         if len(children) > 1:
-            # Compile Sequence and Repetition elements differently.
-            is_rep = isinstance(element, elements_.Repetition)
-            if is_rep and element.optimize:
-                compiler.start_repetition()
-                self.compile_element(children[0], compiler)
-                compiler.end_repetition()
-            else:
-                compiler.start_sequence()
-                for c in children:
-                    self.compile_element(c, compiler)
-                compiler.end_sequence()
+            compiler.start_sequence()
+            for c in children:
+                self.compile_element(c, compiler)
+            compiler.end_sequence()
         elif len(children) == 1:
             self.compile_element(children[0], compiler)
 
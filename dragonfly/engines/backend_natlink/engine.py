@@ -276,7 +276,9 @@ class NatlinkEngine(EngineBase):
         grammar_object = wrapper.grammar_object
         grammar_object.deactivate(rule.name)
 
-    def update_list(self, lst, grammar):
+    def update_list(self, lst, grammar, delta=None):
+        # List deltas are not used; the list is emptied and repopulated
+        #  instead.
         wrapper = self._get_grammar_wrapper(grammar)
         if not wrapper:
             return
@@ -437,11 +439,12 @@ class GrammarWrapper(GrammarWrapperBase):
         # Iterates through this grammar's rules, attempting
         #  to decode each.  If successful, call that rule's
         #  method for processing the recognition and return.
-        s = state_.State(words_rules, self.grammar._rule_names, self.engine)
-        for r in self.grammar._rules:
+        s = state_.State(words_rules, self.grammar._rule_names, self.engine,
+                         self.grammar.memoize_decoding)
+        for r in self.grammar.get_candidate_rules(words):
             if not (r.active and r.exported): continue
             s.initialize_decoding()
-            for result in r.decode(s):
+            for result in self.grammar.decode_rule(r, s):
                 if s.finished():
                     self._retain_audio(words, results, r.name)
                     root = s.build_parse_tree()
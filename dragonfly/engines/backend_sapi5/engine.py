@@ -189,7 +189,8 @@ class Sapi5SharedEngine(EngineBase, DelegateTimerManagerInterface):
         grammar_handle = self._get_grammar_wrapper(grammar).handle
         grammar_handle.CmdSetRuleState(rule.name, constants.SGDSInactive)
 
-    def update_list(self, lst, grammar):
+    def update_list(self, lst, grammar, delta=None):
+        # List deltas are not used; the list rule is rebuilt instead.
         grammar_handle = self._get_grammar_wrapper(grammar).handle
         list_rule_name = "__list_%s" % lst.name
         rule_handle = grammar_handle.Rules.FindRule(list_rule_name)
@@ -620,13 +621,14 @@ class GrammarWrapper(GrammarWrapperBase):
                                                       results=newResult):
                     return
 
-            s = State(results, rule_set, self.engine)
-            for r in self.grammar.rules:
+            s = State(results, rule_set, self.engine,
+                      self.grammar.memoize_decoding)
+            for r in self.grammar.get_candidate_rules(words):
                 if not (r.active and r.exported):
                     continue
 
                 s.initialize_decoding()
-                for result in r.decode(s):
+                for result in self.grammar.decode_rule(r, s):
                     if s.finished():
                         # Notify recognition observers, then process the
                         # rule.
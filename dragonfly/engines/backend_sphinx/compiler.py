@@ -111,21 +111,36 @@ class JSGFCompiler(CompilerBase):
     # instead.
 
     def compile_list(self, lst, *args, **kwargs):
+        expansions = [self.compile_list_item(item, *args, **kwargs)
+                      for item in self.get_list_items(lst)]
+        return self.build_list_rule(lst, expansions, *args, **kwargs)
+
+    def get_list_items(self, lst):
         if isinstance(lst, List):
-            literal_list = [elements_.Literal(item) for item in lst]
+            return list(lst)
         elif isinstance(lst, DictList):
             keys = list(lst.keys())
             keys.sort()
-            literal_list = [elements_.Literal(key) for key in keys]
+            return keys
         else:
             raise CompilerError("Cannot compile dragonfly List %s"
                                 % lst)
 
-        return jsgf.HiddenRule(
-            self.get_reference_name(lst),
-            self.compile_element(elements_.Alternative(literal_list), *args,
-                                 **kwargs)
-        )
+    def compile_list_item(self, item, *args, **kwargs):
+        return self.compile_element(elements_.Literal(item), *args,
+                                    **kwargs)
+
+    def build_list_rule(self, lst, expansions, *args, **kwargs):
+        # Build the hidden rule for a list from its compiled items in the
+        # same way as an Alternative of Literals is compiled.
+        if len(expansions) > 1:
+            expansion = jsgf.AlternativeSet(*expansions)
+        elif len(expansions) == 1:
+            expansion = expansions[0]
+        else:
+            expansion = self.compile_element(elements_.Empty(), *args,
+                                             **kwargs)
+        return jsgf.HiddenRule(self.get_reference_name(lst), expansion)
 
     def recompile_list(self, lst, jsgf_grammar):
         # Used from the GrammarWrapper class to get an updated list and any
@@ -149,20 +164,21 @@ class JSGFCompiler(CompilerBase):
                                   % (self, element))
 
     def _compile_repetition(self, element, *args, **kwargs):
-        # Compile the first element only; pyjsgf doesn't support limits on
-        # repetition (yet).
-        children = element.children
-        if len(children) > 1:
-            self._log.debug("Ignoring limits of repetition element %s."
-                            % element)
-        compiled_child = self.compile_element(children[0], *args, **kwargs)
-        return jsgf.Repeat(compiled_child)
+        # Compile a repeat of the child element; pyjsgf doesn't support
+        # limits on repetition (yet).
+        self._log.debug("Ignoring limits of repetition element %s."
+                        % element)
+        compiled_child = self.compile_element(element.child, *args,
+                                              **kwargs)
+        return self._build_repeat(element, compiled_child)
+
+    def _build_repeat(self, element, compiled_child):
+        repeat = jsgf.Repeat(compiled_child)
+        if element.min == 0:
+            return jsgf.OptionalGrouping(repeat)
+        return repeat
 
     def _compile_sequence(self, element, *args, **kwargs):
-        # Compile Repetition elements separately.
-        if isinstance(element, elements_.Repetition):
-            return self._compile_repetition(element, *args, **kwargs)
-
         children = element.children
         if len(children) > 1:
             return jsgf.Sequence(*[
@@ -251,17 +267,12 @@ class SphinxJSGFCompiler(JSGFCompiler):
     # ----------------------------------------------------------------------
     # Methods for compiling elements.
 
-    def _compile_repetition(self, element, *args, **kwargs):
-        # Compile the first element only; pyjsgf doesn't support limits on
-        # repetition (yet).
-        children = element.children
-        if len(children) > 1:
-            self._log.debug("Ignoring limits of repetition element %s."
-                            % element)
-
+    def _build_repeat(self, element, compiled_child):
         # Return a PatchedRepeat instead of a normal Repeat expansion.
-        compiled_child = self.compile_element(children[0], *args, **kwargs)
-        return PatchedRepeat(compiled_child)
+        repeat = PatchedRepeat(compiled_child)
+        if element.min == 0:
+            return jsgf.OptionalGrouping(repeat)
+        return repeat
 
     def _compile_literal(self, element, *args, **kwargs):
         # Build literals as sequences and use <NULL> for unknown words.
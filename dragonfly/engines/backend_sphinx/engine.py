@@ -41,6 +41,7 @@ from .misc import (EngineConfig, WaveRecognitionObserver,
                    get_decoder_config_object)
 from .recobs import SphinxRecObsManager
 from .recording import PyAudioRecorder
+from .search_pool import SearchPool
 from .timer import SphinxTimerManager
 from .training import write_training_data, write_transcript_files
 
@@ -66,6 +67,7 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
 
     _name = "sphinx"
     DictationContainer = DictationContainerBase
+    _loads_list_items = True  # List items are compiled into the JSGF grammar.
 
     def __init__(self):
         EngineBase.__init__(self)
@@ -84,6 +86,7 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
 
         # Set other variables
         self._decoder = None
+        self._search_pool = None
         self._audio_buffers = []
         self.compiler = SphinxJSGFCompiler(self)
         self._recognition_observer_manager = SphinxRecObsManager(self)
@@ -152,6 +155,8 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
             "RATE",
             "SAMPLE_WIDTH",
             "FRAMES_PER_BUFFER",
+
+            "SEARCH_WORKERS",
         ]
 
         # Get default values and set them they are missing.
@@ -181,6 +186,12 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
         self._decoder = PocketSphinx(decoder_config)
         self._valid_searches.add(self._default_search_name)
 
+        # Initialise decoders for searching grammars concurrently if
+        # requested.
+        search_workers = int(self._config.SEARCH_WORKERS)
+        if search_workers > 1:
+            self._search_pool = SearchPool(decoder_config, search_workers)
+
         # Set up callback function wrappers
         def hypothesis(hyp):
             # Set default search result.
@@ -250,8 +261,11 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
         self._recognising = False
         self._recorder.stop()
 
-        # Free the decoder and clear audio buffers.
+        # Free the decoders and clear audio buffers.
         self._decoder = None
+        if self._search_pool:
+            self._search_pool.close()
+            self._search_pool = None
         self._audio_buffers = []
 
         # Reset other variables
@@ -374,9 +388,11 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
             raise EngineError("no public rules found in the grammar")
 
         # Set the JSGF search.
+        compiled = _map_to_str(compiled)
         self._decoder.end_utterance()
-        self._decoder.set_jsgf_string(wrapper.search_name,
-                                      _map_to_str(compiled))
+        self._decoder.set_jsgf_string(wrapper.search_name, compiled)
+        if self._search_pool:
+            self._search_pool.set_search(wrapper.search_name, compiled)
         activate_search_if_necessary()
 
         # Grammar search has been loaded, so set the wrapper's flag.
@@ -398,6 +414,9 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
             # Remove the search from the valid searches set.
             self._valid_searches.remove(name)
 
+            if self._search_pool:
+                self._search_pool.unset_search(name)
+
         # Change to the default search to avoid possible segmentation faults
         # from Pocket Sphinx which crash Python.
         self._set_default_search()
@@ -525,7 +544,7 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
             self._log.exception("Failed to activate grammar %s: %s."
                                 % (grammar, e))
 
-    def update_list(self, lst, grammar):
+    def update_list(self, lst, grammar, delta=None):
         wrapper = self._get_grammar_wrapper(grammar)
         if not wrapper:
             return
@@ -533,7 +552,7 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
         # Unfortunately there is no way to update lists for Pocket Sphinx
         # without reloading the grammar, so we'll update the list's JSGF
         # rule and reload.
-        wrapper.update_list(lst)
+        wrapper.update_list(lst, delta)
 
         # Reload the grammar.
         try:
@@ -542,6 +561,24 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
             self._log.exception("Failed to update list %s: %s."
                                 % (lst, e))
 
+    def _apply_list_updates(self, list_updates):
+        # Update the lists of each grammar, then reload each grammar once.
+        wrappers = []
+        for lst, grammar, delta in list_updates:
+            wrapper = self._get_grammar_wrapper(grammar)
+            if not wrapper:
+                continue
+            wrapper.update_list(lst, delta)
+            if wrapper not in wrappers:
+                wrappers.append(wrapper)
+
+        for wrapper in wrappers:
+            try:
+                self._set_grammar(wrapper, False)
+            except Exception as e:
+                self._log.exception("Failed to update lists of grammar "
+                                    "%s: %s." % (wrapper.grammar, e))
+
     def set_exclusiveness(self, grammar, exclusive):
         wrapper = self._get_grammar_wrapper(grammar)
         if not wrapper:
@@ -828,23 +865,33 @@ class SphinxEngine(EngineBase, DelegateTimerManagerInterface):
 
         # Batch process audio buffers for each active grammar. Store each
         # hypothesis.
-        for wrapper in wrappers:
-            if mimicking:
-                # Just use 'speech' for everything if mimicking.
-                hyp = speech
-            else:
-                # Switch to the search for this grammar and re-process the
-                # audio.
-                self._set_grammar(wrapper, True)
-                hyp = self._decoder.batch_process(
-                    self._audio_buffers,
-                    use_callbacks=False
-                )
-                if hyp:
-                    hyp = hyp.hypstr
-
-            # Set the hypothesis in the dictionary.
-            hypotheses[wrapper.search_name] = hyp
+        if self._search_pool and not mimicking and len(wrappers) > 1:
+            # Make sure each grammar's search is up to date, then search
+            # them all concurrently using the search pool's decoders.
+            for wrapper in wrappers:
+                self._set_grammar(wrapper, False)
+            hypotheses = self._search_pool.process(
+                [wrapper.search_name for wrapper in wrappers],
+                self._audio_buffers
+            )
+        else:
+            for wrapper in wrappers:
+                if mimicking:
+                    # Just use 'speech' for everything if mimicking.
+                    hyp = speech
+                else:
+                    # Switch to the search for this grammar and re-process the
+                    # audio.
+                    self._set_grammar(wrapper, True)
+                    hyp = self._decoder.batch_process(
+                        self._audio_buffers,
+                        use_callbacks=False
+                    )
+                    if hyp:
+                        hyp = hyp.hypstr
+
+                # Set the hypothesis in the dictionary.
+                hypotheses[wrapper.search_name] = hyp
 
         # Get the best hypothesis.
         speech = self._get_best_hypothesis(list(hypotheses.values()))
@@ -26,6 +26,9 @@ class GrammarWrapper(GrammarWrapperBase):
         self._search_name = search_name
         self.exclusive = False
 
+        # Compiled items of each list, used to apply list deltas.
+        self._list_items = {}
+
         # Compile the grammar into a JSGF grammar and set the language.
         self._jsgf_grammar = engine.compiler.compile_grammar(grammar)
         self._jsgf_grammar.language_name = engine.language
@@ -51,13 +54,33 @@ class GrammarWrapper(GrammarWrapperBase):
             jsgf_rule.disable()
             self.set_search = True
 
-    def update_list(self, lst):
-        # Recompile the list again.
+    def update_list(self, lst, delta=None):
+        # Recompile the list's items, or only the items added by the
+        # delta if the list was compiled previously.
         grammar = self._jsgf_grammar
+        compiler = self.engine.compiler
         name = self._get_reference_name(lst.name)
         old_rule = grammar.get_rule_from_name(name)
-        new_rule, unknown_words = self.engine.compiler.recompile_list(
-            lst, grammar
+        unknown_words = set()
+        items = self._list_items.get(name)
+        if delta is None or items is None:
+            items = [(item, compiler.compile_list_item(item, grammar,
+                                                       unknown_words))
+                     for item in compiler.get_list_items(lst)]
+        else:
+            removed = list(delta.removed)
+            kept = []
+            for item, expansion in items:
+                if item in removed:
+                    removed.remove(item)
+                else:
+                    kept.append((item, expansion))
+            items = kept + [(item, compiler.compile_list_item(
+                item, grammar, unknown_words)) for item in delta.added]
+        self._list_items[name] = items
+        new_rule = compiler.build_list_rule(
+            lst, [expansion for _, expansion in items], grammar,
+            unknown_words
         )
 
         # Only replace the old rule if the list has changed.
@@ -156,12 +179,13 @@ class GrammarWrapper(GrammarWrapperBase):
         # Iterate through this grammar's rules, attempting to decode each.
         # If successful, call that rule's method for processing the
         # recognition and return.
-        s = state_.State(words_rules, self.grammar.rule_names, self.engine)
-        for r in self.grammar.rules:
+        s = state_.State(words_rules, self.grammar.rule_names, self.engine,
+                         self.grammar.memoize_decoding)
+        for r in self.grammar.get_candidate_rules(words):
             if not (r.active and r.exported):
                 continue
             s.initialize_decoding()
-            for _ in r.decode(s):
+            for _ in self.grammar.decode_rule(r, s):
                 if s.finished():
                     # Build the parse tree used to process this rule.
                     root = s.build_parse_tree()
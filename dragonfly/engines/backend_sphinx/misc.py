@@ -91,6 +91,11 @@ class EngineConfig(object):
     RATE = 16000              # 16kHz sample rate
     FRAMES_PER_BUFFER = 2048  # frames per audio buffer
 
+    # Number of decoders used to search active grammars concurrently at the
+    # end of each utterance. The default of 1 searches them one at a time
+    # with the main decoder.
+    SEARCH_WORKERS = 1
+
 
 class WaveRecognitionObserver(RecognitionObserver):
     """ Observer class used in :meth:`SphinxEngine.process_wave_file`. """
@@ -0,0 +1,222 @@
+#
+# This file is part of Dragonfly.
+# (c) Copyright 2007, 2008 by Christo Butcher
+# Licensed under the LGPL.
+#
+#   Dragonfly is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published
+#   by the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Dragonfly is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public
+#   License along with Dragonfly.  If not, see
+#   <http://www.gnu.org/licenses/>.
+#
+
+"""
+Pool of Pocket Sphinx decoders for searching grammars concurrently
+"""
+
+import logging
+import threading
+
+from six.moves import queue
+from sphinxwrapper import PocketSphinx
+
+
+class _SearchWorker(object):
+    """
+    Thread with its own Pocket Sphinx decoder and set of JSGF searches.
+
+    The decoder is only used from the worker's thread. Tasks are run in
+    the order they are submitted. Which searches are set in the decoder
+    is tracked by the pool.
+    """
+
+    def __init__(self, decoder_config, index):
+        self._log = logging.getLogger("engine")
+        self.index = index
+        self.decoder = PocketSphinx(decoder_config)
+        self._default_search = self.decoder.active_search
+
+        # Number of times a JSGF search has been set in the decoder.
+        self.set_count = 0
+
+        self._tasks = queue.Queue()
+        self._thread = threading.Thread(target=self._run,
+                                        name="SphinxSearchWorker-%d" % index)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def submit(self, func, *args):
+        self._tasks.put((func, args))
+
+    def stop(self, timeout=None):
+        self._tasks.put(None)
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            task = self._tasks.get()
+            if task is None:
+                break
+            func, args = task
+            func(*args)
+
+    def search(self, name, jsgf_string, buffers, results):
+        """
+        Re-process the audio buffers using the given search, first setting
+        or replacing the search if *jsgf_string* is not ``None``. The
+        worker index, name, hypothesis string (or ``None``) and whether
+        the search succeeded are put into the *results* queue.
+        """
+        hyp = None
+        success = False
+        try:
+            decoder = self.decoder
+            decoder.end_utterance()
+            if jsgf_string is not None:
+                self.set_count += 1
+                decoder.set_jsgf_string(name, jsgf_string)
+            decoder.active_search = name
+            hyp = decoder.batch_process(buffers, use_callbacks=False)
+            if hyp:
+                hyp = hyp.hypstr
+            success = True
+        except Exception as e:
+            self._log.exception("Failed to process search %s: %s"
+                                % (name, e))
+        finally:
+            results.put((self.index, name, hyp, success))
+
+    def unset_search(self, name):
+        # Change to the default search first to avoid possible
+        # segmentation faults from Pocket Sphinx.
+        try:
+            self.decoder.end_utterance()
+            self.decoder.active_search = self._default_search
+            self.decoder.unset_search(name)
+        except Exception as e:
+            self._log.exception("Failed to unset search %s: %s"
+                                % (name, e))
+
+
+class SearchPool(object):
+    """
+    Pool of decoder threads used to re-process an utterance with the
+    searches of several grammars at once.
+
+    Each worker has its own decoder, so searches are set in workers as
+    they are needed. Pocket Sphinx releases the GIL while decoding, so
+    the searches run in parallel.
+
+    The pool's methods should only be called from one thread.
+    """
+
+    def __init__(self, decoder_config, size):
+        self._workers = [_SearchWorker(decoder_config, i)
+                         for i in range(size)]
+
+        # JSGF strings and versions of the grammar searches.
+        self._searches = {}
+        self._version = 0
+
+        # Versions of the searches set in each worker's decoder, by
+        # (worker index, name). This is only used from the pool's thread
+        # and is updated as tasks are submitted, which workers run in
+        # order.
+        self._worker_searches = {}
+
+    @property
+    def size(self):
+        """ The number of decoders in the pool. """
+        return len(self._workers)
+
+    def set_search(self, name, jsgf_string):
+        """
+        Set or replace the JSGF search with the given name. Workers
+        update their decoders the next time they use the search.
+        """
+        self._version += 1
+        self._searches[name] = (self._version, jsgf_string)
+
+    def unset_search(self, name):
+        """ Unset the search with the given name in all decoders. """
+        if self._searches.pop(name, None) is None:
+            return
+        for worker in self._workers:
+            if self._worker_searches.pop((worker.index, name), None):
+                worker.submit(worker.unset_search, name)
+
+    def _assign(self, names):
+        """
+        Assign each search to a worker, returning a list of names for each
+        worker.
+
+        Searches stay with a worker which already has their current
+        version set, as long as that keeps the load balanced. The other
+        searches go to the least busy workers.
+        """
+        size = len(self._workers)
+        max_load = (len(names) + size - 1) // size
+        assignments = [[] for _ in self._workers]
+        unassigned = []
+        for name in names:
+            version, _ = self._searches[name]
+            for i, assigned in enumerate(assignments):
+                if (len(assigned) < max_load and
+                        self._worker_searches.get((i, name)) == version):
+                    assigned.append(name)
+                    break
+            else:
+                unassigned.append(name)
+        for name in unassigned:
+            min(assignments, key=len).append(name)
+        return assignments
+
+    def process(self, names, buffers):
+        """
+        Re-process the audio buffers with each of the given searches.
+
+        The searches are spread across the workers, favouring workers
+        which already have a search set, and processed concurrently.
+
+        :param names: names of searches set with :meth:`set_search`
+        :param buffers: list of audio buffers for the utterance
+        :returns: dict of hypothesis strings (or ``None``) by search name
+        """
+        # Submit the searches, setting them in the decoders as necessary,
+        # and wait for the results.
+        results = queue.Queue()
+        for worker, assigned in zip(self._workers, self._assign(names)):
+            for name in assigned:
+                version, jsgf_string = self._searches[name]
+                key = (worker.index, name)
+                if self._worker_searches.get(key) == version:
+                    jsgf_string = None
+                self._worker_searches[key] = version
+                worker.submit(worker.search, name, jsgf_string, buffers,
+                              results)
+
+        hypotheses = {}
+        for _ in names:
+            i, name, hyp, success = results.get()
+            if not success:
+                # Set the search again the next time it is used.
+                self._worker_searches.pop((i, name), None)
+            hypotheses[name] = hyp
+        return dict((name, hypotheses[name]) for name in names)
+
+    def close(self):
+        """ Stop the worker threads and free their decoders. """
+        for worker in self._workers:
+            worker.stop()
+            worker.decoder = None
+        self._workers = []
+        self._searches.clear()
+        self._worker_searches.clear()
@@ -48,6 +48,7 @@ class TextInputEngine(EngineBase):
 
     _name = "text"
     DictationContainer = DictationContainerBase
+    _loads_list_items = True  # List items are read when decoding.
 
     # -----------------------------------------------------------------------
 
@@ -113,8 +114,9 @@ class TextInputEngine(EngineBase):
         # No engine-specific rule deactivation required.
         pass
 
-    def update_list(self, lst, grammar):
-        # No engine-specific list update is required.
+    def update_list(self, lst, grammar, delta=None):
+        # No engine-specific list update is required.  List deltas are
+        #  applied to the list's word trie used for decoding.
         pass
 
     def set_exclusiveness(self, grammar, exclusive):
@@ -309,12 +311,13 @@ class GrammarWrapper(GrammarWrapperBase):
         # Iterate through this grammar's rules, attempting to decode each.
         # If successful, call that rule's method for processing the
         # recognition and return.
-        s = state_.State(words_rules, self.grammar.rule_names, self.engine)
-        for r in self.grammar.rules:
+        s = state_.State(words_rules, self.grammar.rule_names, self.engine,
+                         self.grammar.memoize_decoding)
+        for r in self.grammar.get_candidate_rules(words):
             if not (r.active and r.exported):
                 continue
             s.initialize_decoding()
-            for _ in r.decode(s):
+            for _ in self.grammar.decode_rule(r, s):
                 if s.finished():
                     try:
                         root = s.build_parse_tree()
@@ -40,6 +40,7 @@ class CompilerBase(object):
     _log = logging.getLogger("engine.compiler")
 
     element_compilers = [
+        (elements_.Repetition,  lambda s,e,*a,**k: s._compile_repetition(e,*a,**k)),
         (elements_.Sequence,    lambda s,e,*a,**k: s._compile_sequence(e,*a,**k)),
         (elements_.Alternative, lambda s,e,*a,**k: s._compile_alternative(e,*a,**k)),
         (elements_.Optional,    lambda s,e,*a,**k: s._compile_optional(e,*a,**k)),
@@ -84,6 +85,12 @@ class CompilerBase(object):
                                   " for element type %s."
                                   % (self, element))
 
+    def _compile_repetition(self, element, *args, **kwargs):
+        # Compile the equivalent sequence of nested optional elements by
+        #  default.
+        sequence = element.get_expanded_sequence()
+        return self.compile_element(sequence, *args, **kwargs)
+
     _compile_sequence     = _compile_unknown_element
     _compile_alternative  = _compile_unknown_element
     _compile_optional     = _compile_unknown_element
@@ -25,9 +25,13 @@ EngineBase class
 """
 
 import logging
+import threading
+from collections import OrderedDict
+
 from .timer import Timer
 
 import dragonfly.engines
+from dragonfly.grammar.list import ListDelta
 
 
 #---------------------------------------------------------------------------
@@ -53,6 +57,80 @@ class EngineContext(object):
         self._engine.disconnect()
 
 
+#---------------------------------------------------------------------------
+
+class EngineUpdateBatch(object):
+    """
+        Context manager which defers and coalesces grammar updates.
+
+        While a batch is active, list updates and rule activations and
+        deactivations requested by grammars are stored instead of being
+        passed to the engine.  When the outermost batch exits, the
+        stored updates are coalesced and applied together:
+
+         - each list is updated once per grammar, with the deltas of all
+           its updates merged
+         - each rule is only activated or deactivated according to the
+           last request for it
+         - all list updates are applied before all rule activations and
+           deactivations, whatever order they were requested in, so
+           that rules are activated with the final items of their lists
+
+        Batches only apply to the thread which started them.  Updates
+        made by other threads while a batch is active, such as from
+        timer callbacks, are passed to the engine as usual.
+
+        This object has the same update methods as the engine, so
+        grammars use it in place of the engine while it is active.
+    """
+
+    def __init__(self, engine):
+        self._engine = engine
+        self._outermost = False
+        self._list_updates = OrderedDict()
+        self._rule_updates = OrderedDict()
+
+    def __enter__(self):
+        # Nested batches are part of the outermost batch.
+        if self._engine.update_batch is None:
+            self._outermost = True
+            self._engine._update_batch_local.batch = self
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not self._outermost:
+            return
+        self._outermost = False
+        self._engine._update_batch_local.batch = None
+
+        # Apply the updates even if an exception was raised, so that the
+        #  engine matches the state of the grammars and lists.
+        list_updates = list(self._list_updates.values())
+        rule_updates = list(self._rule_updates.values())
+        self._list_updates.clear()
+        self._rule_updates.clear()
+        self._engine._apply_updates(list_updates, rule_updates)
+
+    def update_list(self, lst, grammar, delta=None):
+        key = (id(grammar), id(lst))
+        update = self._list_updates.get(key)
+        if update is None:
+            self._list_updates[key] = (lst, grammar, delta)
+        elif update[2] is not None and delta is not None:
+            merged = ListDelta()
+            merged.merge(update[2])
+            merged.merge(delta)
+            self._list_updates[key] = (lst, grammar, merged)
+        else:
+            self._list_updates[key] = (lst, grammar, None)
+
+    def activate_rule(self, rule, grammar):
+        self._rule_updates[(id(grammar), id(rule))] = (rule, grammar, True)
+
+    def deactivate_rule(self, rule, grammar):
+        self._rule_updates[(id(grammar), id(rule))] = (rule, grammar, False)
+
+
 #---------------------------------------------------------------------------
 
 class EngineBase(object):
@@ -62,6 +140,10 @@ class EngineBase(object):
     _name = "base"
     _timer_manager = None
 
+    # Whether loading a grammar also loads the current items of its lists,
+    #  in which case grammars don't update their lists after loading.
+    _loads_list_items = False
+
     #-----------------------------------------------------------------------
 
     def __init__(self):
@@ -70,6 +152,7 @@ class EngineBase(object):
 
         self._grammar_wrappers = {}
         self._recognition_observer_manager = None
+        self._update_batch_local = threading.local()
 
 #    def __del__(self):
 #        try:
@@ -154,7 +237,7 @@ class EngineBase(object):
         raise NotImplementedError("Virtual method not implemented for"
                                   " engine %s." % self)
 
-    def update_list(self, lst, grammar):
+    def update_list(self, lst, grammar, delta=None):
         raise NotImplementedError("Virtual method not implemented for"
                                   " engine %s." % self)
 
@@ -183,6 +266,72 @@ class EngineBase(object):
         """ Alias of :meth:`set_exclusiveness`. """
         self.set_exclusiveness(grammar, exclusive)
 
+    #-----------------------------------------------------------------------
+    # Methods for batching grammar updates.
+
+    @property
+    def update_batch(self):
+        """
+            The active :class:`EngineUpdateBatch` of the current thread,
+            or *None* if grammar updates are not being batched.
+        """
+        return getattr(self._update_batch_local, "batch", None)
+
+    def batch_updates(self):
+        """
+            Context manager which defers grammar updates and applies them
+            together afterwards.
+
+            List updates and rule activations and deactivations made in a
+            ``with engine.batch_updates():`` block, across any number of
+            lists and grammars, are coalesced and passed to the engine
+            when the block exits.  Engines can then recompile each
+            affected rule once.  Only updates made by the current thread
+            are batched.
+        """
+        return EngineUpdateBatch(self)
+
+    def _apply_updates(self, list_updates, rule_updates):
+        """
+            Apply coalesced grammar updates.
+
+            *list_updates* is a list of ``(list, grammar, delta)``
+            tuples and *rule_updates* a list of ``(rule, grammar,
+            active)`` tuples.  Updates for grammars which have since
+            been unloaded and list updates which change nothing are
+            skipped.  List updates are applied first, so that rules are
+            activated with the final items of their lists.
+        """
+        list_updates = [(lst, grammar, delta)
+                        for lst, grammar, delta in list_updates
+                        if self._is_loaded(grammar)
+                        and (delta is None or delta)]
+        rule_updates = [(rule, grammar, active)
+                        for rule, grammar, active in rule_updates
+                        if self._is_loaded(grammar)]
+        if list_updates:
+            self._apply_list_updates(list_updates)
+        if rule_updates:
+            self._apply_rule_updates(rule_updates)
+
+    def _apply_list_updates(self, list_updates):
+        # Engines may override this method to apply list updates
+        #  together.
+        for lst, grammar, delta in list_updates:
+            self.update_list(lst, grammar, delta)
+
+    def _apply_rule_updates(self, rule_updates):
+        # Engines may override this method to apply rule activations and
+        #  deactivations together.
+        for rule, grammar, active in rule_updates:
+            if active:
+                self.activate_rule(rule, grammar)
+            else:
+                self.deactivate_rule(rule, grammar)
+
+    def _is_loaded(self, grammar):
+        return id(grammar) in self._grammar_wrappers
+
     def _get_grammar_wrapper(self, grammar):
         wrapper_key = id(grammar)
         if wrapper_key not in self._grammar_wrappers:
@@ -0,0 +1,99 @@
+"""
+Example script for benchmarking the CMU Pocket Sphinx dragonfly engine's
+concurrent grammar searches.
+
+A number of grammars are loaded and each of the given wave files is
+recognised using the 'SphinxEngine.process_wave_file' method, first with
+the grammars searched one at a time and then with the grammars searched
+concurrently using the 'SEARCH_WORKERS' configuration option. The
+recognition results of both runs should be the same.
+
+"""
+
+from __future__ import print_function
+
+import argparse
+import time
+
+from dragonfly import get_engine, Grammar, CompoundRule
+
+
+# Phrases used to build the benchmark grammars.
+PHRASES = [
+    "hello world", "testing", "go left", "go right", "open file",
+    "close window", "select all", "copy that", "paste that", "undo that",
+    "save file", "new line", "scroll up", "scroll down", "next tab",
+    "previous tab",
+]
+
+
+def load_grammars(count):
+    grammars = []
+    for i in range(count):
+        grammar = Grammar("benchmark%d" % i)
+        for j in range(4):
+            phrase = PHRASES[(i * 4 + j) % len(PHRASES)]
+            grammar.add_rule(CompoundRule(name="rule%d" % j, spec=phrase))
+        grammar.load()
+        grammars.append(grammar)
+    return grammars
+
+
+def run(engine, files, grammar_count, search_workers):
+    # Restart the engine with the requested number of search workers.
+    engine.disconnect()
+    engine.config.SEARCH_WORKERS = search_workers
+    engine.connect()
+    grammars = load_grammars(grammar_count)
+
+    # Recognise speech from each file.
+    results = []
+    start_time = time.time()
+    try:
+        for path in files:
+            results.append(list(engine.process_wave_file(path)))
+    finally:
+        for grammar in grammars:
+            grammar.unload()
+    return results, time.time() - start_time
+
+
+def main():
+    desc = "Example script for benchmarking the 'SEARCH_WORKERS' " \
+        "configuration option using the " \
+        "'SphinxEngine.process_wave_file' method"
+    parser = argparse.ArgumentParser(description=desc)
+    parser.add_argument("files", metavar="file", nargs="+",
+                        help="A .wav file.")
+    parser.add_argument("-g", "--grammars", type=int, default=10,
+                        help="Number of grammars to load (default: 10).")
+    parser.add_argument("-w", "--workers", type=int, default=4,
+                        help="Number of search workers (default: 4).")
+    args = parser.parse_args()
+
+    # Set up the engine.
+    engine = get_engine("sphinx")
+    engine.config.START_ASLEEP = False
+
+    # Recognise the files with and without the search workers.
+    serial_results, serial_time = run(engine, args.files, args.grammars, 1)
+    results, parallel_time = run(engine, args.files, args.grammars,
+                                 args.workers)
+    engine.disconnect()
+
+    for path, words in zip(args.files, results):
+        print("%s: %s" % (path, " / ".join(words)))
+    print("%d grammars, %d files" % (args.grammars, len(args.files)))
+    print("1 search worker:   %.2f s" % serial_time)
+    print("%d search workers: %.2f s (%.1fx)"
+          % (args.workers, parallel_time,
+             serial_time / parallel_time if parallel_time else 0))
+
+    # Exit with 1 if the results differ.
+    if results != serial_results:
+        print("Results differ from those with 1 search worker!")
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,446 @@
+#
+# This file is part of Dragonfly.
+# (c) Copyright 2007, 2008 by Christo Butcher
+# Licensed under the LGPL.
+#
+#   Dragonfly is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published
+#   by the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Dragonfly is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public
+#   License along with Dragonfly.  If not, see
+#   <http://www.gnu.org/licenses/>.
+#
+
+"""
+    This file implements the CompiledDecoder class, which decodes
+    recognitions using rules compiled into a flat instruction array.
+
+    Each rule's element tree is lowered into instructions which are
+    executed by a backtracking matcher.  The matcher tries decoding
+    possibilities in the same order as the elements' :meth:`decode`
+    methods, so the parse tree built for a recognition is identical to
+    the one built by the default decoding mode.  The matcher remembers
+    which instructions have already been attempted at which word
+    positions, so it does not suffer from exponential backtracking.
+
+    Rules containing elements with overridden :meth:`decode` methods
+    cannot be compiled.  Such rules are decoded using their
+    :meth:`decode` methods instead.
+"""
+
+# pylint: disable=too-many-locals,too-many-branches,too-many-statements
+
+from logging import getLogger
+
+from .elements_basic import (Sequence, Repetition, Optional, Alternative,
+                             Literal, RuleRef, ListRef, Empty, Dictation,
+                             Impossible, _decode_overridden)
+from .rule_base      import Rule
+
+
+#---------------------------------------------------------------------------
+# Instruction opcodes.
+
+OPEN       = 0    # Open a frame for an element: (OPEN, element)
+CLOSE      = 1    # Close the most recently opened frame: (CLOSE,)
+LITERAL    = 2    # Match words: (LITERAL, element, words, words_ext)
+LIST       = 3    # Match a list item: (LIST, element, list)
+DICTATION  = 4    # Match dictated words: (DICTATION, element)
+EMPTY      = 5    # Match no words: (EMPTY, element)
+FAIL       = 6    # Fail to match: (FAIL,)
+SPLIT      = 7    # Try both targets, first to last: (SPLIT, pc1, pc2)
+JUMP       = 8    # Continue at the target: (JUMP, pc)
+CALL       = 9    # Call a rule: (CALL, pc)
+RETURN     = 10   # Return from a rule: (RETURN,)
+
+# Trace event types.
+_OPEN_EVENT  = 0
+_CLOSE_EVENT = 1
+_LEAF_EVENT  = 2
+
+
+class _Unsupported(Exception):
+    pass
+
+
+#---------------------------------------------------------------------------
+
+class CompiledDecoder(object):
+    """
+        Decoder which matches recognitions against compiled rules.
+
+        Constructor arguments:
+         - *rules* (iterable) -- the rules to compile
+
+    """
+
+    _log = getLogger("grammar.decode")
+
+    def __init__(self, rules):
+        self._program = []
+        self._entries = {}
+        self._references = {}
+        self._unsupported = set()
+
+        # Compile the given rules and any rules they reference.
+        self._pending = list(rules)
+        while self._pending:
+            self._compile_rule(self._pending.pop(0))
+
+        # Rules which call rules that could not be compiled cannot be
+        #  compiled either.
+        changed = True
+        while changed:
+            changed = False
+            for rule, references in self._references.items():
+                if rule in self._unsupported:
+                    continue
+                if references & self._unsupported:
+                    self._unsupported.add(rule)
+                    changed = True
+        for rule in self._unsupported:
+            self._entries.pop(rule, None)
+
+        # Resolve the entries of called rules.
+        for pc, instruction in enumerate(self._program):
+            if instruction[0] == CALL:
+                entry = self._entries.get(instruction[1])
+                self._program[pc] = (CALL, entry)
+
+        self._log.debug("Compiled %d rules into %d instructions; %d rules"
+                        " not compiled.", len(self._entries),
+                        len(self._program), len(self._unsupported))
+
+    #-----------------------------------------------------------------------
+    # Methods for runtime introspection.
+
+    program = property(lambda self: tuple(self._program),
+                       doc="The compiled instructions.  (Read-only)")
+
+    def is_compiled(self, rule):
+        """ Whether the given rule was compiled by this decoder. """
+        return rule in self._entries
+
+    #-----------------------------------------------------------------------
+    # Methods for compiling rules.
+
+    def _compile_rule(self, rule):
+        if rule in self._entries or rule in self._unsupported:
+            return
+
+        self._entries[rule] = len(self._program)
+        self._references[rule] = set()
+        try:
+            if (rule.imported or rule.element is None
+                    or _decode_overridden(rule, Rule)):
+                raise _Unsupported()
+            self._emit(OPEN, rule)
+            self._compile_element(rule.element, rule)
+            self._emit(CLOSE)
+            self._emit(RETURN)
+        except _Unsupported:
+            # Discard the rule's instructions.
+            del self._program[self._entries[rule]:]
+            self._unsupported.add(rule)
+
+    def _emit(self, *instruction):
+        self._program.append(instruction)
+        return len(self._program) - 1
+
+    def _patch(self, pc, *instruction):
+        self._program[pc] = instruction
+
+    def _compile_element(self, element, rule):
+        # Elements with overridden decoding cannot be compiled.  Check
+        #  the most derived supported class first.
+        if isinstance(element, RuleRef):
+            if _decode_overridden(element, RuleRef):
+                raise _Unsupported()
+            # Called rules are compiled later and resolved by the
+            #  constructor.
+            referenced = element.rule
+            self._pending.append(referenced)
+            self._references[rule].add(referenced)
+            self._emit(OPEN, element)
+            self._emit(CALL, referenced)
+            self._emit(CLOSE)
+
+        elif isinstance(element, Repetition):
+            if _decode_overridden(element, Repetition):
+                raise _Unsupported()
+
+            # Repetitions beyond the minimum are attempted greedily, like
+            #  nested Optional elements.
+            child = element.child
+            self._emit(OPEN, element)
+            for _ in range(element.min):
+                self._compile_element(child, rule)
+            splits = []
+            for _ in range(element.max_count - element.min):
+                splits.append(self._emit(None))
+                self._compile_element(child, rule)
+            for split in splits:
+                self._patch(split, SPLIT, split + 1, len(self._program))
+            self._emit(CLOSE)
+
+        elif isinstance(element, Sequence):
+            if _decode_overridden(element, Sequence):
+                raise _Unsupported()
+            self._emit(OPEN, element)
+            for child in element.children:
+                self._compile_element(child, rule)
+            self._emit(CLOSE)
+
+        elif isinstance(element, Optional):
+            if _decode_overridden(element, Optional):
+                raise _Unsupported()
+            self._emit(OPEN, element)
+            split = self._emit(None)
+            self._compile_element(element.children[0], rule)
+            end = len(self._program)
+            if element.greedy:
+                self._patch(split, SPLIT, split + 1, end)
+            else:
+                self._patch(split, SPLIT, end, split + 1)
+            self._emit(CLOSE)
+
+        elif isinstance(element, Alternative):
+            if _decode_overridden(element, Alternative):
+                raise _Unsupported()
+            self._emit(OPEN, element)
+            jumps = []
+            children = element.children
+            for i, child in enumerate(children):
+                if i < len(children) - 1:
+                    split = self._emit(None)
+                    self._compile_element(child, rule)
+                    jumps.append(self._emit(None))
+                    self._patch(split, SPLIT, split + 1,
+                                len(self._program))
+                else:
+                    self._compile_element(child, rule)
+            for jump in jumps:
+                self._patch(jump, JUMP, len(self._program))
+            self._emit(CLOSE)
+
+        elif isinstance(element, Literal):
+            if _decode_overridden(element, Literal):
+                raise _Unsupported()
+            self._emit(LITERAL, element, element.lower_words,
+                       element.lower_words_ext)
+
+        elif isinstance(element, ListRef):
+            if _decode_overridden(element, ListRef):
+                raise _Unsupported()
+            self._emit(LIST, element, element.list)
+
+        elif isinstance(element, Dictation):
+            if _decode_overridden(element, Dictation):
+                raise _Unsupported()
+            self._emit(DICTATION, element)
+
+        elif isinstance(element, Empty):
+            if _decode_overridden(element, Empty):
+                raise _Unsupported()
+            self._emit(EMPTY, element)
+
+        elif isinstance(element, Impossible):
+            if _decode_overridden(element, Impossible):
+                raise _Unsupported()
+            self._emit(FAIL)
+
+        else:
+            raise _Unsupported()
+
+    #-----------------------------------------------------------------------
+    # Methods for decoding recognitions.
+
+    def decode(self, rule, state):
+        """
+            Decode the recognition of the given *state* using *rule*.
+
+            This method is a generator yielding *state* once, with its
+            decoding stack set to the frames of the first decoding of
+            *rule* which matches all of the recognized words.  Rules which
+            were not compiled are decoded using their :meth:`decode`
+            method.
+
+        """
+        entry = self._entries.get(rule)
+        if entry is None:
+            for result in state.decode_element(rule):
+                yield result
+            return
+
+        result = self._match(entry, state)
+        if result is None:
+            return
+        for result in state.replay_frames(result, len(state.words())):
+            yield result
+
+    def _match(self, entry, state):
+        program = self._program
+        results_count = len(state.words())
+        words = state.lower_words
+        raw_words = state.words()
+        literal_words = 3 if state.quoted_words_support else 2
+        dictation_counts = None
+        base = state.index
+
+        # Call stacks are interned as integers, each mapping to a
+        #  (return pc, parent call stack, depth) tuple.  Call stack 0 is
+        #  the empty stack.
+        call_stacks = [(None, None, 0)]
+        call_stack_ids = {}
+        max_call_depth = (results_count + 1) * max(len(self._entries), 1)
+
+        # Each thread is a (pc, index, call stack, trace) tuple.  Traces
+        #  are linked lists of (event, parent) tuples.  Threads reaching
+        #  a branch which was already attempted with the same index and
+        #  call stack cannot succeed, because the earlier attempt failed.
+        visited = set()
+        threads = [(entry, base, 0, None)]
+        while threads:
+            pc, index, call_stack, trace = threads.pop()
+            while True:
+                instruction = program[pc]
+                opcode = instruction[0]
+
+                if opcode == OPEN:
+                    trace = ((_OPEN_EVENT, instruction[1], index), trace)
+                    pc += 1
+
+                elif opcode == CLOSE:
+                    trace = ((_CLOSE_EVENT, index), trace)
+                    pc += 1
+
+                elif opcode == LITERAL:
+                    expected = instruction[literal_words]
+                    end = index + len(expected)
+                    if words[index:end] != expected:
+                        break
+                    trace = ((_LEAF_EVENT, instruction[1], index, end),
+                             trace)
+                    index = end
+                    pc += 1
+
+                elif opcode == LIST:
+                    # Try list items from longest to shortest.
+                    lengths = instruction[2].get_item_lengths(
+                        raw_words[index:])
+                    if not lengths:
+                        break
+                    for length in reversed(lengths[1:]):
+                        event = (_LEAF_EVENT, instruction[1], index,
+                                 index + length)
+                        threads.append((pc + 1, index + length, call_stack,
+                                        (event, trace)))
+                    trace = ((_LEAF_EVENT, instruction[1], index,
+                              index + lengths[0]), trace)
+                    index += lengths[0]
+                    pc += 1
+
+                elif opcode == DICTATION:
+                    # Try dictated words from longest to shortest.
+                    if dictation_counts is None:
+                        dictation_counts = _count_dictation(state, base,
+                                                            results_count)
+                    count = dictation_counts[index]
+                    if not count:
+                        break
+                    for end in range(index + 1, index + count):
+                        event = (_LEAF_EVENT, instruction[1], index, end)
+                        threads.append((pc + 1, end, call_stack,
+                                        (event, trace)))
+                    trace = ((_LEAF_EVENT, instruction[1], index,
+                              index + count), trace)
+                    index += count
+                    pc += 1
+
+                elif opcode == EMPTY:
+                    trace = ((_LEAF_EVENT, instruction[1], index, index),
+                             trace)
+                    pc += 1
+
+                elif opcode == FAIL:
+                    break
+
+                elif opcode == SPLIT:
+                    key = (pc, index, call_stack)
+                    if key in visited:
+                        break
+                    visited.add(key)
+                    threads.append((instruction[2], index, call_stack,
+                                    trace))
+                    pc = instruction[1]
+
+                elif opcode == JUMP:
+                    pc = instruction[1]
+
+                elif opcode == CALL:
+                    # Give up on calls which cannot terminate, e.g. left
+                    #  recursion.
+                    depth = call_stacks[call_stack][2] + 1
+                    if depth > max_call_depth:
+                        break
+                    frame = (pc + 1, call_stack)
+                    call_stack_id = call_stack_ids.get(frame)
+                    if call_stack_id is None:
+                        call_stack_id = len(call_stacks)
+                        call_stacks.append((pc + 1, call_stack, depth))
+                        call_stack_ids[frame] = call_stack_id
+                    call_stack = call_stack_id
+                    pc = instruction[1]
+
+                elif opcode == RETURN:
+                    if call_stack == 0:
+                        # The top-level rule must match all words.
+                        if index != results_count:
+                            break
+                        return _build_frames(trace)
+                    pc, call_stack, _ = call_stacks[call_stack]
+
+        return None
+
+
+#---------------------------------------------------------------------------
+# Utility functions.
+
+def _count_dictation(state, base, results_count):
+    # Count the dictated words following each word position.
+    counts = [0] * (results_count + 1)
+    for index in range(results_count - 1, base - 1, -1):
+        if state.rule(index - base) == "dgndictation":
+            counts[index] = counts[index + 1] + 1
+    return counts
+
+
+def _build_frames(trace):
+    # Convert a trace into a list of (depth, actor, begin, end) tuples in
+    #  the order of the State class' decoding stack.
+    events = []
+    while trace is not None:
+        event, trace = trace
+        events.append(event)
+    events.reverse()
+
+    frames = []
+    open_frames = []
+    for event in events:
+        if event[0] == _OPEN_EVENT:
+            frame = [len(open_frames) + 1, event[1], event[2], None]
+            frames.append(frame)
+            open_frames.append(frame)
+        elif event[0] == _CLOSE_EVENT:
+            open_frames.pop()[3] = event[1]
+        else:
+            frames.append([len(open_frames) + 1, event[1], event[2],
+                           event[3]])
+    return [tuple(frame) for frame in frames]
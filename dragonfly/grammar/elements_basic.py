@@ -83,16 +83,24 @@ import copy
 import itertools
 import logging
 
-from six import integer_types, string_types
+from six import integer_types, string_types, get_unbound_function
 
 from .rule_base  import Rule
-from .list       import ListBase, DictList
+from .list       import ListBase, DictList, ListFirstWords
 
 #===========================================================================
 # Element base class.
 
 id_generator = itertools.count()
 
+
+def _decode_overridden(element, cls):
+    # Return whether the element's class overrides cls.decode().  The
+    #  first_words() methods below are only correct for the decoding
+    #  behavior of the classes which define them.
+    return (get_unbound_function(type(element).decode)
+            is not get_unbound_function(cls.decode))
+
 class ElementBase(object):
     """ Base class for all other element classes. """
 
@@ -180,6 +188,28 @@ class ElementBase(object):
             dependencies.extend(c.dependencies(memo))
         return dependencies
 
+    def first_words(self, memo):
+        """
+            Returns a ``(words, empty)`` 2-tuple describing the words
+            with which a recognition of this element can begin.
+
+            *words* is a set of lowercase words, or *None* if this
+            element can begin with any word.  The set may also contain
+            :class:`ListFirstWords` objects standing for the words with
+            which the items of a list can begin.  *empty* is *True* if this
+            element can be recognized without any words.
+
+            The *memo* argument is a dictionary used by rules to store
+            their results and to avoid infinite recursion.
+
+            The default implementation of this method returns
+            ``(None, True)``, which is correct for any element.  Derived
+            classes should override this method if their decoding is
+            more restrictive.
+
+        """
+        return None, True
+
     def compile(self, compiler):
         raise NotImplementedError("Call to virtual method compile()"
                                   " in base class ElementBase")
@@ -321,6 +351,20 @@ class Sequence(ElementBase):
              + " ".join([e.gstring() for e in self._children]) \
              + ")"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Sequence):
+            return ElementBase.first_words(self, memo)
+        words = set()
+        for child in self._children:
+            child_words, child_empty = child.first_words(memo)
+            if child_words is None:
+                words = None
+            elif words is not None:
+                words.update(child_words)
+            if not child_empty:
+                return words, False
+        return words, True
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
@@ -335,9 +379,17 @@ class Sequence(ElementBase):
             state.decode_failure(self)
             return
 
+        # When memoizing, keep track of which children have already been
+        #  attempted at which indices.  Decoding the remaining children
+        #  from the same index again cannot reach any new end indices.
+        if state.memoize:
+            explored = set()
+        else:
+            explored = None
+
         # Attempt to walk a path through the entire sequence of children
         #  so that each one decodes successfully.
-        path = [self._children[0].decode(state)]
+        path = [state.decode_element(self._children[0])]
         while path:
             # Allow the last child to attempt decoding.
             try: next(path[-1])
@@ -348,8 +400,17 @@ class Sequence(ElementBase):
             else:
                 # Last child successfully decoded.
                 if len(path) < len(self._children):
+                    # Skip this path if the next child has already been
+                    #  attempted at the current index.
+                    if explored is not None:
+                        position = (len(path), state.index)
+                        if position in explored:
+                            continue
+                        explored.add(position)
+
                     # Sequence not yet complete, append the next child.
-                    path.append(self._children[len(path)].decode(state))
+                    child = self._children[len(path)]
+                    path.append(state.decode_element(child))
                 else:
                     # Sequence complete, all children decoded successfully.
                     state.decode_success(self)
@@ -407,6 +468,10 @@ class Optional(ElementBase):
         """ Returns the optional child element. """
         return (self._child, )
 
+    greedy = property(lambda self: self._greedy,
+                      doc="Whether the child element is decoded before"
+                          " the null-decode possibility.  (Read-only)")
+
     #-----------------------------------------------------------------------
     # Methods for load-time setup.
 
@@ -419,6 +484,12 @@ class Optional(ElementBase):
     def gstring(self):
         return "[" + self._child.gstring() + "]"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Optional):
+            return ElementBase.first_words(self, memo)
+        words, _ = self._child.first_words(memo)
+        return words, True
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
@@ -428,7 +499,7 @@ class Optional(ElementBase):
 
         # If in greedy mode, allow the child to decode before.
         if self._greedy:
-            for result in self._child.decode(state):
+            for result in state.decode_element(self._child):
                 state.decode_success(self)
                 yield state
                 state.decode_retry(self)
@@ -443,7 +514,7 @@ class Optional(ElementBase):
 
         # If not in greedy mode, allow the child to decode after.
         if not self._greedy:
-            for result in self._child.decode(state):
+            for result in state.decode_element(self._child):
                 state.decode_success(self)
                 yield state
                 state.decode_retry(self)
@@ -507,6 +578,25 @@ class Alternative(ElementBase):
              + " | ".join([e.gstring() for e in self._children]) \
              + ")"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Alternative):
+            return ElementBase.first_words(self, memo)
+
+        # Special case for an empty list of alternatives.
+        if len(self._children) == 0:
+            return set(), True
+
+        words = set()
+        empty = False
+        for child in self._children:
+            child_words, child_empty = child.first_words(memo)
+            if child_words is None:
+                words = None
+            elif words is not None:
+                words.update(child_words)
+            empty = empty or child_empty
+        return words, empty
+
     def dependencies(self, memo):
         if self._id in memo:
             return []
@@ -535,7 +625,7 @@ class Alternative(ElementBase):
 
             # Iterate through this child's possible decoding states.
             # pylint: disable=unused-variable
-            for result in child.decode(state):
+            for result in state.decode_element(child):
                 state.decode_success(self)
                 yield state
                 state.decode_retry(self)
@@ -612,23 +702,35 @@ class Repetition(Sequence):
         else:           self._max = max
         self._optimize = optimize
 
-        optional_length = self._max - self._min - 1
-        if optional_length > 0:
-            element = Optional(child)
-            for index in range(optional_length):
-                element = Optional(Sequence([child, element]))
-
-            if self._min >= 1:
-                children = [child] * self._min + [element]
-            else:
-                children = [element]
-        elif self._min > 0:
-            children = [child] * self._min
+        # Determine the maximum number of repetitions actually allowed.
+        #  This is consistent with the previous implementation, which
+        #  built a chain of max - min nested Optional elements if that
+        #  chain was longer than one.
+        if self._max - self._min > 1:
+            self._max_count = self._max
         else:
+            self._max_count = self._min
+        if self._max_count == 0:
             raise ValueError("Repetition not allowed to be empty.")
 
+        # The child element is decoded repeatedly by this element's
+        #  decode() method.  The children of this element are still those
+        #  of the equivalent sequence of nested Optional elements, for
+        #  code which inspects element trees.
+        children = [child] * self._min
+        optional_length = self._max_count - self._min
+        if optional_length > 0:
+            element = Optional(child)
+            for index in range(optional_length - 1):
+                element = Optional(Sequence([child, element]))
+            children.append(element)
         Sequence.__init__(self, children, name=name, default=default)
 
+    child = property(
+        lambda self: self._child,
+        doc="The child element which is repeated. (Read-only)"
+    )
+
     min = property(
         lambda self: self._min,
         doc="The minimum number of times that the child element must be "
@@ -643,6 +745,12 @@ class Repetition(Sequence):
         "(Read-only)"
     )
 
+    max_count = property(
+        lambda self: self._max_count,
+        doc="The maximum number of times that the child element can be "
+        "recognized. (Read-only)"
+    )
+
     optimize = property(
         lambda self: self._optimize,
         doc="Whether the engine's compiler should compile the element "
@@ -655,9 +763,77 @@ class Repetition(Sequence):
         memo.add(self._id)
         return self._child.dependencies(memo)
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Repetition):
+            return ElementBase.first_words(self, memo)
+        words, empty = self._child.first_words(memo)
+        return words, empty or self._min == 0
+
+    def get_expanded_sequence(self):
+        """
+            Returns a :class:`Sequence` element which matches the same
+            recognitions as this element, built out of copies of the
+            child element and nested :class:`Optional` elements.
+
+            This is intended for use by engine compilers which have no
+            native construct for repetitions with limits.
+
+        """
+        return Sequence(self._children)
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
+    def decode(self, state):
+        state.decode_attempt(self)
+        max_count = self._max_count
+
+        # When memoizing, keep track of the number of repetitions decoded
+        #  at each index.  Repetitions continuing from the same index
+        #  cannot reach any new end indices.
+        if state.memoize:
+            explored = set()
+        else:
+            explored = None
+
+        # Decode the child element repeatedly, keeping one child decoding
+        #  generator per repetition on the path.  More repetitions are
+        #  attempted before fewer, like nested greedy Optional elements.
+        path = [state.decode_element(self._child)]
+        while path:
+            try: next(path[-1])
+            except StopIteration:
+                # The last repetition failed to decode, so all further
+                #  repetitions have been attempted.  Yield the remaining
+                #  repetitions if there are enough of them, then allow the
+                #  one-before-last repetition to reattempt.
+                path.pop()
+                if len(path) >= self._min:
+                    state.decode_success(self)
+                    yield state
+                    state.decode_retry(self)
+                continue
+
+            # Skip this path if it has already been attempted with the
+            #  same number of repetitions at the current index.
+            if explored is not None:
+                position = (len(path), state.index)
+                if position in explored:
+                    continue
+                explored.add(position)
+
+            if len(path) < max_count:
+                # Attempt another repetition.
+                path.append(state.decode_element(self._child))
+            else:
+                # Maximum number of repetitions decoded.
+                state.decode_success(self)
+                yield state
+                state.decode_retry(self)
+
+        # No more decoding possibilities available, failure.
+        state.decode_failure(self)
+
     def get_repetitions(self, node):
         """
             Returns a list containing the nodes associated with
@@ -670,33 +846,11 @@ class Repetition(Sequence):
                tree
 
         """
-        repetitions = []
-        for index in range(self._min):
-            element = node.children[index]
-            if element.actor != self._child:
+        for child in node.children:
+            if child.actor is not self._child:
                 raise TypeError("Invalid child of %s: %s" \
-                    % (self, element.actor))
-            repetitions.append(element)
-
-        if self._max - self._min > 1:
-            optional = node.children[-1]
-            while optional.children:
-                child = optional.children[0]
-                if isinstance(child.actor, Sequence):
-                    assert len(child.children) == 2
-                    element, optional = child.children
-                    if element.actor != self._child:
-                        raise TypeError("Invalid child of %s: %s" \
-                            % (self, element.actor))
-                    repetitions.append(element)
-                elif child.actor == self._child:
-                    repetitions.append(child)
-                    break
-                else:
-                    raise TypeError("Invalid child of %s: %s" \
-                        % (self, child.actor))
-
-        return repetitions
+                    % (self, child.actor))
+        return list(node.children)
 
     def value(self, node):
         """
@@ -797,6 +951,10 @@ class Literal(ElementBase):
         self._words = words
         self._words_ext = words_ext
 
+        # Store lowercase tuples of both lists for decoding.
+        self._lower_words = tuple(word.lower() for word in words)
+        self._lower_words_ext = tuple(word.lower() for word in words_ext)
+
     #-----------------------------------------------------------------------
     # Methods for runtime introspection.
 
@@ -814,6 +972,16 @@ class Literal(ElementBase):
         "single items. This is extends the :py:attr:`~words` property."
     )
 
+    lower_words = property(
+        lambda self: self._lower_words,
+        doc="Tuple of the :py:attr:`~words` property in lowercase."
+    )
+
+    lower_words_ext = property(
+        lambda self: self._lower_words_ext,
+        doc="Tuple of the :py:attr:`~words_ext` property in lowercase."
+    )
+
     #-----------------------------------------------------------------------
     # Methods for load-time setup.
 
@@ -823,29 +991,33 @@ class Literal(ElementBase):
     def gstring(self):
         return " ".join(self._words)
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Literal):
+            return ElementBase.first_words(self, memo)
+
+        # Include the first quoted word too, as it is matched as a single
+        #  word by engines with quoted words support.
+        if not self._words:
+            return set(), True
+        return set([self._lower_words[0], self._lower_words_ext[0]]), False
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
     def decode(self, state):
         state.decode_attempt(self)
 
-        # Iterate through this element's words.
-        # If all match, success.  Else, failure.
-        if state.engine.quoted_words_support:
-            words = self._words_ext
+        # Compare this element's lowercase words with the next lowercase
+        #  words of the recognition.  If all match, success.  Else,
+        #  failure.
+        if state.quoted_words_support:
+            words = self._lower_words_ext
         else:
-            words = self._words
-        for i in range(len(words)):
-            word = state.word(i)
-
-            # If word isn't None, make it lowercase.
-            if word:
-                word = word.lower()
-
-            # If the words are not the same, then this is a decode failure.
-            if word != words[i].lower():
-                state.decode_failure(self)
-                return
+            words = self._lower_words
+        index = state.index
+        if state.lower_words[index:index + len(words)] != words:
+            state.decode_failure(self)
+            return
 
         # All words matched, success.
         state.next(len(words))
@@ -910,6 +1082,10 @@ class RuleRef(ElementBase):
     def gstring(self):
         return "<" + self._rule.name + ">"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, RuleRef):
+            return ElementBase.first_words(self, memo)
+        return self._rule.first_words(memo)
 
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
@@ -919,7 +1095,7 @@ class RuleRef(ElementBase):
 
         # Allow the rule to attempt decoding.
         # pylint: disable=unused-variable
-        for result in self._rule.decode(state):
+        for result in state.decode_element(self._rule):
             state.decode_success(self)
             yield state
             state.decode_retry(self)
@@ -948,6 +1124,9 @@ class ListRef(ElementBase):
            the default value used if this element is optional and wasn't
            spoken
 
+        If list items of different lengths match the recognized words,
+        the longest item is tried first.
+
     """
 
     # pylint: disable=redefined-builtin
@@ -991,26 +1170,28 @@ class ListRef(ElementBase):
     def gstring(self):
         return "{" + self._list.name + "}"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, ListRef):
+            return ElementBase.first_words(self, memo)
+
+        # Refer to the list instead of its items, so that the result
+        #  stays valid when the list is modified.
+        return set([ListFirstWords(self._list)]), False
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
     def decode(self, state):
         state.decode_attempt(self)
 
-        # If the next word(s) is/are in the list, success.
-        delta = 0
-        word = state.word()
-        while 1:
-            if word in self._list:
-                state.next(delta + 1)
-                state.decode_success(self)
-                yield state
-                state.decode_retry(self)
-            delta += 1
-            next = state.word(delta)
-            if next is None:
-                break
-            word += " " + next
+        # Walk the list's word trie to find the items formed by the next
+        #  word(s), then yield each, longest first.
+        for length in self._list.get_item_lengths(state.words(state.index)):
+            state.next(length)
+            state.decode_success(self)
+            yield state
+            state.decode_retry(self)
+            state.decode_rollback(self)
 
         # If the word is not in the list, or on retry, failure.
         state.decode_failure(self)
@@ -1082,6 +1263,11 @@ class Empty(ElementBase):
     def gstring(self):
         return "<Empty()>"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Empty):
+            return ElementBase.first_words(self, memo)
+        return set(), True
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
@@ -1162,6 +1348,12 @@ class Dictation(ElementBase):
     def gstring(self):
         return "<Dictation()>"
 
+    def first_words(self, memo):
+        # Dictation can begin with any word, but not with zero words.
+        if _decode_overridden(self, Dictation):
+            return ElementBase.first_words(self, memo)
+        return None, False
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
@@ -1262,6 +1454,11 @@ class Impossible(ElementBase):
     def gstring(self):
         return "<Impossible()>"
 
+    def first_words(self, memo):
+        if _decode_overridden(self, Impossible):
+            return ElementBase.first_words(self, memo)
+        return set(), False
+
     #-----------------------------------------------------------------------
     # Methods for runtime recognition processing.
 
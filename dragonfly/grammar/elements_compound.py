@@ -38,7 +38,8 @@ from six import string_types, binary_type
 
 from dragonfly.grammar.elements_basic import Alternative, ElementBase
 
-from dragonfly.parsing.parse import spec_parser, CompoundTransformer, ParseError
+from dragonfly.parsing.parse import (spec_parse_cache, CompoundTransformer,
+                                     ParseError)
 
 #---------------------------------------------------------------------------
 # The Compound class.
@@ -46,7 +47,7 @@ from dragonfly.parsing.parse import spec_parser, CompoundTransformer, ParseError
 class Compound(Alternative):
 
     _log = logging.getLogger("compound.parse")
-    _parser = spec_parser
+    _parser = spec_parse_cache
 
     def __init__(self, spec, extras=None, actions=None, name=None,
                  value=None, value_func=None, elements=None, default=None):
@@ -115,12 +116,7 @@ class Compound(Alternative):
         if self._value_func is not None:
             # Prepare *extras* dict for passing to value_func().
             extras = {"_node": node}
-            for name, element in self._extras.items():
-                extra_node = node.get_child_by_name(name, shallow=True)
-                if extra_node:
-                    extras[name] = extra_node.value()
-                elif element.has_default():
-                    extras[name] = element.default
+            node.get_extras(self._extras, extras)
             try:
                 value = self._value_func(node, extras)
             except Exception as e:
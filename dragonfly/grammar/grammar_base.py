@@ -25,12 +25,14 @@ Grammar class
 """
 
 import logging
+from heapq import merge
 from six import string_types
 
 from ..engines         import get_engine
 from .rule_base        import Rule
-from .list             import ListBase
+from .list             import ListBase, ListFirstWords
 from .context          import Context
+from .decoding         import CompiledDecoder
 from ..error           import GrammarError
 
 
@@ -83,6 +85,10 @@ class Grammar(object):
         self._loaded = False
         self._enabled = True
         self._in_context = False
+        self._memoize_decoding = False
+        self._compiled_decoding = False
+        self._compiled_decoder = None
+        self._first_word_index = None
 
     def __del__(self):
         try:
@@ -150,6 +156,34 @@ class Grammar(object):
                        doc="Whether a grammar is active to receive "
                            "recognitions or not.")
 
+    def _get_memoize_decoding(self):
+        return self._memoize_decoding
+
+    def _set_memoize_decoding(self, value):
+        self._memoize_decoding = bool(value)
+
+    memoize_decoding = property(
+        _get_memoize_decoding, _set_memoize_decoding,
+        doc="Whether recognitions are decoded using memoization.  When"
+            " enabled, each element is only decoded once per word"
+            " position, which avoids exponential backtracking in rules"
+            " with many nested optional or repeated elements."
+    )
+
+    def _get_compiled_decoding(self):
+        return self._compiled_decoding
+
+    def _set_compiled_decoding(self, value):
+        self._compiled_decoding = bool(value)
+        self._compiled_decoder = None
+
+    compiled_decoding = property(
+        _get_compiled_decoding, _set_compiled_decoding,
+        doc="Whether recognitions are decoded using rules compiled into"
+            " a flat instruction array when the grammar is loaded.  Rules"
+            " which cannot be compiled are decoded normally."
+    )
+
     def set_exclusiveness(self, exclusive):
         """ Set the exclusiveness of this grammar. """
         self._engine.set_exclusiveness(self, exclusive)
@@ -285,7 +319,7 @@ class Grammar(object):
             return
 
         # Activate the given rule.
-        self._engine.activate_rule(rule, self)
+        self._get_engine_updater().activate_rule(rule, self)
 
     def deactivate_rule(self, rule):
         """
@@ -310,31 +344,143 @@ class Grammar(object):
             return
 
         # Deactivate the given rule.
-        self._engine.deactivate_rule(rule, self)
+        self._get_engine_updater().deactivate_rule(rule, self)
 
-    def update_list(self, lst):
+    def update_list(self, lst, delta=None):
         """
             Update a list's content loaded in this grammar.
 
+            *delta* is a :class:`ListDelta` of the items added to and
+            removed from the list since its last update, or *None* if
+            they are not known.  Engines which support deltas apply them
+            instead of rebuilding the entire list.
+
             **Internal:** this method is normally *not* called
             directly by the user, but instead automatically when
             the list itself is modified by the user.
 
         """
+        # Nothing to do if no items were added or removed.
+        if delta is not None and not delta:
+            return
+
         self._log_load.debug("Grammar %s: updating list %s.",
                              self._name, lst.name)
 
-        # Check for correct type and valid list instance.
+        # Check for correct type and valid list instance.  The items of
+        #  deltas are checked when they are recorded.
         #        assert self._loaded
         if lst not in self._lists:
             raise GrammarError("List '%s' not loaded in this grammar."
                                % lst.name)
-        elif [True for w in lst.get_list_items()
-              if not isinstance(w, string_types)]:
+        elif delta is None and [True for w in lst.get_list_items()
+                                if not isinstance(w, string_types)]:
             raise GrammarError("List '%s' contains objects other than"
                                "strings." % lst.name)
 
-        self._engine.update_list(lst, self)
+        self._get_engine_updater().update_list(lst, self, delta)
+
+    def _get_engine_updater(self):
+        # Rule and list updates are deferred while the engine is batching
+        #  them.
+        return self._engine.update_batch or self._engine
+
+    # ----------------------------------------------------------------------
+    # Methods for selecting rules to decode.
+
+    def _build_first_word_index(self):
+        # Map each lowercase first word to the positions of exported rules
+        #  which can begin with it.  Rules which can begin with the items
+        #  of lists are mapped by list, so that the index stays valid when
+        #  the lists are modified.  Rules which can begin with any word or
+        #  with no words at all are stored separately.
+        index = {}
+        list_index = {}
+        wildcards = []
+        memo = {}
+        for position, rule in enumerate(self._rules):
+            if not rule.exported:
+                continue
+            words, empty = rule.first_words(memo)
+            if words is None or empty:
+                wildcards.append(position)
+                continue
+            for word in words:
+                if isinstance(word, ListFirstWords):
+                    list_index.setdefault(word, []).append(position)
+                else:
+                    index.setdefault(word, []).append(position)
+
+        self._first_word_index = (index, list(list_index.items()),
+                                  wildcards)
+        self._log_load.debug("Grammar %s: built first word index of %d"
+                             " words, %d lists and %d wildcard rules.",
+                             self._name, len(index), len(list_index),
+                             len(wildcards))
+
+    def get_candidate_rules(self, words):
+        """
+            Get the rules of this grammar which could match the given
+            recognized words.
+
+            Only exported rules which can begin with the first of
+            *words* are returned, in the order in which they were added
+            to this grammar.  Rules are selected using an index of each
+            rule's possible first words, which is built as necessary.
+            Rules which can begin with a list item are selected by
+            looking up the word in the list's items, so the index is not
+            rebuilt when lists are modified.
+
+            Engines should call this method before attempting to decode
+            each rule of a recognition.  The returned rules may still
+            fail to decode and may be inactive.
+
+            :param words: the recognized words
+            :type words: sequence
+        """
+        if self._first_word_index is None:
+            self._build_first_word_index()
+        index, list_index, wildcards = self._first_word_index
+
+        # Any exported rule could match if there are no words.
+        if not words:
+            return [r for r in self._rules if r.exported]
+
+        first_word = words[0]
+        position_lists = [index.get(first_word.lower(), ()), wildcards]
+        for list_words, list_positions in list_index:
+            if list_words.matches(first_word):
+                position_lists.append(list_positions)
+
+        # Merge the positions, skipping rules found more than once.
+        rules = []
+        previous = None
+        for position in merge(*position_lists):
+            if position != previous:
+                rules.append(self._rules[position])
+                previous = position
+        return rules
+
+    def decode_rule(self, rule, state):
+        """
+            Decode a recognition using one of this grammar's rules.
+
+            This method returns a generator yielding each decoding of
+            *rule*, like :meth:`Rule.decode`.  If the grammar's
+            :attr:`compiled_decoding` property is set, then only the
+            first decoding which matches all of the recognized words is
+            yielded.
+
+            :param rule: the rule to decode
+            :type rule: Rule
+            :param state: the decoding state of the recognition
+            :type state: State
+        """
+        if not self._compiled_decoding:
+            return state.decode_element(rule)
+        if self._compiled_decoder is None:
+            self._compiled_decoder = CompiledDecoder(self._rules)
+        return self._compiled_decoder.decode(rule, state)
 
     # ----------------------------------------------------------------------
     # Methods for registering a grammar object instance in natlink.
@@ -349,21 +495,34 @@ class Grammar(object):
         if self._loaded:
             return
 
+        # Validate the items of lists before the engine loads them.
         self.add_all_dependencies()
+        for lst in self._lists:
+            # pylint: disable=protected-access
+            lst._validate_items()
         self._engine.load_grammar(self)
         self._loaded = True
+        self._first_word_index = None
+        if self._compiled_decoding:
+            self._compiled_decoder = CompiledDecoder(self._rules)
         self._in_context = False
 
-        # Update all rules loaded in this grammar.
-        for rule in self._rules:
-            # Explicitly compare to False so that uninitialized rules (which
-            # have active set to None) are activated.
-            if rule.active is not False:
-                rule.activate(force=True)
-        # Update all lists loaded in this grammar.
-        for lst in self._lists:
+        # Activate rules and populate lists in a single batch of engine
+        #  updates.
+        with self._engine.batch_updates():
+            # Update all rules loaded in this grammar.
+            for rule in self._rules:
+                # Explicitly compare to False so that uninitialized rules
+                # (which have active set to None) are activated.
+                if rule.active is not False:
+                    rule.activate(force=True)
+
+            # Update all lists loaded in this grammar, unless the engine
+            #  loaded their items with the grammar.
             # pylint: disable=protected-access
-            lst._update()
+            if not self._engine._loads_list_items:
+                for lst in self._lists:
+                    lst._update()
 
         #        self._log_load.warning(self.get_complexity_string())
 
@@ -377,6 +536,8 @@ class Grammar(object):
 
         self._engine.unload_grammar(self)
         self._loaded = False
+        self._first_word_index = None
+        self._compiled_decoder = None
         self._in_context = False
 
     def get_complexity_string(self):
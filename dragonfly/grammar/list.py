@@ -40,8 +40,101 @@
 #""" % {"class": "list", "function": name})
 #   return "".join(output)
 #print construct_skeleton()
+from collections import Counter
+
 from six import string_types
 
+#===========================================================================
+# Placeholder for the first words of a list's items.
+
+class ListFirstWords(object):
+    """
+        Placeholder for the words with which the items of a dragonfly
+        list can begin.
+
+        These are included in the first-word sets of elements which
+        begin with a list reference, instead of the words themselves, so
+        that the sets stay valid when the list is modified.
+    """
+
+    __slots__ = ("list",)
+
+    def __init__(self, lst):
+        self.list = lst
+
+    def __eq__(self, other):
+        return (isinstance(other, ListFirstWords)
+                and other.list is self.list)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __hash__(self):
+        return id(self.list)
+
+    def __repr__(self):
+        return "%s(%r)" % (self.__class__.__name__, self.list.name)
+
+    def matches(self, word):
+        """ Whether an item of the list can begin with *word*. """
+        return self.list.has_item_prefix(word)
+
+
+#===========================================================================
+# Record of the items added to and removed from a list.
+
+class ListDelta(object):
+    """
+        Items added to and removed from a dragonfly list by one or more
+        modifications.
+
+        Deltas are passed to the grammar and engine when a list is
+        modified, so that engines can apply the change instead of
+        rebuilding the entire list.  An item which is removed and then
+        added again, or vice versa, does not appear in the delta.
+    """
+
+    def __init__(self, added=(), removed=()):
+        self._added = Counter()
+        self._removed = Counter()
+        self.record(added, removed)
+
+    def __repr__(self):
+        return "%s(added=%r, removed=%r)" % (self.__class__.__name__,
+                                             self.added, self.removed)
+
+    def __bool__(self):
+        return bool(self._added or self._removed)
+
+    __nonzero__ = __bool__
+
+    added = property(lambda self: list(self._added.elements()),
+                     doc="List of the items added.")
+
+    removed = property(lambda self: list(self._removed.elements()),
+                       doc="List of the items removed.")
+
+    def record(self, added=(), removed=()):
+        """ Record the removal and then addition of the given items. """
+        for item in removed:
+            if self._added[item]:
+                self._added[item] -= 1
+                if not self._added[item]:
+                    del self._added[item]
+            else:
+                self._removed[item] += 1
+        for item in added:
+            if self._removed[item]:
+                self._removed[item] -= 1
+                if not self._removed[item]:
+                    del self._removed[item]
+            else:
+                self._added[item] += 1
+
+    def merge(self, delta):
+        """ Record the items of a later delta in this delta. """
+        self.record(delta.added, delta.removed)
+
 #===========================================================================
 # Base class for dragonfly list objects.
 
@@ -53,6 +146,9 @@ class ListBase(object):
         self._grammar = None
         self._batch_mode = False
         self._batch_updates = False
+        self._batch_delta = None
+        self._version = 0
+        self._trie = None
 
     #-----------------------------------------------------------------------
     # Protected attribute access.
@@ -64,6 +160,11 @@ class ListBase(object):
     name = property(lambda self: self._name,
                     doc="Read-only access to a list's name.")
 
+    version = property(lambda self: self._version,
+                       doc="Read-only access to a list's modification "
+                           "counter, which is incremented each time the "
+                           "list is modified.")
+
     def _get_grammar(self):
         return self._grammar
 
@@ -87,32 +188,66 @@ class ListBase(object):
     def __exit__(self, exc_type, exc_value, exc_tb):
         self._batch_mode = False
         if self._batch_updates:
-            self._update()
             self._batch_updates = False
+            delta, self._batch_delta = self._batch_delta, None
+            self._notify(delta)
 
     #-----------------------------------------------------------------------
     # Notify the grammar of a list modification.
 
-    def _update(self):
+    def _update(self, delta=None):
         """
         Internal method that notifies the engine of list updates.
 
         This method should be called internally by :class:`ListBase`sub-
-        classes when the list is modified.
+        classes when the list is modified.  *delta* is a
+        :class:`ListDelta` of the items added and removed by the
+        modification, or *None* if they are not known.
         """
+        self._version += 1
+        if self._trie is not None:
+            if delta is None or not self._update_trie(delta):
+                self._trie = None
+
         # Return early for batch mode. A single update_list() call will
         # occur in __exit__(), after a 'with' block.
         if self._batch_mode:
-            self._batch_updates = True
+            if not self._batch_updates:
+                self._batch_updates = True
+                self._batch_delta = delta
+            elif self._batch_delta is not None:
+                if delta is None:
+                    self._batch_delta = None
+                else:
+                    self._batch_delta.merge(delta)
             return
 
-        # Validate list items.
-        self._validate_items()
+        self._notify(delta)
+
+    def _update_items(self, added=(), removed=()):
+        """
+        Internal method that notifies the engine of the items added to
+        and removed from this list by a modification.
+        """
+        # Only valid items are recorded in deltas; invalid items are
+        #  reported by _validate_items().
+        valid_types = self.valid_types
+        for item in list(added) + list(removed):
+            if not isinstance(item, valid_types):
+                self._update()
+                return
+        self._update(ListDelta(added, removed))
+
+    def _notify(self, delta):
+        # Validate list items.  The items of deltas are validated when
+        #  they are recorded.
+        if delta is None:
+            self._validate_items()
 
         # If this list is part of a grammar, then notify it of the list
         # changes.
         if self._grammar:
-            self._grammar.update_list(self)
+            self._grammar.update_list(self, delta)
 
     def _validate_items(self):
         valid_types = self.valid_types
@@ -126,6 +261,110 @@ class ListBase(object):
     def get_list_items(self):
         raise NotImplementedError("Call to virtual method list_items()")
 
+    #-----------------------------------------------------------------------
+    # Methods for matching recognized words against list items.
+
+    def get_word_trie(self):
+        """
+        Get a word-level trie of this list's items.
+
+        Each node of the trie is a dictionary mapping words to child
+        nodes.  Nodes at which items end also map *None* to the number of
+        those items.  Items are split into words at each space character,
+        so that the trie matches exactly the items which are equal to
+        recognized words joined by spaces.
+
+        The trie is built as necessary and updated when this list is
+        modified.
+        """
+        trie = self._trie
+        if trie is None:
+            trie = {}
+            for item in self.get_list_items():
+                if isinstance(item, string_types):
+                    self._add_trie_item(trie, item)
+            self._trie = trie
+        return trie
+
+    @staticmethod
+    def _add_trie_item(trie, item):
+        node = trie
+        for word in item.split(" "):
+            child = node.get(word)
+            if child is None:
+                child = node[word] = {}
+            node = child
+        node[None] = node.get(None, 0) + 1
+
+    def _update_trie(self, delta):
+        # Apply a delta to the word trie, returning False if it could not
+        #  be applied.
+        trie = self._trie
+        for item in delta.removed:
+            node = trie
+            path = []
+            for word in item.split(" "):
+                path.append((node, word))
+                node = node.get(word)
+                if node is None:
+                    return False
+            count = node.get(None)
+            if not count:
+                return False
+            elif count > 1:
+                node[None] = count - 1
+                continue
+
+            # Remove the item and any nodes left without items.
+            del node[None]
+            for parent, word in reversed(path):
+                if parent[word]:
+                    break
+                del parent[word]
+        for item in delta.added:
+            self._add_trie_item(trie, item)
+        return True
+
+    def has_item_prefix(self, word):
+        """
+        Whether any of this list's items begins with the given
+        recognized word.
+
+        :param word: recognized word
+        :type word: str
+        """
+        node = self.get_word_trie()
+        for part in word.split(" "):
+            node = node.get(part)
+            if node is None:
+                return False
+        return True
+
+    def get_item_lengths(self, words):
+        """
+        Get the numbers of *words* matching this list's items.
+
+        The returned list contains, from longest to shortest, the number
+        of leading words of *words* which form each item of this list
+        when joined by spaces.
+
+        :param words: recognized words
+        :type words: sequence
+        """
+        lengths = []
+        node = self.get_word_trie()
+        for length, word in enumerate(words, 1):
+            for part in word.split(" "):
+                node = node.get(part)
+                if node is None:
+                    break
+            if node is None:
+                break
+            if None in node:
+                lengths.append(length)
+        lengths.reverse()
+        return lengths
+
 
 #===========================================================================
 # Wrapper for Python's built-in list type.
@@ -160,62 +399,85 @@ class List(ListBase, list):
     #-----------------------------------------------------------------------
     # Overridden list methods.
 
+    # Each modifying method notifies the engine of the items it added
+    #  and removed.  Methods which do not modify the list notify it of an
+    #  empty delta.
+
     def __add__(self, *args, **kwargs):
         result = list.__add__(self, *args, **kwargs)
-        self._update(); return result
-    def __delitem__(self, *args, **kwargs):
-        result = list.__delitem__(self, *args, **kwargs)
-        self._update(); return result
-    def __delslice__(self, *args, **kwargs):
+        self._update_items(); return result
+    def __delitem__(self, index):
+        removed = self[index]
+        if not isinstance(index, slice):
+            removed = [removed]
+        result = list.__delitem__(self, index)
+        self._update_items(removed=removed); return result
+    def __delslice__(self, i, j):
         # pylint: disable=no-member
-        result = list.__delslice__(self, *args, **kwargs)
-        self._update(); return result
-    def __iadd__(self, *args, **kwargs):
-        result = list.__iadd__(self, *args, **kwargs)
-        self._update(); return result
-    def __imul__(self, *args, **kwargs):
-        result = list.__imul__(self, *args, **kwargs)
-        self._update(); return result
+        removed = self[i:j]
+        result = list.__delslice__(self, i, j)
+        self._update_items(removed=removed); return result
+    def __iadd__(self, other):
+        added = list(other)
+        result = list.__iadd__(self, added)
+        self._update_items(added=added); return result
+    def __imul__(self, count):
+        items = list(self)
+        result = list.__imul__(self, count)
+        if count > 0:
+            self._update_items(added=items * (count - 1))
+        else:
+            self._update_items(removed=items)
+        return result
     def __mul__(self, *args, **kwargs):
         result = list.__mul__(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def __reduce__(self, *args, **kwargs):
         result = list.__reduce__(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def __reduce_ex__(self, *args, **kwargs):
         result = list.__reduce_ex__(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def __rmul__(self, *args, **kwargs):
         result = list.__rmul__(self, *args, **kwargs)
-        self._update(); return result
-    def __setitem__(self, *args, **kwargs):
-        result = list.__setitem__(self, *args, **kwargs)
-        self._update(); return result
-    def __setslice__(self, *args, **kwargs):
+        self._update_items(); return result
+    def __setitem__(self, index, value):
+        removed = self[index]
+        if isinstance(index, slice):
+            value = list(value)
+            added = value
+        else:
+            removed, added = [removed], [value]
+        result = list.__setitem__(self, index, value)
+        self._update_items(added, removed); return result
+    def __setslice__(self, i, j, sequence):
         # pylint: disable=no-member
-        result = list.__setslice__(self, *args, **kwargs)
-        self._update(); return result
-    def append(self, *args, **kwargs):
-        result = list.append(self, *args, **kwargs)
-        self._update(); return result
-    def extend(self, *args, **kwargs):
-        result = list.extend(self, *args, **kwargs)
-        self._update(); return result
-    def insert(self, *args, **kwargs):
-        result = list.insert(self, *args, **kwargs)
-        self._update(); return result
+        removed = self[i:j]
+        added = list(sequence)
+        result = list.__setslice__(self, i, j, added)
+        self._update_items(added, removed); return result
+    def append(self, item):
+        result = list.append(self, item)
+        self._update_items(added=[item]); return result
+    def extend(self, iterable):
+        added = list(iterable)
+        result = list.extend(self, added)
+        self._update_items(added=added); return result
+    def insert(self, index, item):
+        result = list.insert(self, index, item)
+        self._update_items(added=[item]); return result
     def pop(self, *args, **kwargs):
         result = list.pop(self, *args, **kwargs)
-        self._update(); return result
-    def remove(self, *args, **kwargs):
-        result = list.remove(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(removed=[result]); return result
+    def remove(self, item):
+        result = list.remove(self, item)
+        self._update_items(removed=[item]); return result
     def reverse(self, *args, **kwargs):
         result = list.reverse(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def sort(self, *args, **kwargs):
         result = list.sort(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def clear(self):
         del self[:]
 
@@ -255,33 +517,43 @@ class DictList(ListBase, dict):
     #-----------------------------------------------------------------------
     # Overridden dict methods.
 
-    def __delitem__(self, *args, **kwargs):
-        result = dict.__delitem__(self, *args, **kwargs)
-        self._update(); return result
+    # Each modifying method notifies the engine of the keys it added
+    #  and removed.  Methods which do not add or remove keys notify it
+    #  of an empty delta.
+
+    def __delitem__(self, key):
+        result = dict.__delitem__(self, key)
+        self._update_items(removed=[key]); return result
     def __reduce__(self, *args, **kwargs):
         result = dict.__reduce__(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
     def __reduce_ex__(self, *args, **kwargs):
         result = dict.__reduce_ex__(self, *args, **kwargs)
-        self._update(); return result
-    def __setitem__(self, *args, **kwargs):
-        result = dict.__setitem__(self, *args, **kwargs)
-        self._update(); return result
-    def clear(self, *args, **kwargs):
-        result = dict.clear(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
+    def __setitem__(self, key, value):
+        added = [] if key in self else [key]
+        result = dict.__setitem__(self, key, value)
+        self._update_items(added=added); return result
+    def clear(self):
+        removed = list(self.keys())
+        result = dict.clear(self)
+        self._update_items(removed=removed); return result
     def fromkeys(self, *args, **kwargs):
         result = dict.fromkeys(self, *args, **kwargs)
-        self._update(); return result
-    def pop(self, *args, **kwargs):
-        result = dict.pop(self, *args, **kwargs)
-        self._update(); return result
-    def popitem(self, *args, **kwargs):
-        result = dict.popitem(self, *args, **kwargs)
-        self._update(); return result
-    def setdefault(self, *args, **kwargs):
-        result = dict.setdefault(self, *args, **kwargs)
-        self._update(); return result
+        self._update_items(); return result
+    def pop(self, key, *args):
+        removed = [key] if key in self else []
+        result = dict.pop(self, key, *args)
+        self._update_items(removed=removed); return result
+    def popitem(self):
+        result = dict.popitem(self)
+        self._update_items(removed=[result[0]]); return result
+    def setdefault(self, key, *args):
+        added = [] if key in self else [key]
+        result = dict.setdefault(self, key, *args)
+        self._update_items(added=added); return result
     def update(self, *args, **kwargs):
-        result = dict.update(self, *args, **kwargs)
-        self._update(); return result
+        items = dict(*args, **kwargs)
+        added = [key for key in items if key not in self]
+        result = dict.update(self, items)
+        self._update_items(added=added); return result
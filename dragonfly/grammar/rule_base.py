@@ -28,6 +28,8 @@ Rule class
 
 import logging
 
+from six import get_unbound_function
+
 from .context import Context
 from ..error import GrammarError
 
@@ -242,13 +244,39 @@ class Rule(object):
         else:
             return []
 
+    def first_words(self, memo):
+        """
+            Returns a ``(words, empty)`` 2-tuple describing the words
+            with which a recognition of this rule can begin.
+
+            See :meth:`ElementBase.first_words` for details.  Results
+            are stored in the *memo* dictionary by rule name.
+
+        """
+        if self._name in memo:
+            return memo[self._name]
+
+        # Imported rules and rules with overridden decoding can begin
+        #  with any word.
+        if (self._imported or not self._element
+                or get_unbound_function(type(self).decode)
+                is not get_unbound_function(Rule.decode)):
+            return None, True
+
+        # Guard against recursive rule references.  The conservative
+        #  result is replaced once this rule's result is known.
+        memo[self._name] = (None, True)
+        result = self._element.first_words(memo)
+        memo[self._name] = result
+        return result
+
     #-----------------------------------------------------------------------
     # Methods for decoding and evaluating recognitions.
 
     def decode(self, state):
         state.decode_attempt(self)
 
-        for result in self._element.decode(state):
+        for result in state.decode_element(self._element):
             state.decode_success(self)
             yield state
             state.decode_retry(self)
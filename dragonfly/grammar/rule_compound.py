@@ -150,12 +150,7 @@ class CompoundRule(Rule):
             "_node":     node,
         }
         extras.update(self._defaults)
-        for name, element in self._extras.items():
-            extra_node = node.get_child_by_name(name, shallow=True)
-            if extra_node:
-                extras[name] = extra_node.value()
-            elif element.has_default():
-                extras[name] = element.default
+        node.get_extras(self._extras, extras)
 
         # Call the method to do the actual processing.
         self._process_recognition(node, extras)
@@ -29,7 +29,7 @@ from locale import getpreferredencoding
 
 from logging import getLogger, DEBUG
 
-from six import PY2, text_type, binary_type
+from six import PY2, text_type, binary_type, string_types, integer_types
 
 from ..error import GrammarError
 
@@ -41,7 +41,7 @@ class State(object):
     # -----------------------------------------------------------------------
     # Methods for initialization.
 
-    def __init__(self, results, rule_names, engine):
+    def __init__(self, results, rule_names, engine, memoize=False):
         self._results = results
         self._rule_names = rule_names
         self._engine = engine
@@ -49,6 +49,12 @@ class State(object):
         self._data = {}
         self._depth = 0
         self._stack = []
+        self._depth_frames = {}
+        self._actor_frames = {}
+        self._memoize = bool(memoize)
+        self._memo = {}
+        self._lower_words = None
+        self._quoted_words_support = None
         self.initialize_decoding()
         self._previous_index = None
 
@@ -78,6 +84,36 @@ class State(object):
     def engine(self):
         return self._engine
 
+    @property
+    def lower_words(self):
+        """
+            Tuple of the recognized words in lowercase, for comparison
+            with element words.  (Read-only)
+        """
+        if self._lower_words is None:
+            self._lower_words = tuple(w[0].lower() if w[0] else w[0]
+                                      for w in self._results)
+        return self._lower_words
+
+    @property
+    def quoted_words_support(self):
+        """
+            Whether the engine supports quoted words.  (Read-only)
+        """
+        if self._quoted_words_support is None:
+            self._quoted_words_support = self._engine.quoted_words_support
+        return self._quoted_words_support
+
+    @property
+    def index(self):
+        """ The index of the next word to be decoded.  (Read-only) """
+        return self._index
+
+    @property
+    def memoize(self):
+        """ Whether this state memoizes element decoding.  (Read-only) """
+        return self._memoize
+
     def rule(self, delta=0):
         i = self._index + delta
         if 0 <= i < len(self._results):
@@ -116,22 +152,28 @@ class State(object):
     # Methods for tracking decoding of recognition.
 
     class Frame(object):
-        __slots__ = ("depth", "actor", "begin", "end")
+        __slots__ = ("depth", "actor", "begin", "end",
+                     "previous_depth_frame", "previous_actor_frame")
 
         def __init__(self, depth, actor, begin):
             self.depth = depth
             self.actor = actor
             self.begin = begin
             self.end = None
+            self.previous_depth_frame = None
+            self.previous_actor_frame = None
 
     def initialize_decoding(self):
         self._depth = 0
         self._stack = []
+        self._depth_frames = {}
+        self._actor_frames = {}
+        self._memo = {}
         self._previous_index = None
 
     def decode_attempt(self, element):
         self._depth += 1
-        self._stack.append(State.Frame(self._depth, element, self._index))
+        self._push_frame(State.Frame(self._depth, element, self._index))
         self._log_step(element, "attempt")
 
     def decode_retry(self, element):
@@ -159,25 +201,108 @@ class State(object):
         self._depth -= 1
 
     def decode_failure(self, element):
-        frame = self._stack.pop()
+        frame = self._pop_frame()
         self._index = frame.begin
         self._depth = frame.depth
         self._log_step(element, "failure")
         self._depth -= 1
 
+    # -----------------------------------------------------------------------
+    # Methods for memoized decoding.
+
+    def decode_element(self, element):
+        """
+            Return a generator decoding *element* at the current index.
+
+            If this state was created with *memoize* enabled, the
+            decoding results of each element are stored in a memo table
+            keyed by the element and the index at which decoding starts.
+            Later attempts to decode the same element at the same index
+            replay the stored results instead of decoding again.  The
+            memo table is cleared by :meth:`initialize_decoding`.
+
+        """
+        if not self._memoize:
+            return element.decode(self)
+        return self._decode_memoized(element)
+
+    def _decode_memoized(self, element):
+        begin = self._index
+        depth = self._depth
+        stack_length = len(self._stack)
+
+        key = (element, begin)
+        results = self._memo.get(key)
+        if results is None:
+            # Decode the element exhaustively, storing the frames of the
+            #  first decoding to reach each end index.  Later decodings
+            #  reaching the same end index cannot change whether the
+            #  remaining words decode, so they are discarded.
+            results = []
+            ends = set()
+            for _ in element.decode(self):
+                if self._index in ends:
+                    continue
+                ends.add(self._index)
+                frames = tuple((frame.depth - depth, frame.actor,
+                                frame.begin, frame.end)
+                               for frame in self._stack[stack_length:])
+                results.append((self._index, frames))
+            self._memo[key] = results
+
+        # Replay the stored decodings by rebuilding their frames on the
+        #  stack.
+        for end, frames in results:
+            for result in self.replay_frames(frames, end):
+                yield result
+
+    def replay_frames(self, frames, end):
+        """
+            Push the frames of a complete decoding onto the stack.
+
+            This method is a generator yielding this state once, with
+            the given *frames* on the stack and the index set to *end*.
+            Each frame is a ``(depth, actor, begin, end)`` tuple, with
+            the depth relative to the current depth.  The stack and index
+            are restored afterwards.
+
+        """
+        begin = self._index
+        depth = self._depth
+        for relative_depth, actor, frame_begin, frame_end in frames:
+            frame = State.Frame(depth + relative_depth, actor, frame_begin)
+            frame.end = frame_end
+            self._push_frame(frame)
+        self._index = end
+        yield self
+        for _ in frames:
+            self._pop_frame()
+        self._index = begin
+        self._depth = depth
+
+    # The last frame on the stack for each depth and for each actor are
+    #  stored so that they can be found without scanning the stack.  Each
+    #  frame links to the frames it replaced, which are restored when it
+    #  is popped.
+
+    def _push_frame(self, frame):
+        frame.previous_depth_frame = self._depth_frames.get(frame.depth)
+        frame.previous_actor_frame = self._actor_frames.get(id(frame.actor))
+        self._depth_frames[frame.depth] = frame
+        self._actor_frames[id(frame.actor)] = frame
+        self._stack.append(frame)
+
+    def _pop_frame(self):
+        frame = self._stack.pop()
+        self._depth_frames[frame.depth] = frame.previous_depth_frame
+        self._actor_frames[id(frame.actor)] = frame.previous_actor_frame
+        return frame
+
     def _get_frame_from_depth(self):
-        for i in range(len(self._stack)-1, -1, -1):
-            frame = self._stack[i]
-            if frame.depth == self._depth:
-                return frame
-        return None
+        return self._depth_frames.get(self._depth)
 
     def _get_frame_from_actor(self, actor):
-        for i in range(len(self._stack)-1, -1, -1):
-            frame = self._stack[i]
-            if frame.actor is actor:
-                return frame
-        return None
+        return self._actor_frames.get(id(actor))
 
     def _log_step(self, parser, message):
         if not self._log_decode or not self._log_decode.isEnabledFor(DEBUG):
@@ -220,7 +345,16 @@ class State(object):
 class Node(object):
 
     __slots__ = ("parent", "children", "actor", "results",
-                 "begin", "end", "depth", "engine")
+                 "begin", "end", "depth", "engine", "_value")
+
+    # Marker for nodes whose value has not been computed yet.
+    _no_value = object()
+
+    # Types of values which are cached.  Other values, such as lists,
+    #  could be modified by callers, so they are computed again by each
+    #  call and never shared between callers.
+    _cached_value_types = string_types + integer_types + (float,
+                                                          type(None))
 
     # pylint: disable=too-many-arguments
     def __init__(self, parent, actor, results, begin, end, depth, engine):
@@ -232,6 +366,7 @@ class Node(object):
         self.depth = depth
         self.engine = engine
         self.children = []
+        self._value = Node._no_value
 
     def __repr__(self):
         return "Node: %s, %s" % (self.actor, self.words())
@@ -243,7 +378,14 @@ class Node(object):
         return self.results[self.begin:self.end]
 
     def value(self):
-        return self.actor.value(self)
+        # Compute immutable values once, as the values of parent nodes
+        #  are usually computed from the values of their children.
+        if self._value is not Node._no_value:
+            return self._value
+        value = self.actor.value(self)
+        if isinstance(value, Node._cached_value_types):
+            self._value = value
+        return value
 
     def pretty_string(self, indent=""):
         if not self.children:
@@ -294,3 +436,47 @@ class Node(object):
                     continue
             matches.extend(child.get_children_by_name(name, shallow))
         return matches
+
+    def get_named_children(self, shallow=False):
+        """
+        Get a dictionary of names to the first node below this node with
+        each name, collected in a single pass.
+
+        This is equivalent to calling :meth:`get_child_by_name` for each
+        name, but walks the tree only once.
+        """
+        named = {}
+        pending = list(reversed(self.children))
+        while pending:
+            child = pending.pop()
+            if child.name:
+                if child.name not in named:
+                    named[child.name] = child
+                if shallow:
+                    # If shallow, don't look past named children.
+                    continue
+            pending.extend(reversed(child.children))
+        return named
+
+    def get_extras(self, extras, values=None):
+        """
+        Get a dictionary of the values of the named nodes below this
+        node for the given extras.
+
+        Extras not found below this node use the default value of their
+        element, if it has one.  Named nodes are found as with
+        :meth:`get_child_by_name` in shallow mode.
+
+        - *extras* -- dict of extra names to elements
+        - *values* -- optional dict to update and return
+        """
+        if values is None:
+            values = {}
+        named = self.get_named_children(shallow=True)
+        for name, element in extras.items():
+            extra_node = named.get(name)
+            if extra_node:
+                values[name] = extra_node.value()
+            elif element.has_default():
+                values[name] = element.default
+        return values
@@ -1 +1 @@
-from .parse import spec_parser, CompoundTransformer
\ No newline at end of file
+from .parse import spec_parser, spec_parse_cache, CompoundTransformer
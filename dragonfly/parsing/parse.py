@@ -1,16 +1,165 @@
+from collections import OrderedDict
+from threading import Lock
+import hashlib
+import logging
+import pickle
+
+import lark
 from lark import Lark, Transformer
 from ..grammar.elements_basic import Literal, Optional, Sequence, Alternative, Empty
 import os
 
 dir_path = os.path.dirname(os.path.realpath(__file__))
+grammar_path = os.path.join(dir_path, "grammar.lark")
+precompiled_path = os.path.join(dir_path, "grammar.lark.bin")
+
+_log = logging.getLogger("compound.parse")
+
+def build_spec_parser():
+    """ Build the spec parser from the Lark grammar file. """
+    return Lark.open(grammar_path, parser="lalr")
+
+def _precompiled_header():
+    # The precompiled parser is only valid for the grammar and Lark
+    #  version it was built from.
+    with open(grammar_path, "rb") as f:
+        grammar_hash = hashlib.sha1(f.read()).hexdigest()
+    return {"lark_version": lark.__version__, "grammar_hash": grammar_hash}
+
+def save_spec_parser(path=precompiled_path):
+    """
+        Save a precompiled spec parser to the given path.
+
+        The precompiled parser shipped with dragonfly can be rebuilt
+        after changing the grammar file by calling this function.
+    """
+    parser = build_spec_parser()
+    with open(path, "wb") as f:
+        pickle.dump(_precompiled_header(), f, protocol=2)
+        parser.save(f)
+
+def load_spec_parser(path=precompiled_path):
+    """
+        Load a precompiled spec parser from the given path.
+
+        Returns *None* if the file does not exist or was built from a
+        different grammar or Lark version.
+    """
+    if not os.path.isfile(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            if pickle.load(f) != _precompiled_header():
+                _log.debug("Precompiled spec parser %r is out of date",
+                           path)
+                return None
+            return Lark.load(f)
+    except Exception as e:
+        _log.warning("Failed to load precompiled spec parser %r: %s",
+                     path, e)
+        return None
+
+class LazySpecParser(object):
+    """
+        Spec parser which is constructed on first use.
+
+        The precompiled parser is loaded if it is up to date, otherwise
+        the parser is built from the grammar file.
+    """
+
+    def __init__(self, path=precompiled_path):
+        self._path = path
+        self._parser = None
+        self._lock = Lock()
 
-spec_parser = Lark.open(os.path.join(dir_path, "grammar.lark"),
-    parser="lalr"
-)
+    @property
+    def loaded(self):
+        """ Whether the parser has been constructed. """
+        return self._parser is not None
+
+    @property
+    def parser(self):
+        """ The Lark parser, constructed if necessary. """
+        if self._parser is None:
+            with self._lock:
+                if self._parser is None:
+                    parser = load_spec_parser(self._path)
+                    if parser is None:
+                        parser = build_spec_parser()
+                    self._parser = parser
+        return self._parser
+
+    def parse(self, text):
+        """ Parse the given spec string, returning its Lark tree. """
+        return self.parser.parse(text)
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.parser, name)
+
+spec_parser = LazySpecParser()
 
 class ParseError(Exception):
     pass
 
+class SpecParseCache(object):
+    """
+        Least-recently-used cache of parsed compound specs.
+
+        Spec strings are parsed by the given Lark parser the first time
+        they are seen; later parses of the same spec return the stored
+        parse tree.  The trees are shared, so they must not be modified.
+        Specs which fail to parse are not stored.
+
+        The *hits* and *misses* counters can be used to profile spec
+        parsing, e.g. during startup.
+    """
+
+    def __init__(self, parser, maxsize=10000):
+        self._parser = parser
+        self._maxsize = maxsize
+        self._trees = OrderedDict()
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def maxsize(self):
+        """ The maximum number of parse trees stored. """
+        return self._maxsize
+
+    @property
+    def currsize(self):
+        """ The number of parse trees currently stored. """
+        return len(self._trees)
+
+    def parse(self, spec):
+        """ Parse the given spec string, returning its Lark tree. """
+        with self._lock:
+            tree = self._trees.pop(spec, None)
+            if tree is not None:
+                self.hits += 1
+                self._trees[spec] = tree
+                return tree
+            self.misses += 1
+
+        tree = self._parser.parse(spec)
+        with self._lock:
+            self._trees[spec] = tree
+            while len(self._trees) > self._maxsize:
+                self._trees.popitem(last=False)
+        return tree
+
+    def clear(self):
+        """ Remove all stored parse trees and reset the counters. """
+        with self._lock:
+            self._trees.clear()
+            self.hits = 0
+            self.misses = 0
+
+spec_parse_cache = SpecParseCache(spec_parser)
+
 class CompoundTransformer(Transformer):
     """
         Visits each node of the parse tree starting with the leaves
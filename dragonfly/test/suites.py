@@ -42,6 +42,7 @@ common_names = [
     "test_log",
     "test_parser",
     "test_lark_parser",
+    "test_grammar_list",
     "test_rpc",
     "test_timer",
     "test_window",
@@ -115,6 +116,7 @@ engine_tests_dict = {
     "text": [
         "test_engine_text",
         "test_dictation",
+        "test_grammar_decoding",
     ] + common_names + language_names,
 
     "natlink": natlink_names,
@@ -10,6 +10,11 @@ These tests assume that the `kaldi_model` model is used.
 Adapted from `test_engine_sphinx.py`.
 """
 
+import collections
+import itertools
+import os
+import threading
+import time
 import unittest
 
 import logging
@@ -25,8 +30,10 @@ from dragonfly.test import (ElementTester, RuleTestGrammar)
 
 try:
     from dragonfly.engines.backend_kaldi.engine import KaldiError
+    from dragonfly.engines.backend_kaldi.audio import VADAudio
 except ImportError:
     KaldiError = Exception
+    VADAudio = object
 
 
 class MockLoggingHandler(logging.Handler):
@@ -70,6 +77,84 @@ class RecognitionObserverTester(RecognitionObserver):
         self.words = False
 
 
+class SyntheticStream(object):
+    """
+    Stand-in for a sounddevice stream, which passes the given blocks to
+    callback at the real-time rate of a microphone from a separate
+    thread, while started.
+    """
+
+    def __init__(self, callback, blocks, block_duration_s):
+        self.callback = callback
+        self.blocks = blocks
+        self.block_duration_s = block_duration_s
+        self.closed = False
+        self.active = False
+        self._active_event = threading.Event()
+        self.thread = threading.Thread(target=self._feeder_thread)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def _feeder_thread(self):
+        next_time = None
+        for block in self.blocks:
+            while not self.active and not self.closed:
+                self._active_event.wait()
+                next_time = None
+            if self.closed:
+                return
+            next_time = (next_time or time.time()) + self.block_duration_s
+            time.sleep(max(0, next_time - time.time()))
+            self.callback(block)
+
+    def start(self):
+        self.active = True
+        self._active_event.set()
+
+    def stop(self):
+        self.active = False
+        self._active_event.clear()
+
+    def close(self):
+        self.closed = True
+        self.active = False
+        self._active_event.set()
+
+
+class SyntheticAudio(VADAudio):
+    """
+    Audio source which streams the given blocks (default: endless silence)
+    at the real-time rate of a microphone, rather than from a microphone.
+    Records the latency between each block becoming available and it
+    being read, in ``latencies``.
+    """
+
+    def __init__(self, blocks=None, **kwargs):
+        if blocks is None:
+            block_size = self.BLOCK_SIZE_SAMPLES * self.SAMPLE_WIDTH
+            blocks = itertools.repeat(b'\0' * block_size)
+        self.blocks = blocks
+        self.latencies = []
+        self._block_times = collections.deque()
+        super(SyntheticAudio, self).__init__(**kwargs)
+
+    def _connect(self, start=None):
+        def callback(block):
+            self._block_times.append(time.time())
+            self.callback(block)
+        self.stream = SyntheticStream(callback, self.blocks,
+                                      self.BLOCK_DURATION_MS / 1000.0)
+        if start:
+            self.start()
+
+    def read(self, nowait=False, timeout=None):
+        block = super(SyntheticAudio, self).read(nowait=nowait,
+                                                 timeout=timeout)
+        if block:
+            self.latencies.append(time.time() - self._block_times.popleft())
+        return block
+
+
 class KaldiEngineCase(unittest.TestCase):
     """
     Base TestCase class for Kaldi engine tests
@@ -216,6 +301,422 @@ class EngineTests(KaldiEngineCase):
         finally:
             grammar.unload()
 
+    def test_list_shared_by_rules(self):
+        """ Verify that a list referenced by several rules is compiled once
+            and that list updates only recompile the list. """
+        lst = List("shared list", ["test list"])
+        grammar = Grammar("test")
+        for word in ("one", "two", "three"):
+            element = Sequence([Literal(word), ListRef("shared list", lst)])
+            grammar.add_rule(Rule(name=word, element=element, exported=True))
+        compiler = self.engine._compiler
+        try:
+            grammar.load()
+            self.assertEqual(len(compiler.kaldi_list_rule_by_listreflist_dict), 1)
+            self.assert_mimic_success("one test list", "three test list")
+            self.assert_mimic_failure("test list")
+
+            # Record the rules recompiled by a list update.
+            compiled_rules = []
+            def compile_rule_root(rule, grammar, kaldi_rule):
+                compiled_rules.append(rule)
+                return compile_rule_root_orig(rule, grammar, kaldi_rule)
+            compile_rule_root_orig = compiler._compile_rule_root
+            compiler._compile_rule_root = compile_rule_root
+            lst.append("hello world")
+            self.assert_mimic_success("two hello world")
+            self.assertEqual(compiled_rules, [])
+        finally:
+            if "_compile_rule_root" in vars(compiler):
+                del compiler._compile_rule_root
+            grammar.unload()
+        self.assertEqual(len(compiler.kaldi_list_rule_by_listreflist_dict), 0)
+
+    def test_list_decoding(self):
+        """ Verify that rules containing a list are decoded with the list's
+            sub-FST enabled, and that a list recognized on its own, rather
+            than through a rule, is rejected. """
+        import shutil
+        import tempfile
+        compiler = self.engine._compiler
+        if compiler.parsing_framework != 'token':
+            self.skipTest("decoder output has no nonterminals")
+        lst = List("decoded list", ["test list"])
+        grammar = Grammar("test")
+        element = Sequence([Literal("one"), ListRef("decoded list", lst)])
+        grammar.add_rule(Rule(name="one", element=element, exported=True))
+        grammar.load()
+        decoder = self.engine._decoder
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            kaldi_rule = compiler.kaldi_rule_by_rule_dict[grammar.rules[0]]
+            kaldi_list_rule, = \
+                compiler.kaldi_list_rule_by_listreflist_dict.values()
+            filename = os.path.join(tmp_dir, "silence.wav")
+            self.engine._audio.write_wav(filename, b'\0\0' * 16000)
+
+            # Record the activity passed to the decoder and replace its
+            #  output with the given one.
+            activities = []
+            def decode(frames, finalize, grammars_activity=None):
+                if grammars_activity is not None:
+                    activities.append(list(grammars_activity))
+                return decode_orig(frames, finalize, grammars_activity)
+            decode_orig = decoder.decode
+            decoder.decode = decode
+            def transcribe(output):
+                decoder.get_output = lambda: (output, 1.0)
+                try:
+                    return self.engine.transcribe_wave_file(filename)[:2]
+                finally:
+                    del decoder.get_output
+
+            # The list sub-FST is enabled for the rule linking to it.
+            self.assertEqual(
+                transcribe("#nonterm:rule%d one test list #nonterm:end"
+                           % kaldi_rule.id),
+                (kaldi_rule, "one test list"))
+            self.assertTrue(activities[0][kaldi_rule.id])
+            self.assertTrue(activities[0][kaldi_list_rule.id])
+
+            # A bare list item is not a top-level result.
+            self.assertEqual(
+                transcribe("#nonterm:rule%d test list #nonterm:end"
+                           % kaldi_list_rule.id),
+                (None, ""))
+        finally:
+            if "decode" in vars(decoder):
+                del decoder.decode
+            shutil.rmtree(tmp_dir)
+            grammar.unload()
+
+    def test_rule_cache(self):
+        """ Verify that unchanged rules are loaded from the rule cache and
+            benchmark cold and warm grammar loads. """
+        compiler = self.engine._compiler
+        if not compiler.rule_cache:
+            self.skipTest("rule cache disabled")
+        lst = List("cached list", ["test list"])
+        grammar = Grammar("test")
+        words = ("one", "two", "three", "four", "five")
+        for first in words:
+            for second in words:
+                element = Sequence([Literal(first), Literal(second),
+                                    ListRef("cached list", lst)])
+                grammar.add_rule(Rule(name=first + second, element=element,
+                                      exported=True))
+
+        def timed_load():
+            start_time = time.time()
+            grammar.load()
+            self.engine.prepare_for_recognition()
+            return time.time() - start_time
+
+        compiler.rule_cache.clear()
+        try:
+            cold_time = timed_load()
+            grammar.unload()
+            hits = compiler.rule_cache.hits
+            warm_time = timed_load()
+            # All 25 rules and the list were found in the cache.
+            self.assertEqual(compiler.rule_cache.hits - hits, 26)
+            self.assert_mimic_success("one five test list")
+        finally:
+            grammar.unload()
+        self.log.info("Loading 25 rules: cold %.2f ms, warm %.2f ms",
+                      cold_time * 1000, warm_time * 1000)
+
+    def test_parallel_compilation(self):
+        """ Verify that compiling rules in parallel gives the same results
+            as compiling them one after another. """
+        compiler = self.engine._compiler
+        grammar = Grammar("test")
+        words = ("one", "two", "three", "four", "five")
+        for first in words:
+            for second in words:
+                element = Sequence([Literal(first), Literal(second)])
+                grammar.add_rule(Rule(name=first + second, element=element,
+                                      exported=True))
+
+        def load_filenames():
+            grammar.load()
+            try:
+                self.assert_mimic_success("one five", "four two")
+                return [compiler.kaldi_rule_by_rule_dict[rule].filename
+                        for rule in grammar.rules]
+            finally:
+                grammar.unload()
+
+        options = (compiler.lazy_compilation, compiler.compile_workers,
+                   compiler.rule_cache)
+        compiler.lazy_compilation = False
+        compiler.rule_cache = None
+        try:
+            compiler.compile_workers = 1
+            compiler.fst_cache.invalidate()
+            serial_filenames = load_filenames()
+            compiler.compile_workers = 4
+            compiler.fst_cache.invalidate()
+            self.assertEqual(load_filenames(), serial_filenames)
+        finally:
+            (compiler.lazy_compilation, compiler.compile_workers,
+             compiler.rule_cache) = options
+
+    def test_rule_activity(self):
+        """ Verify that the rule activity vector is kept up to date by rule
+            and grammar (de)activation, and benchmark computing it. """
+        lst = List("activity list", ["test list"])
+        grammar1 = Grammar("test1")
+        grammar2 = Grammar("test2")
+        words = ("one", "two", "three", "four", "five")
+        for grammar in (grammar1, grammar2):
+            for word in words:
+                element = Sequence([Literal(word), ListRef("list", lst)])
+                grammar.add_rule(Rule(name=word, element=element,
+                                      exported=True))
+
+        def assert_activity_current():
+            activity = list(self.engine._compute_kaldi_rules_activity(
+                phrase_start=False))
+            self.engine._rebuild_kaldi_rules_activity()
+            self.assertEqual(activity, self.engine._kaldi_rules_activity)
+            return activity
+
+        try:
+            grammar1.load()
+            grammar2.load()
+            self.assertTrue(all(assert_activity_current()))
+            for rule in grammar1.rules:
+                rule.disable()
+            assert_activity_current()
+            grammar2.rules[0].disable()
+            assert_activity_current()
+            grammar2.set_exclusiveness(True)
+            assert_activity_current()
+            grammar2.set_exclusiveness(False)
+            grammar1.rules[0].enable()
+            self.engine.deactivate_grammar(grammar2)
+            self.assertEqual(sum(assert_activity_current()), 2)
+
+            start_time = time.time()
+            for _ in range(100):
+                self.engine._compute_kaldi_rules_activity(phrase_start=False)
+            self.log.info("Computing rule activity: %.3f ms",
+                          (time.time() - start_time) * 10)
+        finally:
+            grammar1.unload()
+            grammar2.unload()
+
+    def test_parse_cache(self):
+        """ Verify that repeated recognitions reuse cached parse results
+            until the active rules change. """
+        grammar = Grammar("test")
+        grammar.add_rule(CompoundRule(name="r1", spec="scratch that"))
+        grammar.add_rule(CompoundRule(name="r2", spec="press enter"))
+        grammar.load()
+        try:
+            hits = self.engine.parse_cache_hits
+            misses = self.engine.parse_cache_misses
+            for _ in range(3):
+                self.assert_mimic_success("scratch that", "press enter")
+            self.assertEqual(self.engine.parse_cache_misses - misses, 2)
+            self.assertEqual(self.engine.parse_cache_hits - hits, 4)
+            for results in self.engine._parse_cache.values():
+                self.assertIsInstance(results, tuple)
+
+            # Changing the active rules invalidates cached results.
+            grammar.rules[0].deactivate()
+            self.assert_mimic_failure("scratch that")
+            grammar.rules[0].activate()
+            self.assert_mimic_success("scratch that")
+            self.assertEqual(self.engine.parse_cache_misses - misses, 4)
+        finally:
+            grammar.unload()
+
+    def test_transcribe_files(self):
+        """ Verify that wave files are transcribed without processing the
+            recognitions. """
+        import shutil
+        import tempfile
+        from dragonfly.engines.backend_kaldi.batch import transcribe_files
+        test_func = self.get_test_function()
+
+        class TestRule(CompoundRule):
+            spec = "hello world"
+            _process_recognition = test_func
+
+        grammar = Grammar("test")
+        grammar.add_rule(TestRule())
+        grammar.load()
+        tmp_dir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmp_dir, "silence.wav")
+            self.engine._audio.write_wav(filename, b'\0\0' * 16000)
+            try:
+                kaldi_rule, text, _, audio_length_s = \
+                    self.engine.transcribe_wave_file(filename)
+            finally:
+                grammar.unload()
+            self.assertIsNone(kaldi_rule)
+            self.assertEqual(text, "")
+            self.assertAlmostEqual(audio_length_s, 1.0, places=2)
+            self.assert_test_function_called(test_func, 0)
+
+            # The engine transcribes the files itself with one process,
+            #  and is disconnected afterwards.
+            results, stats = transcribe_files(
+                [filename, (filename, ""), "missing.wav"], processes=1)
+            self.assertIsNone(self.engine._decoder)
+            self.assertEqual([result.filename for result in results],
+                             [filename, filename, "missing.wav"])
+            self.assertEqual(stats["errors"], 1)
+            self.assertEqual(stats["correct"], 1)
+            self.assertAlmostEqual(stats["audio_s"], 2.0, places=2)
+            self.log.info("Transcribed at %.1f x real time", stats["speed"])
+        finally:
+            shutil.rmtree(tmp_dir)
+
+    def test_idle_audio_wait(self):
+        """ Benchmark idle CPU use and audio wake-up latency of the
+            recognition loop, using a synthetic source of silence. """
+        audio = SyntheticAudio(start=True)
+        audio_iter = audio.vad_collector(
+            timeout=audio.BLOCK_DURATION_MS / 1000.0)
+        try:
+            start_times = os.times()
+            self.engine.do_recognition(timeout=2, audio_iter=audio_iter)
+            end_times = os.times()
+        finally:
+            audio.destroy()
+        cpu_time = sum(end_times[:2]) - sum(start_times[:2])
+        latencies = sorted(audio.latencies)
+        self.log.info("Idle recognition loop: %.1f%% CPU, audio wake-up "
+                      "latency median %.2f ms, max %.2f ms",
+                      cpu_time / 2 * 100,
+                      latencies[len(latencies) // 2] * 1000,
+                      latencies[-1] * 1000)
+        # Waiting for audio must not busy-loop.
+        self.assertLess(cpu_time, 1.0)
+        self.assertGreater(len(latencies), 100)
+
+    def test_energy_gate(self):
+        """ Verify that quiet blocks are gated before the VAD, unless they
+            may be quiet unvoiced speech. """
+        import numpy as np
+        samples = np.arange(160)
+        silence = np.zeros(160, dtype=np.int16).tobytes()
+        hum = (150 * np.sin(samples * 2 * np.pi * 100 / 16000.0))
+        hiss = (150 * np.sign(np.sin(samples * 2 * np.pi * 6000 / 16000.0)))
+        tone = (3000 * np.sin(samples * 2 * np.pi * 200 / 16000.0))
+        hum, hiss, tone = [block.astype(np.int16).tobytes()
+                           for block in (hum, hiss, tone)]
+        audio = SyntheticAudio(start=False, energy_gate_dbfs=-45)
+        try:
+            for block in (silence, hum):
+                self.assertFalse(audio.is_speech(block))
+            self.assertEqual(audio.num_blocks_gated, 2)
+            for block in (hiss, tone):
+                audio.is_speech(block)
+            self.assertEqual(audio.num_blocks_gated, 2)
+            self.assertEqual(audio.num_blocks_vad, 2)
+
+            start_time = time.time()
+            for _ in range(1000):
+                audio.is_speech(silence)
+            self.log.info("Energy gate: %.1f us per silent block",
+                          (time.time() - start_time) * 1000)
+        finally:
+            audio.destroy()
+
+    def test_audio_ring_buffer(self):
+        """ Verify that audio blocks are read from the ring buffer as
+            views, without copies, and stored contiguously. """
+        from dragonfly.engines.backend_kaldi.audio import (AudioRingBuffer,
+                                                           AudioStore)
+        ring_buffer = AudioRingBuffer(4, 2)
+        for i in range(6):
+            ring_buffer.write(bytearray([i, i]))
+        self.assertEqual(ring_buffer.num_dropped, 2)
+        blocks = [ring_buffer.read(timeout=0) for _ in range(len(ring_buffer))]
+        self.assertIsInstance(blocks[0], memoryview)
+        self.assertEqual([bytes(block) for block in blocks],
+                         [b'\x02\x02', b'\x03\x03', b'\x04\x04', b'\x05\x05'])
+        self.assertIsNone(ring_buffer.read(timeout=0.01))
+
+        audio_store = AudioStore(self.engine._audio, maxlen=1)
+        audio_store._buffer = bytearray(3)
+        for block in blocks:
+            audio_store.add_block(block)
+        self.assertEqual(audio_store.current_audio_data,
+                         b'\x02\x02\x03\x03\x04\x04\x05\x05')
+        audio_store.finalize("text", "grammar", "rule")
+        self.assertEqual(audio_store[0].audio_data,
+                         b'\x02\x02\x03\x03\x04\x04\x05\x05')
+        self.assertEqual(len(audio_store.current_audio_data), 0)
+
+    def test_partial_parse_throttling(self):
+        """ Verify that unchanged or too frequent partial outputs are not
+            reparsed. """
+        engine = self.engine
+        get_output = engine._decoder.get_output
+        calls = []
+        def mock_get_output():
+            calls.append(None)
+            return '', 0.0
+        engine._decoder.get_output = mock_get_output
+        try:
+            parse_count = engine.partial_parse_count
+            skip_count = engine.partial_parse_skip_count
+            engine._last_partial_output = None
+            engine._next_partial_parse_time = 0
+            for _ in range(10):
+                self.assertFalse(engine._parse_partial_output(False))
+            self.assertEqual(engine.partial_parse_count - parse_count, 1)
+            self.assertEqual(engine.partial_parse_skip_count - skip_count, 9)
+            self.assertEqual(len(calls), 10)
+
+            # Within the interval, the output is not even fetched.
+            engine._options['partial_parse_interval_ms'] = 60000
+            engine._next_partial_parse_time = 0
+            for _ in range(10):
+                self.assertTrue(engine._parse_partial_output(True))
+            self.assertEqual(len(calls), 11)
+            self.assertEqual(engine.partial_parse_skip_count - skip_count, 19)
+        finally:
+            engine._options['partial_parse_interval_ms'] = 0
+            engine._decoder.get_output = get_output
+
+    def test_audio_store_writer(self):
+        """ Verify that retained recognitions are written in the
+            background without blocking, dropping them when the queue is
+            full. """
+        import shutil
+        import tempfile
+        from dragonfly.engines.backend_kaldi.audio import AudioStore
+        save_dir = tempfile.mkdtemp()
+        try:
+            audio_store = AudioStore(self.engine._audio, maxlen=1,
+                                     save_dir=save_dir, save_audio=True,
+                                     save_queue_size=5, save_fsync="batch")
+            start_time = time.time()
+            for i in range(10):
+                audio_store.add_block(b'\0\0' * 160)
+                audio_store.finalize("text %d" % i, "grammar", "rule")
+            audio_store.save_all()
+            self.log.info("Retained 10 recognitions in %.2f ms",
+                          (time.time() - start_time) * 1000)
+            audio_store.close()
+
+            writer = audio_store.writer
+            self.assertEqual(writer.num_written + writer.num_dropped, 10)
+            self.assertGreaterEqual(writer.num_written, 5)
+            self.assertLessEqual(writer.max_queue_length, 5)
+            with open(os.path.join(save_dir, "retain.tsv")) as tsv_file:
+                lines = tsv_file.read().splitlines()
+            self.assertEqual(len(lines), writer.num_written)
+        finally:
+            shutil.rmtree(save_dir)
+
 
 # ---------------------------------------------------------------------
 
@@ -12,6 +12,8 @@ language models distributed with the `pocketsphinx` Python package are used.
 import unittest
 
 import logging
+import random
+import struct
 
 from dragonfly.engines import (EngineBase, EngineError, MimicFailure,
                                get_engine)
@@ -209,6 +211,8 @@ class EngineTests(SphinxEngineCase):
             "RATE",
             "SAMPLE_WIDTH",
             "FRAMES_PER_BUFFER",
+
+            "SEARCH_WORKERS",
         ]
 
         class TestConfig(object):
@@ -404,6 +408,70 @@ class EngineTests(SphinxEngineCase):
         finally:
             grammar.unload()
 
+    def test_search_workers(self):
+        """ Verify that grammars can be searched concurrently. """
+        # Restart the engine with a search pool of two decoders.
+        self.engine.disconnect()
+        self.engine.config.SEARCH_WORKERS = 2
+        grammars = []
+        try:
+            self.engine.connect()
+            search_pool = self.engine._search_pool
+            self.assertEqual(search_pool.size, 2)
+
+            # Load a few grammars.
+            for i, spec in enumerate(["hello world", "testing", "hello"]):
+                grammar = Grammar("test%d" % i)
+                grammar.add_rule(CompoundRule(name="rule", spec=spec))
+                grammar.load()
+                grammars.append(grammar)
+            names = [self.engine._get_grammar_wrapper(grammar).search_name
+                     for grammar in grammars]
+
+            # Re-process some noise with each grammar search, first using
+            # the engine's decoder, then using the search pool.
+            rand = random.Random(0)
+            buffers = [
+                struct.pack("<1024h", *[rand.randint(-500, 500)
+                                        for _ in range(1024)])
+                for _ in range(16)
+            ]
+            expected = {}
+            for grammar, name in zip(grammars, names):
+                wrapper = self.engine._get_grammar_wrapper(grammar)
+                self.engine._set_grammar(wrapper, True)
+                hyp = self.engine._decoder.batch_process(
+                    buffers, use_callbacks=False)
+                expected[name] = hyp.hypstr if hyp else None
+            self.engine._set_default_search()
+            self.assertEqual(search_pool.process(names, buffers), expected)
+
+            # Repeated utterances must not set the searches again.
+            set_counts = [worker.set_count for worker in search_pool._workers]
+            self.assertEqual(sum(set_counts), len(names))
+            for _ in range(3):
+                self.assertEqual(search_pool.process(names, buffers),
+                                 expected)
+            self.assertEqual(
+                [worker.set_count for worker in search_pool._workers],
+                set_counts)
+
+            # Check that unloaded and updated grammars are searched
+            # correctly.
+            grammars.pop(0).unload()
+            del expected[names.pop(0)]
+            wrapper = self.engine._get_grammar_wrapper(grammars[0])
+            wrapper.set_search = True
+            self.engine._set_grammar(wrapper, False)
+            self.assertEqual(search_pool.process(names, buffers), expected)
+
+            # Mimic should still work normally.
+            self.assert_mimic_success("testing")
+        finally:
+            for grammar in grammars:
+                grammar.unload()
+            self.engine.config.SEARCH_WORKERS = 1
+
     def test_training_session(self):
         """ Verify that no recognition processing occurs when training. """
         # Set up a rule to "train".
@@ -20,13 +20,16 @@
 #
 
 import locale
+import logging
+import threading
+import time
 import unittest
 
 import six
 
-from dragonfly.engines import EngineBase
+from dragonfly.engines import EngineBase, MimicFailure
 from dragonfly import (Literal, Dictation, Sequence, CompoundRule,
-                       get_engine)
+                       Grammar, Rule, List, ListRef, get_engine)
 from dragonfly.test import ElementTester, RecognitionFailure, RuleTestCase
 
 
@@ -73,3 +76,184 @@ class TestEngineText(unittest.TestCase):
         # Check that recognition failure is possible.
         results = tester.recognize(u"jalapeo")
         assert results is RecognitionFailure
+
+
+# --------------------------------------------------------------------------
+
+class TestEngineUpdateBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = get_engine("text")
+        self.updates = []
+
+        self.grammars = []
+        self.lists = []
+        for name in ("first", "second"):
+            lst = List("%s_list" % name, ["a"])
+            grammar = Grammar(name)
+            grammar.add_rule(Rule("%s_rule" % name, ListRef("ref", lst),
+                                  exported=True))
+            grammar.add_rule(Rule("%s_other" % name, Literal("other"),
+                                  exported=True))
+            grammar.load()
+            self.grammars.append(grammar)
+            self.lists.append(lst)
+
+        # Record the updates passed to the engine.
+        def update_list(lst, grammar, delta=None):
+            self.updates.append(("list", grammar.name, lst.name,
+                                 sorted(delta.added), sorted(delta.removed)))
+
+        def activate_rule(rule, grammar):
+            self.updates.append(("activate", grammar.name, rule.name))
+
+        def deactivate_rule(rule, grammar):
+            self.updates.append(("deactivate", grammar.name, rule.name))
+
+        self.engine.update_list = update_list
+        self.engine.activate_rule = activate_rule
+        self.engine.deactivate_rule = deactivate_rule
+
+    def tearDown(self):
+        for name in ("update_list", "activate_rule", "deactivate_rule"):
+            if name in vars(self.engine):
+                delattr(self.engine, name)
+        for grammar in self.grammars:
+            if grammar.loaded:
+                grammar.unload()
+
+    def test_coalesced_updates(self):
+        """ Verify that batched updates are coalesced. """
+        first, second = self.lists
+        first_grammar, second_grammar = self.grammars
+        with self.engine.batch_updates():
+            first.append("b")
+            second.append("c")
+            first.append("d")
+            first.remove("b")
+            second.remove("c")
+            first_grammar.rules[0].disable()
+            second_grammar.rules[1].disable()
+            first_grammar.rules[0].enable()
+            with self.engine.batch_updates():
+                first.append("e")
+            self.assertEqual(self.updates, [])
+        self.assertEqual(self.updates, [
+            ("list", "first", "first_list", ["d", "e"], []),
+            ("activate", "first", "first_rule"),
+            ("deactivate", "second", "second_other"),
+        ])
+
+    def test_unloaded_grammar(self):
+        """ Verify that updates for unloaded grammars are skipped. """
+        with self.engine.batch_updates():
+            self.lists[0].append("b")
+            self.lists[1].append("c")
+            self.grammars[0].unload()
+        self.assertEqual(self.updates, [
+            ("list", "second", "second_list", ["c"], []),
+        ])
+
+    def test_recognition(self):
+        """ Verify that lists can be recognized after batched updates. """
+        del self.engine.update_list
+        with self.engine.batch_updates():
+            self.lists[0].set(["hello world"])
+        self.engine.mimic("hello world")
+
+    def test_update_order(self):
+        """ Verify that list updates are applied before rule updates. """
+        rule = self.grammars[0].rules[0]
+        rule.disable()
+        del self.updates[:]
+        with self.engine.batch_updates():
+            rule.enable()
+            self.lists[0].append("b")
+        self.assertEqual(self.updates, [
+            ("list", "first", "first_list", ["b"], []),
+            ("activate", "first", "first_rule"),
+        ])
+
+        # The rule is recognized with the updated list.
+        for name in ("update_list", "activate_rule", "deactivate_rule"):
+            delattr(self.engine, name)
+        rule.disable()
+        self.assertRaises(MimicFailure, self.engine.mimic, "b")
+        with self.engine.batch_updates():
+            rule.enable()
+            self.lists[0].append("c")
+        self.engine.mimic("b")
+        self.engine.mimic("c")
+
+    def test_other_threads(self):
+        """ Verify that updates from other threads are not batched. """
+        with self.engine.batch_updates():
+            self.lists[0].append("b")
+            thread = threading.Thread(target=self.lists[1].append,
+                                      args=("c",))
+            thread.start()
+            thread.join()
+            self.assertEqual(self.updates, [
+                ("list", "second", "second_list", ["c"], []),
+            ])
+        self.assertEqual(self.updates[1:], [
+            ("list", "first", "first_list", ["b"], []),
+        ])
+
+
+# --------------------------------------------------------------------------
+
+class TestGrammarLoad(unittest.TestCase):
+
+    def setUp(self):
+        self.engine = get_engine("text")
+        self.updates = []
+
+        # Record the list updates passed to the engine.
+        def update_list(lst, grammar, delta=None):
+            self.updates.append(lst.name)
+
+        self.engine.update_list = update_list
+
+        # Build a grammar with several large lists, each referenced by
+        #  several rules.
+        self.grammar = Grammar("load")
+        lists = [List("list%d" % i, ["item %d %d" % (i, j)
+                                     for j in range(10000)])
+                 for i in range(5)]
+        for i in range(10):
+            element = Sequence([ListRef("first", lists[i % 5]),
+                                ListRef("second", lists[(i + 1) % 5])])
+            self.grammar.add_rule(Rule("rule%d" % i, element,
+                                       exported=True))
+
+    def tearDown(self):
+        for name in ("update_list", "_loads_list_items"):
+            if name in vars(self.engine):
+                delattr(self.engine, name)
+        self.grammar.unload()
+
+    def time_load(self):
+        self.grammar.unload()
+        start_time = time.time()
+        self.grammar.load()
+        return time.time() - start_time
+
+    def test_list_updates(self):
+        """ Verify that lists are only updated if the engine needs it. """
+        self.grammar.load()
+        self.assertEqual(self.updates, [])
+        self.grammar.unload()
+        self.engine._loads_list_items = False
+        self.grammar.load()
+        self.assertEqual(sorted(self.updates),
+                         ["list%d" % i for i in range(5)])
+
+    def test_load_benchmark(self):
+        """ Benchmark loading a grammar with several large lists. """
+        load_time = self.time_load()
+        self.engine._loads_list_items = False
+        update_time = self.time_load()
+        logging.getLogger("test.engine").info(
+            "5 lists of 10000 items: load %.2f ms, load and update lists "
+            "%.2f ms", load_time * 1000, update_time * 1000)
@@ -0,0 +1,878 @@
+#
+# This file is part of Dragonfly.
+# (c) Copyright 2007, 2008 by Christo Butcher
+# Licensed under the LGPL.
+#
+#   Dragonfly is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published
+#   by the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Dragonfly is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public
+#   License along with Dragonfly.  If not, see
+#   <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests and benchmarks for recognition decoding
+============================================================================
+
+"""
+
+import logging
+import time
+import unittest
+
+from dragonfly import (Literal, Sequence, Alternative, Optional, Repetition,
+                       ListRef, DictListRef, List, DictList, Dictation,
+                       Empty, Impossible, Rule, RuleRef, Compound, Grammar,
+                       get_engine)
+from dragonfly.engines.base import MimicFailure
+from dragonfly.grammar.decoding import CompiledDecoder
+from dragonfly.grammar.list import ListFirstWords
+from dragonfly.grammar.state import State
+from dragonfly.test import ElementTester, RecognitionFailure
+
+
+_log = logging.getLogger("test.decoding")
+
+
+# --------------------------------------------------------------------------
+# Utility functions.
+
+def words_rules(words, dictation=()):
+    """ Build recognition results for the given words. """
+    return tuple((word, 1000000 if i in dictation else 0)
+                 for i, word in enumerate(words.split()))
+
+
+def decode(rule, results, compiled=False, state_type=State, **kwargs):
+    """
+        Decode *results* using the given rule and return the pretty string
+        of the resulting parse tree, or *None* if decoding failed.
+
+    """
+    state = state_type(results, [rule.name], get_engine(), **kwargs)
+    state.initialize_decoding()
+    if compiled:
+        decoding = CompiledDecoder([rule]).decode(rule, state)
+    else:
+        decoding = rule.decode(state)
+    for _ in decoding:
+        if state.finished():
+            return state.build_parse_tree().pretty_string()
+    return None
+
+
+def time_decode(rule, results, **kwargs):
+    start_time = time.time()
+    decode(rule, results, **kwargs)
+    return time.time() - start_time
+
+
+class _CountingState(State):
+    """ State which counts element decoding attempts. """
+
+    attempts = 0
+
+    def decode_attempt(self, element):
+        self.attempts += 1
+        State.decode_attempt(self, element)
+
+
+def count_attempts(rule, results, **kwargs):
+    """
+        Decode *results* using the given rule and return the number of
+        element decoding attempts made.
+
+    """
+    state = _CountingState(results, [rule.name], get_engine(), **kwargs)
+    state.initialize_decoding()
+    for _ in rule.decode(state):
+        if state.finished():
+            break
+    return state.attempts
+
+
+def build_rules():
+    """ Build rules covering each type of element. """
+    n = Alternative([Literal(w) for w in "one two three".split()], name="n")
+    lst = List("lst", ["hello", "hello world"])
+    dict_list = DictList("dict", {"up": 1, "down": 2})
+    return [
+        Rule("sequence", Sequence([
+            Literal("go"), Optional(Literal("to")),
+            Optional(Repetition(n, 1, 5)), Literal("end"),
+        ])),
+        Rule("compound", Compound("<text> [please] | stop <n> [<n2>]",
+             extras=[Dictation("text"), n,
+                     Alternative([Literal("two")], name="n2")])),
+        Rule("lists", Sequence([ListRef("lst", lst),
+                                Optional(ListRef("lst2", lst)),
+                                DictListRef("dict", dict_list)])),
+        Rule("rule_ref", Sequence([
+            RuleRef(Rule("inner", Repetition(n, 0, 4))),
+            Literal("done"),
+        ])),
+    ]
+
+
+# Utterances and their dictated word positions.
+UTTERANCES = [
+    ("go end", ()),
+    ("go to one two end", ()),
+    ("go one one one one end", ()),
+    ("go one two three one end", ()),
+    ("hello please", (0,)),
+    ("hello world please", (0, 1)),
+    ("hello world", (0, 1)),
+    ("stop one two", ()),
+    ("stop two", ()),
+    ("hello world hello up", ()),
+    ("hello hello world down", ()),
+    ("hello world left", ()),
+    ("done", ()),
+    ("one two done", ()),
+    ("one two three one done", ()),
+]
+
+
+def build_backtracking_rule(length):
+    """
+        Build a rule which requires exponential backtracking to reject
+        utterances consisting only of the word "a".
+
+    """
+    word = Alternative([Literal("a"), Sequence([Literal("a"), Literal("a")])])
+    return Rule("backtracking", Sequence([Optional(word)] * length
+                                         + [Literal("end")]))
+
+
+# --------------------------------------------------------------------------
+
+class MemoizedDecodingTestCase(unittest.TestCase):
+    """ Tests for the memoizing decoding mode. """
+
+    def test_parse_trees(self):
+        """ Verify that memoized decoding builds identical parse trees. """
+        rules = build_rules()
+        for words, dictation in UTTERANCES:
+            results = words_rules(words, dictation)
+            for rule in rules:
+                expected = decode(rule, results)
+                self.assertEqual(decode(rule, results, memoize=True),
+                                 expected)
+
+    def test_grammar_memoize_decoding(self):
+        """ Verify that memoized decoding can be enabled per grammar. """
+        element = Sequence([Optional(Literal("hello")),
+                            Repetition(Literal("there"), 1, 10)])
+        tester = ElementTester(element)
+        self.assertFalse(tester.memoize_decoding)
+        tester.memoize_decoding = True
+        self.assertEqual(tester.recognize("hello there there"),
+                         ["hello", ["there", "there"]])
+        self.assertEqual(tester.recognize("hello hello"),
+                         RecognitionFailure)
+
+    def test_backtracking_benchmark(self):
+        """ Benchmark decode time against utterance length. """
+        for length in range(2, 10):
+            rule = build_backtracking_rule(length)
+            results = words_rules(" ".join(["a"] * length + ["stop"]))
+            default_time = time_decode(rule, results)
+            memoize_time = time_decode(rule, results, memoize=True)
+            _log.info("%d words: default %.2f ms, memoized %.2f ms",
+                      length + 1, default_time * 1000, memoize_time * 1000)
+
+        # The default decoding mode makes an exponential number of
+        #  attempts to reject the longest utterance.
+        default_attempts = count_attempts(rule, results)
+        memoize_attempts = count_attempts(rule, results, memoize=True)
+        self.assertLess(memoize_attempts * 10, default_attempts)
+
+    def test_memo_cleared(self):
+        """ Verify that the memo table is cleared between decodings. """
+        rule1 = Rule("rule1", Sequence([Literal("a"), Literal("b")]))
+        rule2 = Rule("rule2", Sequence([Literal("a"), Literal("c")]))
+        state = State(words_rules("a b"), ["rule1"], get_engine(),
+                      memoize=True)
+        for rule, expected in ((rule1, True), (rule2, False)):
+            state.initialize_decoding()
+            self.assertEqual(state._memo, {})
+            finished = any(state.finished() for _ in rule.decode(state))
+            self.assertEqual(finished, expected)
+            self.assertTrue(state._memo)
+
+
+# --------------------------------------------------------------------------
+
+class RepetitionDecodingTestCase(unittest.TestCase):
+    """ Tests for the decoding of Repetition elements. """
+
+    def test_limits(self):
+        """ Verify the numbers of repetitions allowed by each element. """
+        limits = [((1, None), [1]), ((3, None), [3]), ((1, 2), [1]),
+                  ((1, 3), [1, 2, 3]), ((2, 4), [2, 3, 4]),
+                  ((0, 2), [1, 2]), ((0, 3), [1, 2, 3])]
+        for (min, max), counts in limits:
+            element = Repetition(Literal("a"), min, max)
+            self.assertEqual(element.max_count, counts[-1])
+            tester = ElementTester(element)
+            recognized = [count for count in range(1, 6)
+                          if tester.recognize(" ".join(["a"] * count))
+                          is not RecognitionFailure]
+            self.assertEqual(recognized, counts)
+        self.assertRaises(ValueError, Repetition, Literal("a"), 0)
+
+    def test_flat_parse_tree(self):
+        """ Verify that repetitions are direct children of the element. """
+        child = Alternative([Literal("a"), Literal("b")])
+        element = Repetition(child, 1, 50)
+        self.assertIs(element.child, child)
+        rule = Rule("repetition", element)
+        state = State(words_rules("a b a"), [rule.name], get_engine())
+        state.initialize_decoding()
+        for _ in rule.decode(state):
+            if state.finished():
+                break
+        node = state.build_parse_tree().children[0]
+        self.assertEqual([c.words() for c in node.children],
+                         [["a"], ["b"], ["a"]])
+        self.assertEqual(element.get_repetitions(node), node.children)
+        self.assertEqual(node.value(), ["a", "b", "a"])
+
+    def test_children(self):
+        """ Verify that children are those of the expanded sequence. """
+        child = Literal("a")
+        element = Repetition(child, 1, 4)
+        self.assertEqual(element.children[0], child)
+        self.assertEqual(element.gstring(), "(a [(a [(a [a])])])")
+        self.assertEqual(Repetition(child, 0, 2).gstring(), "([(a [a])])")
+        self.assertEqual(Repetition(child, 2).gstring(), "(a a)")
+        for min, max in ((0, 3), (1, 2), (1, 4), (2, 5)):
+            element = Repetition(child, min, max)
+            self.assertEqual(element.get_expanded_sequence().gstring(),
+                             element.gstring())
+
+    def test_expanded_sequence(self):
+        """ Verify that expanded sequences match the same recognitions. """
+        child = Alternative([Literal("a"), Sequence([Literal("a"),
+                                                     Literal("b")])])
+        for min, max in ((0, 3), (1, 2), (1, 4), (2, 5)):
+            element = Repetition(child, min, max)
+            rule = Rule("repetition", Sequence([element,
+                                                Optional(Literal("b"))]))
+            expanded = Rule("expanded", Sequence([
+                element.get_expanded_sequence(), Optional(Literal("b"))
+            ]))
+            for words in ("a", "a b", "a a b", "a b a b", "a a a a b",
+                          "b", "a b b"):
+                results = words_rules(words)
+                self.assertEqual(decode(rule, results) is None,
+                                 decode(expanded, results) is None)
+                self.assertEqual(decode(rule, results, memoize=True),
+                                 decode(rule, results))
+                self.assertEqual(decode(rule, results, compiled=True),
+                                 decode(rule, results))
+
+    def test_long_repetition_benchmark(self):
+        """ Benchmark decoding of long repetitions. """
+        child = Alternative([Literal(w) for w in "one two three".split()])
+        element = Repetition(child, 1, 50)
+        rule = Rule("repetition", element)
+        expanded = Rule("expanded", element.get_expanded_sequence())
+        results = words_rules(" ".join(["one two three"] * 15))
+        repetition_time = time_decode(rule, results)
+        expanded_time = time_decode(expanded, results)
+        _log.info("45 repetitions: native %.2f ms, nested %.2f ms",
+                  repetition_time * 1000, expanded_time * 1000)
+        self.assertTrue(decode(rule, results))
+        self.assertLess(count_attempts(rule, results),
+                        count_attempts(expanded, results))
+
+
+# --------------------------------------------------------------------------
+
+class _ScanningState(State):
+    """ State which finds frames by scanning its stack. """
+
+    def _get_frame_from_depth(self):
+        for frame in reversed(self._stack):
+            if frame.depth == self._depth:
+                return frame
+        return None
+
+    def _get_frame_from_actor(self, actor):
+        for frame in reversed(self._stack):
+            if frame.actor is actor:
+                return frame
+        return None
+
+
+def parse_tree(rule, results, state_type=State):
+    """
+        Decode *results* using the given rule and return the root node of
+        the resulting parse tree, or *None* if decoding failed.
+
+    """
+    state = state_type(results, [rule.name], get_engine())
+    state.initialize_decoding()
+    for _ in rule.decode(state):
+        if state.finished():
+            return state.build_parse_tree()
+    return None
+
+
+def decode_nodes(rule, results, state_type=State):
+    """
+        Decode *results* using the given rule and return a list of the
+        nodes of the resulting parse tree, or *None* if decoding failed.
+
+        This function does not recurse, so it can be used for deep parse
+        trees.
+
+    """
+    root = parse_tree(rule, results, state_type)
+    if root is None:
+        return None
+    nodes = []
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        parent = node.parent.actor if node.parent else None
+        nodes.append((node.depth, node.actor, parent, node.begin, node.end))
+        pending.extend(reversed(node.children))
+    return nodes
+
+
+def build_nested_rule(depth):
+    """ Build a rule referencing a chain of *depth* nested rules. """
+    rule = Rule("nested0", Literal("end"))
+    for i in range(1, depth):
+        rule = Rule("nested%d" % i, Sequence([Optional(Literal("a")),
+                                              RuleRef(rule)]))
+    return rule
+
+
+class StateFrameTestCase(unittest.TestCase):
+    """ Tests for looking up the frames of the decoding stack. """
+
+    def test_parse_trees(self):
+        """ Verify that frame lookups build identical parse trees. """
+        rules = build_rules()
+        for words, dictation in UTTERANCES:
+            results = words_rules(words, dictation)
+            for rule in rules:
+                self.assertEqual(decode(rule, results),
+                                 decode(rule, results,
+                                        state_type=_ScanningState))
+
+    def test_nested_rules_benchmark(self):
+        """ Benchmark decoding of rules nested 200 levels deep. """
+        rule = build_nested_rule(200)
+        for count in (199, 100, 0):
+            results = words_rules(" ".join(["a"] * count + ["end"]))
+            start_time = time.time()
+            expected = decode_nodes(rule, results, _ScanningState)
+            scanning_time = time.time() - start_time
+            start_time = time.time()
+            nodes = decode_nodes(rule, results)
+            lookup_time = time.time() - start_time
+            self.assertTrue(expected)
+            self.assertEqual(nodes, expected)
+            _log.info("200 nested rules, %d words: lookup %.2f ms,"
+                      " scanning %.2f ms", count + 1, lookup_time * 1000,
+                      scanning_time * 1000)
+        self.assertLess(lookup_time, scanning_time)
+
+
+# --------------------------------------------------------------------------
+
+class _WordByWordLiteral(Literal):
+    """ Literal element which compares each word separately. """
+
+    def decode(self, state):
+        state.decode_attempt(self)
+        words = self.words
+        for i in range(len(words)):
+            word = state.word(i)
+            if word:
+                word = word.lower()
+            if word != words[i].lower():
+                state.decode_failure(self)
+                return
+        state.next(len(words))
+        state.decode_success(self)
+        yield state
+        state.decode_retry(self)
+        state.decode_failure(self)
+
+
+class LiteralDecodingTestCase(unittest.TestCase):
+    """ Tests for the decoding of Literal elements. """
+
+    def test_lower_words(self):
+        """ Verify that words are compared case-insensitively. """
+        element = Literal("Hello World")
+        self.assertEqual(element.lower_words, ("hello", "world"))
+        self.assertEqual(element.lower_words_ext, ("hello", "world"))
+        rule = Rule("literal", element)
+        for words in ("hello world", "HELLO world", "Hello World"):
+            self.assertTrue(decode(rule, words_rules(words)))
+        for words in ("hello", "hello there", "hello world again"):
+            self.assertEqual(decode(rule, words_rules(words)), None)
+
+    def test_quoted_words(self):
+        """ Verify the lowercase words of literals with quoted words. """
+        element = Literal('say "New York" now', quote_start_str='"',
+                          quote_end_str='"', strip_quote_strs=True)
+        self.assertEqual(element.lower_words, ("say", "new", "york", "now"))
+        self.assertEqual(element.lower_words_ext, ("say", "new york", "now"))
+
+    def test_state_lower_words(self):
+        """ Verify that states lowercase recognized words once. """
+        state = State(words_rules("Hello WORLD"), [], get_engine())
+        self.assertEqual(state.lower_words, ("hello", "world"))
+        self.assertIs(state.lower_words, state.lower_words)
+
+    def test_literal_benchmark(self):
+        """ Benchmark decoding of long literals. """
+        text = " ".join(["Alpha Bravo Charlie"] * 10)
+        results = words_rules(text.upper())
+        rule = Rule("literal", Alternative([Literal(text + " end")] * 100
+                                           + [Literal(text)]))
+        word_rule = Rule("word", Alternative(
+            [_WordByWordLiteral(text + " end")] * 100
+            + [_WordByWordLiteral(text)]
+        ))
+        self.assertTrue(decode(rule, results))
+        self.assertTrue(decode(word_rule, results))
+        literal_time = min(time_decode(rule, results) for _ in range(5))
+        word_time = min(time_decode(word_rule, results) for _ in range(5))
+        _log.info("30-word literals: tuples %.2f ms, word by word %.2f ms",
+                  literal_time * 1000, word_time * 1000)
+        self.assertLess(literal_time, word_time)
+
+
+# --------------------------------------------------------------------------
+
+class ListTrieTestCase(unittest.TestCase):
+    """ Tests for matching list items using word tries. """
+
+    def test_item_lengths(self):
+        """ Verify that list items are matched longest first. """
+        lst = List("lst", ["a", "a b", "a b c", "b", "x  y"])
+        self.assertEqual(lst.get_item_lengths(["a", "b", "c", "d"]),
+                         [3, 2, 1])
+        self.assertEqual(lst.get_item_lengths(["a", "c"]), [1])
+        self.assertEqual(lst.get_item_lengths(["c"]), [])
+        self.assertEqual(lst.get_item_lengths([]), [])
+
+        # Recognized words may contain spaces.
+        self.assertEqual(lst.get_item_lengths(["a b", "c"]), [2, 1])
+        self.assertEqual(lst.get_item_lengths(["x", "", "y"]), [3])
+        self.assertEqual(lst.get_item_lengths(["x", "y"]), [])
+
+    def test_list_modification(self):
+        """ Verify that list tries are rebuilt after modifications. """
+        lst = List("lst", ["a"])
+        self.assertEqual(lst.get_item_lengths(["a", "b"]), [1])
+        lst.append("a b")
+        self.assertEqual(lst.get_item_lengths(["a", "b"]), [2, 1])
+        lst.remove("a")
+        self.assertEqual(lst.get_item_lengths(["a", "b"]), [2])
+        with lst:
+            lst.append("a")
+            self.assertEqual(lst.get_item_lengths(["a", "b"]), [2, 1])
+
+        dict_list = DictList("dict", {"up": 1})
+        self.assertEqual(dict_list.get_item_lengths(["up", "left"]), [1])
+        dict_list["up left"] = 2
+        self.assertEqual(dict_list.get_item_lengths(["up", "left"]), [2, 1])
+        del dict_list["up"]
+        self.assertEqual(dict_list.get_item_lengths(["up", "left"]), [2])
+
+    def test_decode(self):
+        """ Verify that list references decode longest items first. """
+        lst = List("lst", ["a", "a b"])
+        dict_list = DictList("dict", {"b": 1, "b c": 2})
+        element = Sequence([ListRef("lst", lst), Optional(Literal("b")),
+                            Optional(DictListRef("dict", dict_list))])
+        tester = ElementTester(element)
+        self.assertEqual(tester.recognize("a b"), ["a b", None, None])
+        self.assertEqual(tester.recognize("a b b"), ["a b", "b", None])
+        self.assertEqual(tester.recognize("a b b c"), ["a b", None, 2])
+        self.assertEqual(tester.recognize("a b c"), ["a", None, 2])
+
+    def test_large_list_benchmark(self):
+        """ Benchmark decoding of list references to large lists. """
+        count = 100000
+        items = ["item number %d" % i for i in range(count)]
+        lst = List("lst", items)
+        dict_list = DictList("dict", dict((item, i)
+                                          for i, item in enumerate(items)))
+        words = ("item number %d" % (count - 1)).split()
+
+        start_time = time.time()
+        lst.get_word_trie()
+        dict_list.get_word_trie()
+        build_time = time.time() - start_time
+
+        start_time = time.time()
+        for _ in range(100):
+            self.assertEqual(lst.get_item_lengths(words), [3])
+            self.assertEqual(dict_list.get_item_lengths(words), [3])
+        trie_time = time.time() - start_time
+
+        # Testing each prefix for membership was the previous approach.
+        start_time = time.time()
+        for _ in range(100):
+            for i in range(1, len(words) + 1):
+                " ".join(words[:i]) in lst
+        scan_time = time.time() - start_time
+
+        _log.info("%d items: trie build %.2f ms, 100 trie lookups %.2f ms,"
+                  " 100 list scans %.2f ms", count, build_time * 1000,
+                  trie_time * 1000, scan_time * 1000)
+        self.assertLess(trie_time, scan_time)
+
+        rule = Rule("lists", Sequence([ListRef("lst", lst),
+                                       DictListRef("dict", dict_list)]))
+        results = words_rules(" ".join(words * 2))
+        self.assertTrue(decode(rule, results))
+        self.assertTrue(decode(rule, results, compiled=True))
+
+
+# --------------------------------------------------------------------------
+
+class CompiledDecodingTestCase(unittest.TestCase):
+    """ Tests for the compiled decoding mode. """
+
+    def test_parse_trees(self):
+        """ Verify that compiled decoding builds identical parse trees. """
+        rules = build_rules()
+        for words, dictation in UTTERANCES:
+            results = words_rules(words, dictation)
+            for rule in rules:
+                expected = decode(rule, results)
+                self.assertEqual(decode(rule, results, compiled=True),
+                                 expected)
+
+    def test_list_items(self):
+        """ Verify that list items of different lengths are matched. """
+        lst = List("lst", ["a", "a b", "a b c"])
+        rule = Rule("lists", Sequence([Repetition(ListRef("lst", lst),
+                                                  1, 4),
+                                       Literal("end")]))
+        for words in ("a end", "a b end", "a a b c end", "a b a end",
+                      "a b c a b end", "b end"):
+            results = words_rules(words)
+            expected = decode(rule, results)
+            self.assertEqual(decode(rule, results, compiled=True),
+                             expected)
+        self.assertEqual(decode(rule, words_rules("a b c a b end")).count(
+                         "ListRef"), 2)
+
+    def test_recursive_rules(self):
+        """ Verify that recursive rules are compiled. """
+        # pylint: disable=protected-access
+        rule = Rule("recursive")
+        rule._element = Alternative([
+            Sequence([Literal("open"), RuleRef(rule), Literal("close")]),
+            Literal("x"),
+        ])
+        for words in ("x", "open x close", "open open x close close",
+                      "open x", "close"):
+            results = words_rules(words)
+            expected = decode(rule, results)
+            self.assertEqual(decode(rule, results, compiled=True),
+                             expected)
+
+        # Left recursive rules cannot be decoded normally, but must not
+        #  loop forever.
+        rule = Rule("left_recursive")
+        rule._element = Alternative([Sequence([RuleRef(rule), Literal("a")]),
+                                     Literal("a")])
+        self.assertTrue(decode(rule, words_rules("a a"), compiled=True))
+        self.assertEqual(decode(rule, words_rules("a b"), compiled=True),
+                         None)
+
+    def test_overridden_decode(self):
+        """ Verify that rules with overridden decoding are not compiled. """
+        class Custom(Literal):
+            def decode(self, state):
+                for result in Literal.decode(self, state):
+                    yield result
+
+        custom = Rule("custom", Sequence([Literal("a"), Custom("b")]))
+        referencing = Rule("referencing", RuleRef(custom))
+        plain = Rule("plain", Literal("a"))
+        decoder = CompiledDecoder([referencing, plain])
+        self.assertFalse(decoder.is_compiled(custom))
+        self.assertFalse(decoder.is_compiled(referencing))
+        self.assertTrue(decoder.is_compiled(plain))
+        results = words_rules("a b")
+        self.assertEqual(decode(referencing, results, compiled=True),
+                         decode(referencing, results))
+
+    def test_grammar_compiled_decoding(self):
+        """ Verify that compiled decoding can be enabled per grammar. """
+        element = Sequence([Optional(Literal("hello")),
+                            Repetition(Literal("there"), 1, 10)])
+        tester = ElementTester(element)
+        self.assertFalse(tester.compiled_decoding)
+        tester.compiled_decoding = True
+        self.assertEqual(tester.recognize("hello there there"),
+                         ["hello", ["there", "there"]])
+        self.assertEqual(tester.recognize("hello hello"),
+                         RecognitionFailure)
+
+    def test_backtracking_benchmark(self):
+        """ Benchmark compiled decode time against utterance length. """
+        for length in range(2, 10):
+            rule = build_backtracking_rule(length)
+            results = words_rules(" ".join(["a"] * length + ["stop"]))
+            default_time = time_decode(rule, results)
+            compiled_time = time_decode(rule, results, compiled=True)
+            _log.info("%d words: default %.2f ms, compiled %.2f ms",
+                      length + 1, default_time * 1000, compiled_time * 1000)
+        self.assertLess(compiled_time, default_time)
+
+
+# --------------------------------------------------------------------------
+
+class FirstWordIndexTestCase(unittest.TestCase):
+    """ Tests for selecting candidate rules by their first words. """
+
+    def setUp(self):
+        self.grammar = Grammar("first_words")
+        self.lst = List("lst", ["hello world", "Bye"])
+        self.rules = [
+            Rule("literal", Literal("Go home"), exported=True),
+            Rule("optional", Sequence([Optional(Literal("please")),
+                                       Literal("stop")]), exported=True),
+            Rule("list", ListRef("lst", self.lst), exported=True),
+            Rule("dictation", Sequence([Literal("say"), Dictation("text")]),
+                 exported=True),
+            Rule("wildcard", Sequence([Dictation("text"), Literal("now")]),
+                 exported=True),
+            Rule("empty", Optional(Literal("maybe")), exported=True),
+            Rule("impossible", Impossible(), exported=True),
+        ]
+        for rule in self.rules:
+            self.grammar.add_rule(rule)
+        self.grammar.load()
+
+    def tearDown(self):
+        self.grammar.unload()
+
+    def candidates(self, words):
+        rules = self.grammar.get_candidate_rules(words.split())
+        return [rule.name for rule in rules]
+
+    def test_first_words(self):
+        """ Verify the first words of elements. """
+        memo = {}
+        self.assertEqual(Literal("Go home").first_words(memo),
+                         (set(["go"]), False))
+        self.assertEqual(Empty().first_words(memo), (set(), True))
+        self.assertEqual(Impossible().first_words(memo), (set(), False))
+        self.assertEqual(Dictation().first_words(memo), (None, False))
+        self.assertEqual(Repetition(Literal("a"), 0, 3).first_words(memo),
+                         (set(["a"]), True))
+        element = Alternative([Literal("a"), Sequence([
+            Optional(Literal("b")), RuleRef(Rule("c", Literal("c"))),
+            Literal("d")
+        ])])
+        self.assertEqual(element.first_words(memo),
+                         (set(["a", "b", "c"]), False))
+        self.assertEqual(ListRef("lst", self.lst).first_words(memo),
+                         (set([ListFirstWords(self.lst)]), False))
+
+    def test_recursive_rule(self):
+        """ Verify that recursive rules are handled conservatively. """
+        # pylint: disable=protected-access
+        rule = Rule("recursive", exported=True)
+        rule._element = Alternative([Literal("a"),
+                                     Sequence([Literal("b"), RuleRef(rule)])])
+        self.assertEqual(rule.first_words({}), (set(["a", "b"]), False))
+        rule = Rule("recursive", exported=True)
+        rule._element = Sequence([Optional(Literal("a")), RuleRef(rule)])
+        self.assertEqual(rule.first_words({}), (None, True))
+
+    def test_candidate_rules(self):
+        """ Verify that candidate rules are selected in grammar order. """
+        self.assertEqual(self.candidates("go home"),
+                         ["literal", "wildcard", "empty"])
+        self.assertEqual(self.candidates("Please stop"),
+                         ["optional", "wildcard", "empty"])
+        self.assertEqual(self.candidates("stop"),
+                         ["optional", "wildcard", "empty"])
+        self.assertEqual(self.candidates("hello world"),
+                         ["list", "wildcard", "empty"])
+        self.assertEqual(self.candidates("Bye"),
+                         ["list", "wildcard", "empty"])
+        self.assertEqual(self.candidates("bye"), ["wildcard", "empty"])
+        self.assertEqual(self.candidates("unknown"), ["wildcard", "empty"])
+        self.assertEqual(self.candidates(""), [r.name for r in self.rules])
+
+    def test_list_update(self):
+        """ Verify that list modifications update candidate rules. """
+        self.assertEqual(self.candidates("goodbye"), ["wildcard", "empty"])
+        self.lst.append("goodbye")
+        self.assertEqual(self.candidates("goodbye"),
+                         ["list", "wildcard", "empty"])
+        self.lst.remove("goodbye")
+        self.assertEqual(self.candidates("goodbye"), ["wildcard", "empty"])
+
+        # List modifications do not rebuild the index.
+        # pylint: disable=protected-access
+        index = self.grammar._first_word_index
+        self.lst.extend(["see you", "later"])
+        self.assertEqual(self.candidates("see"),
+                         ["list", "wildcard", "empty"])
+        self.assertIs(self.grammar._first_word_index, index)
+
+    def test_duplicate_candidates(self):
+        """ Verify that rules are returned once per recognition. """
+        rule = Rule("both", Alternative([Literal("hello"),
+                                         ListRef("lst", self.lst)]),
+                    exported=True)
+        self.grammar.unload()
+        self.grammar.add_rule(rule)
+        self.grammar.load()
+        self.assertEqual(self.candidates("hello"),
+                         ["list", "wildcard", "empty", "both"])
+
+    def test_mimic(self):
+        """ Verify that recognitions are processed by candidate rules. """
+        engine = get_engine()
+        engine.mimic("go home")
+        engine.mimic("please stop")
+        engine.mimic("say HELLO THERE")
+        engine.mimic("hello world")
+        engine.mimic("HELLO now")
+        self.assertRaises(MimicFailure, engine.mimic, "go")
+
+
+# --------------------------------------------------------------------------
+
+class _CountingLiteral(Literal):
+    """ Literal element which counts calls to its value() method. """
+
+    def __init__(self, *args, **kwargs):
+        Literal.__init__(self, *args, **kwargs)
+        self.value_calls = 0
+
+    def value(self, node):
+        self.value_calls += 1
+        return Literal.value(self, node)
+
+
+class ParseTreeNodeTestCase(unittest.TestCase):
+    """ Tests for collecting extras from parse tree nodes. """
+
+    def test_named_children(self):
+        """ Verify that named children match lookups by name. """
+        for words, dictation in UTTERANCES:
+            results = words_rules(words, dictation)
+            for rule in build_rules():
+                root = parse_tree(rule, results)
+                if root is None:
+                    continue
+                nodes = [root]
+                for node in nodes:
+                    nodes.extend(node.children)
+                names = set(node.name for node in nodes if node.name)
+                for node in nodes:
+                    for shallow in (True, False):
+                        named = node.get_named_children(shallow)
+                        for name in names:
+                            self.assertIs(named.get(name),
+                                          node.get_child_by_name(name,
+                                                                 shallow))
+
+    def test_extras(self):
+        """ Verify the values and defaults of extras. """
+        n = Alternative([Literal("one", value=1), Literal("two", value=2)],
+                        name="n")
+        m = Alternative([Literal("three", value=3)], name="m", default=0)
+        k = Alternative([Literal("four")], name="k")
+        rule = Rule("extras", Compound("<n> [<m>] [<k>] | <m> <n>",
+                                       extras=[n, m, k]))
+        extras = {"n": n, "m": m, "k": k}
+        root = parse_tree(rule, words_rules("two three"))
+        self.assertEqual(root.get_extras(extras), {"n": 2, "m": 3})
+        root = parse_tree(rule, words_rules("one"))
+        self.assertEqual(root.get_extras(extras, {"_node": root}),
+                         {"_node": root, "n": 1, "m": 0})
+
+    def test_value_cache(self):
+        """ Verify that node values are computed once. """
+        element = _CountingLiteral("hello")
+        rule = Rule("cache", Sequence([element, Optional(element)]))
+        root = parse_tree(rule, words_rules("hello hello"))
+        self.assertEqual(root.value(), ["hello", "hello"])
+        self.assertEqual(root.value(), ["hello", "hello"])
+        self.assertEqual(element.value_calls, 2)
+
+    def test_mutable_values(self):
+        """ Verify that mutable node values are not shared by callers. """
+        element = Repetition(Literal("hello"), 1, 5, name="rep")
+        rule = Rule("mutable", Sequence([element, Literal("there")]))
+        root = parse_tree(rule, words_rules("hello hello there"))
+        extras = root.get_extras({"rep": element})
+        extras["rep"].append("modified")
+        value = root.value()
+        self.assertEqual(value, [["hello", "hello"], "there"])
+        value[0].append("modified")
+        self.assertEqual(root.value(), [["hello", "hello"], "there"])
+        self.assertEqual(root.get_extras({"rep": element}),
+                         {"rep": ["hello", "hello"]})
+
+    def test_extras_benchmark(self):
+        """ Benchmark collecting the values of 20 extras. """
+        names = ["extra%d" % i for i in range(20)]
+        extras = dict((name, Alternative([Literal("word%d" % i)],
+                                         name=name))
+                      for i, name in enumerate(names))
+        spec = "start " + " ".join("<%s>" % name for name in names)
+        rule = Rule("benchmark", Compound(spec, extras=list(extras.values())))
+        words = "start " + " ".join("word%d" % i for i in range(20))
+        root = parse_tree(rule, words_rules(words))
+
+        def get_extras_by_name():
+            values = {}
+            for name in extras:
+                extra_node = root.get_child_by_name(name, shallow=True)
+                if extra_node:
+                    values[name] = extra_node.value()
+            return values
+
+        self.assertEqual(root.get_extras(extras), get_extras_by_name())
+        single_pass_time = by_name_time = float("inf")
+        for _ in range(5):
+            start_time = time.time()
+            for _ in range(100):
+                root.get_extras(extras)
+            single_pass_time = min(single_pass_time,
+                                   time.time() - start_time)
+            start_time = time.time()
+            for _ in range(100):
+                get_extras_by_name()
+            by_name_time = min(by_name_time, time.time() - start_time)
+        _log.info("100 x 20 extras: single pass %.2f ms, by name %.2f ms",
+                  single_pass_time * 1000, by_name_time * 1000)
+        self.assertLess(single_pass_time, by_name_time)
+
+
+# ==========================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,176 @@
+#
+# This file is part of Dragonfly.
+# (c) Copyright 2007, 2008 by Christo Butcher
+# Licensed under the LGPL.
+#
+#   Dragonfly is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU Lesser General Public License as published
+#   by the Free Software Foundation, either version 3 of the License, or
+#   (at your option) any later version.
+#
+#   Dragonfly is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranty of
+#   MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU
+#   Lesser General Public License for more details.
+#
+#   You should have received a copy of the GNU Lesser General Public
+#   License along with Dragonfly.  If not, see
+#   <http://www.gnu.org/licenses/>.
+#
+
+"""
+Tests for the list deltas passed to grammars when lists are modified.
+"""
+
+import unittest
+
+from dragonfly import List, DictList
+from dragonfly.grammar.list import ListDelta
+
+
+# --------------------------------------------------------------------------
+
+class RecordingGrammar(object):
+    """ Grammar stand-in which records list updates. """
+
+    def __init__(self):
+        self.updates = []
+
+    def update_list(self, lst, delta=None):
+        if delta is None:
+            self.updates.append(None)
+        else:
+            self.updates.append((sorted(delta.added),
+                                 sorted(delta.removed)))
+
+
+def build_trie(items):
+    """ Build the word trie of a new list with the given items. """
+    return List("trie", items).get_word_trie()
+
+
+# --------------------------------------------------------------------------
+
+class ListDeltaTestCase(unittest.TestCase):
+    """ Tests for the ListDelta class. """
+
+    def test_record(self):
+        delta = ListDelta(["a", "b", "b"], ["c"])
+        self.assertEqual(sorted(delta.added), ["a", "b", "b"])
+        self.assertEqual(delta.removed, ["c"])
+        self.assertTrue(delta)
+
+    def test_cancel(self):
+        delta = ListDelta(["a", "b"])
+        delta.merge(ListDelta(["c"], ["a"]))
+        delta.merge(ListDelta(["b"], ["b"]))
+        self.assertEqual(sorted(delta.added), ["b", "c"])
+        self.assertEqual(delta.removed, [])
+        delta.merge(ListDelta(removed=["b", "c", "d"]))
+        self.assertEqual(delta.added, [])
+        self.assertEqual(delta.removed, ["d"])
+        delta.merge(ListDelta(["d"]))
+        self.assertFalse(delta)
+
+
+class ListUpdateTestCase(unittest.TestCase):
+    """ Tests for the deltas of List and DictList modifications. """
+
+    def setUp(self):
+        self.grammar = RecordingGrammar()
+
+    def new_list(self, items):
+        lst = List("list", items)
+        lst.grammar = self.grammar
+        return lst
+
+    def new_dict_list(self, items):
+        lst = DictList("dict_list", items)
+        lst.grammar = self.grammar
+        return lst
+
+    def test_list_methods(self):
+        lst = self.new_list(["a", "b"])
+        lst.append("c")
+        lst.extend(iter(["d", "e"]))
+        lst.insert(0, "f")
+        lst.remove("a")
+        lst.pop()
+        lst[0] = "g"
+        lst[1:3] = iter(["h"])
+        del lst[0]
+        lst += ["i"]
+        lst.sort()
+        lst.reverse()
+        self.assertEqual(lst, ["i", "h", "d"])
+        self.assertEqual(self.grammar.updates, [
+            (["c"], []), (["d", "e"], []), (["f"], []), ([], ["a"]),
+            ([], ["e"]), (["g"], ["f"]), (["h"], ["b", "c"]), ([], ["g"]),
+            (["i"], []), ([], []), ([], []),
+        ])
+
+    def test_list_multiply(self):
+        lst = self.new_list(["a", "b"])
+        lst *= 2
+        lst *= 0
+        self.assertEqual(self.grammar.updates, [
+            (["a", "b"], []), ([], ["a", "a", "b", "b"]),
+        ])
+
+    def test_dict_list_methods(self):
+        lst = self.new_dict_list({"a": 1, "b": 2})
+        lst["a"] = 3
+        lst["c"] = 4
+        lst.update({"c": 5, "d": 6}, e=7)
+        lst.setdefault("a", 8)
+        lst.setdefault("f", 9)
+        del lst["b"]
+        lst.pop("x", None)
+        lst.pop("a")
+        self.assertEqual(self.grammar.updates, [
+            ([], []), (["c"], []), (["d", "e"], []), ([], []), (["f"], []),
+            ([], ["b"]), ([], []), ([], ["a"]),
+        ])
+        lst.clear()
+        self.assertEqual(self.grammar.updates[-1],
+                         ([], ["c", "d", "e", "f"]))
+
+    def test_batch_updates(self):
+        lst = self.new_list(["a", "b"])
+        with lst:
+            lst.append("c")
+            lst.remove("a")
+            lst.append("a")
+            lst.remove("b")
+        self.assertEqual(self.grammar.updates, [(["c"], ["b"])])
+        lst.set(["c", "d"])
+        self.assertEqual(self.grammar.updates[-1], (["d"], ["a"]))
+
+    def test_invalid_items(self):
+        # Invalid items are reported with a full update.
+        lst = self.new_list(["a"])
+        self.assertRaises(TypeError, lst.append, 1)
+        self.assertEqual(self.grammar.updates, [])
+        lst.remove(1)
+        self.assertEqual(self.grammar.updates, [None])
+
+    def test_word_trie(self):
+        lst = self.new_list(["a b", "a", "c"])
+        lst.get_word_trie()
+        lst.append("a b c")
+        lst.append("a b")
+        lst.remove("a b")
+        self.assertEqual(lst.get_word_trie(), build_trie(lst))
+        self.assertEqual(lst.get_item_lengths(["a", "b", "c"]), [3, 2, 1])
+        lst.remove("a b")
+        lst.remove("a b c")
+        self.assertEqual(lst.get_item_lengths(["a", "b", "c"]), [1])
+        lst.set(["x y", "z"])
+        self.assertEqual(lst.get_item_lengths(["x", "y"]), [2])
+        self.assertEqual(lst.get_item_lengths(["a"]), [])
+
+
+# ==========================================================================
+
+if __name__ == "__main__":
+    unittest.main()
@@ -1,13 +1,26 @@
 # coding=utf-8
 
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
 import unittest
 import string
 
-from dragonfly.parsing.parse import spec_parser, CompoundTransformer
+import dragonfly
+
+from dragonfly.parsing.parse import (spec_parser, spec_parse_cache,
+                                     CompoundTransformer, SpecParseCache,
+                                     LazySpecParser, build_spec_parser,
+                                     load_spec_parser, save_spec_parser)
 from dragonfly import Compound, Literal, Sequence, Optional, Empty, Alternative
 
 # ===========================================================================
 
+package_directory = os.path.dirname(os.path.abspath(dragonfly.__file__))
+
 extras = {"an_extra": Alternative([Literal(u"1"), Literal(u"2")])}
 
 
@@ -113,6 +126,101 @@ class TestLarkParser(unittest.TestCase):
         assert getattr(output.children[2], 'test_special', None) == None
 
 
+class TestSpecParseCache(unittest.TestCase):
+    def test_hits_and_misses(self):
+        cache = SpecParseCache(spec_parser)
+        tree = cache.parse("test <an_extra> [op]")
+        assert (cache.hits, cache.misses) == (0, 1)
+        assert cache.parse("test <an_extra> [op]") is tree
+        assert (cache.hits, cache.misses) == (1, 1)
+        cache.parse("test")
+        assert (cache.hits, cache.misses, cache.currsize) == (1, 2, 2)
+        cache.clear()
+        assert (cache.hits, cache.misses, cache.currsize) == (0, 0, 0)
+
+    def test_least_recently_used(self):
+        cache = SpecParseCache(spec_parser, maxsize=2)
+        first = cache.parse("first")
+        cache.parse("second")
+        assert cache.parse("first") is first
+        cache.parse("third")
+        assert cache.currsize == 2
+        assert cache.parse("first") is first
+        cache.parse("second")
+        assert (cache.hits, cache.misses) == (2, 4)
+
+    def test_parse_errors_not_stored(self):
+        cache = SpecParseCache(spec_parser)
+        self.assertRaises(Exception, cache.parse, "test [")
+        assert (cache.currsize, cache.misses) == (0, 1)
+
+    def test_shared_trees(self):
+        # Compound elements with the same spec share parse trees but
+        #  not elements.
+        hits = spec_parse_cache.hits
+        first = Compound("shared spec <an_extra>", extras=extras)
+        second = Compound("shared spec <an_extra>", extras=extras)
+        assert spec_parse_cache.hits > hits
+        assert first.children[0] is not second.children[0]
+        assert (first.element_tree_string()
+                == second.element_tree_string())
+
+
+class TestLazySpecParser(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "grammar.lark.bin")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_lazy_construction(self):
+        parser = LazySpecParser(self.path)
+        assert not parser.loaded
+        tree = parser.parse("test <an_extra> [op]")
+        assert parser.loaded
+        assert tree == build_spec_parser().parse("test <an_extra> [op]")
+
+    def test_precompiled_parser(self):
+        assert load_spec_parser(self.path) is None
+        save_spec_parser(self.path)
+        parser = load_spec_parser(self.path)
+        for spec in ["test", "(a | b) [<an_extra>] {weight=2}"]:
+            assert parser.parse(spec) == build_spec_parser().parse(spec)
+
+    def test_invalid_precompiled_parser(self):
+        with open(self.path, "wb") as f:
+            f.write(b"invalid")
+        logging.disable(logging.WARNING)
+        try:
+            assert load_spec_parser(self.path) is None
+        finally:
+            logging.disable(logging.NOTSET)
+        assert LazySpecParser(self.path).parse("test") is not None
+
+    def test_shipped_precompiled_parser(self):
+        # The precompiled parser shipped with the package should be up to
+        #  date with the grammar file and the installed Lark version.
+        assert load_spec_parser() is not None
+
+    def test_import_loads_precompiled_parser(self):
+        # Import the parsing module in a new process and check that the
+        #  parser is not constructed on import, then that it is loaded
+        #  from the precompiled file instead of being built on first use.
+        code = ("from dragonfly.parsing import parse; "
+                "assert not parse.spec_parser.loaded; "
+                "parse.build_spec_parser = None; "
+                "parse.spec_parser.parse('test <an_extra> [op]'); "
+                "assert parse.spec_parser.loaded")
+        process = subprocess.Popen([sys.executable, "-c", code],
+                                   stdout=subprocess.PIPE,
+                                   stderr=subprocess.PIPE,
+                                   universal_newlines=True,
+                                   cwd=os.path.dirname(package_directory))
+        _, stderr = process.communicate()
+        assert process.returncode == 0, stderr
+
+
 # ===========================================================================
 
 if __name__ == "__main__":